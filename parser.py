@@ -3,13 +3,24 @@ import logging
 import sys
 import importlib
 import os
+import unicodedata
 from parser.helper import infer_edition_from_url, get_html_tree_from_string, get_html_tree_from_url
 
 if sys.version_info[0:3] >= (3, 0, 0):  # python 3 (tested)
-    from zim.zimpy_p3 import ZimFile
+    from zim.zimpy_p3 import ZimFile, open_zim, html_mimetypes
+    from zim.pack import PackFile, is_pack
 else:  # python 2 (not tested)
     from zim.zimpy_p2 import ZimFile
 
+    def open_zim(filename, use_mmap=False, **kwargs):
+        return ZimFile(filename=filename)
+
+    def is_pack(filename):
+        return False
+
+    def html_mimetypes(mime_types):
+        return None
+
 
 def setup_logger():
     if not os.path.exists('log/'):
@@ -48,25 +59,171 @@ def get_parser(edition):
     return parsers[edition]()
 
 
-def read_zim_file(file):
+def read_zim_file(file, workers=1, directory=None, clusters=None, reader=None):
     # print(file.metadata())
     # we only need main articles. They are in namespace 'A'.
+    # Walk them cluster by cluster so that every cluster is decompressed once,
+    # and only the html pages among them, so that the clusters of images,
+    # stylesheets and scripts are never decompressed.
     namespace = b'A'
-    for article in file.articles():
-        if article['namespace'] != namespace:
-            continue
-        body = file.get_article_by_index(
-            article['index'], follow_redirect=False)[0]
-        if not body:
+    mimetypes = html_mimetypes(file.mimeTypeList)
+    pool = None
+    if reader is None and workers == 1:
+        reader = file
+    elif reader is None:
+        from zim.parallel import ParallelClusterReader
+        reader = pool = ParallelClusterReader(file, workers=workers)
+    try:
+        blobs = reader.iter_blobs_by_cluster(namespace=namespace, directory=directory, clusters=clusters,
+                                             mimetypes=mimetypes)
+        for entry, body in blobs:
+            if not body:
+                continue
+            else:
+                # str() also decodes the memoryview blobs of the mmap reader
+                yield entry, str(body, 'utf-8')
+    finally:
+        # stop the worker processes, also when the pages are not all read
+        if pool is not None:
+            pool.close()
+
+
+def word_url(word):
+    """The url of the page of word in a zim file of Wiktionary"""
+    url = unicodedata.normalize('NFC', word.strip()).replace(' ', '_')
+    return url if url.endswith('.html') else url + '.html'
+
+
+def read_word_list(filename):
+    """Reads one word per line, skipping blank lines"""
+    with open(filename, encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def find_words(file, words):
+    """Looks words up in one pass over the url list of the zim file. Returns
+    the entries of their pages, each once, and {ZIM index of a page: [words
+    redirecting to it]}."""
+    urls = {}
+    for word in words:
+        urls.setdefault(word_url(word), word)
+    found = file.match_urls(b'A', urls)
+    logging.info("Found {} of {} words".format(len(found), len(urls)))
+    entries = {}
+    redirected = {}
+    for url, index in sorted(found.items(), key=lambda item: item[1]):
+        try:
+            entry = file.resolve_entry(index)
+        except IOError as e:
+            logging.warning("Skipping {}: {}".format(urls[url], e))
             continue
+        entries[entry['index']] = entry
+        if entry['index'] != index:
+            redirected.setdefault(entry['index'], []).append(urls[url])
+    return list(entries.values()), redirected
+
+
+def read_zim_entries(file, entries, reader=None):
+    """Like read_zim_file, for the html pages of entries only"""
+    if reader is None:
+        reader = file
+    for entry, body in reader.iter_blobs_of_entries(entries, mimetypes=html_mimetypes(file.mimeTypeList)):
+        if body:
+            yield entry, str(body, 'utf-8')
+
+
+def alias_headword(alias):
+    """The headword of a redirect, from its title (or its url without .html)"""
+    return alias[:-5] if alias.endswith('.html') else alias
+
+
+def open_input(filename, use_mmap=False, **kwargs):
+    """Opens a zim file, or a pack of some of its articles"""
+    if is_pack(filename):
+        return PackFile(filename, **kwargs)
+    return open_zim(filename, use_mmap=use_mmap, **kwargs)
+
+
+def print_cache_stats(file):
+    """Print the cluster cache statistics of the zim file to stderr"""
+    stats = file.clusterCache.stats()
+    print("Cluster cache: {hits} hits, {misses} misses, {evictions} evictions, "
+          "{entries} clusters / {bytes} bytes held (limit {max_bytes}), "
+          "{decompress_time:.2f}s decompressing; {clusters_loaded} clusters loaded, "
+          "at most {max_loads_per_cluster} time(s) each".format(**stats), file=sys.stderr)
+    if hasattr(file.f, 'stats'):
+        # a zim file read over HTTP
+        print("HTTP: {requests} range requests, {bytes_fetched} bytes fetched, {hits} block hits, "
+              "{misses} misses".format(**file.f.stats()), file=sys.stderr)
+
+
+def print_prefetch_stats(prefetcher):
+    """Print how often parsing waited for the prefetch thread to stderr"""
+    print("Prefetch: {clusters} clusters read up to {depth} ahead, {stalls} stalls, "
+          "{stall_time:.2f}s waiting".format(**prefetcher.stats()), file=sys.stderr)
+
+
+def print_spill_stats(spill):
+    """Print how much decompression the spill cache saved to stderr"""
+    print("Spill cache: {hits} hits, {misses} misses ({hit_rate:.0%} hit rate), {uncompressed} uncompressed "
+          "clusters read directly, {bytes_saved} bytes not decompressed again ({time_saved:.2f}s saved), "
+          "{bytes_written} bytes written; "
+          "{files} clusters / {bytes} bytes on disk (limit {max_bytes})".format(**spill.stats()), file=sys.stderr)
+
+
+def parse_zim(filename, edition=None, use_mmap=False, workers=1, cache_bytes=64 << 20, cache_policy='lru',
+              stats=False, use_index=False, aliases=False, shard=None, prefetch=4, spill=None, spill_bytes=4 << 30,
+              words=None, sample=None, strata=1, seed=0):
+    """Parse html in zim file (or in a pack made by zim.extract), or with
+    shard=(i, N) only the i-th (from 1) of N parts of it, see ZimFile.plan_shards,
+    or with words (a list) only the pages of those words and of the pages
+    they redirect to, printing the translations of the latter under the words,
+    or with sample only that many pages picked at random (see
+    ZimFile.sample_articles) from strata size groups, with seed.
+    Without workers, a thread reads and decompresses up to prefetch clusters
+    ahead of the parsing (none with prefetch=0), and with spill (a directory)
+    the decompressed clusters are kept there for the next runs."""
+    file = open_input(filename, use_mmap=use_mmap, cache_bytes=cache_bytes, cache_policy=cache_policy)
+    if spill and workers == 1 and not is_pack(filename):
+        file.use_spill(spill, spill_bytes)
+    directory = None
+    if use_index and not is_pack(filename):
+        from zim.sidecar import load_sidecar
+        index = load_sidecar(file)
+        metadata = index.metadata
+        directory = index.directory(file.mimeTypeList)
+    else:
+        metadata = file.metadata()
+    # the namespace A directory of the zim file, redirects included, when it
+    # is loaded anyway (that of the sidecar or of a pack only holds articles)
+    zim_directory = None
+    if (shard or sample) and directory is None:
+        directory = file.load_directory(namespace=b'A')
+        if not is_pack(filename):
+            zim_directory = directory
+    clusters = None
+    if shard:
+        clusters = file.plan_shards(shard[1], directory=directory,
+                                    mimetypes=html_mimetypes(file.mimeTypeList))[shard[0] - 1]
+        logging.info("Shard {}/{}: clusters {} to {}".format(shard[0], shard[1], clusters.start, clusters.stop))
+    if sample:
+        directory = file.sample_articles(sample, directory=directory, mimetypes=html_mimetypes(file.mimeTypeList),
+                                         strata=strata, seed=seed)
+        logging.info("Sample of {} pages in {} strata, seed {}".format(len(directory), strata, seed))
+    entries = None
+    if words is not None:
+        entries, alias_map = find_words(file, words)
+    else:
+        alias_map = {}
+    if aliases:
+        if zim_directory is not None:
+            found = file.aliases(directory=zim_directory)
         else:
-            yield (body.decode('utf-8'))
-
-
-def parse_zim(filename, edition=None):
-    """Parse html in zim file"""
-    file = ZimFile(filename=filename)
-    edition_lang_code = file.metadata()['language'].decode('utf-8')
+            found = file.aliases()
+        for index, alias_list in found.items():
+            alias_map.setdefault(index, []).extend(alias for alias in alias_list
+                                                   if alias not in alias_map.get(index, ()))
+    edition_lang_code = metadata['language'].decode('utf-8')
 
     if edition:
         edition_wikt_code = edition
@@ -81,19 +238,66 @@ def parse_zim(filename, edition=None):
         print("We don't have a parser for {}/{} language yet.".format(edition_lang_code, edition_wikt_code))
         return
 
+    reader = None
+    if workers == 1 and prefetch:
+        from zim.prefetch import ClusterPrefetcher
+        reader = ClusterPrefetcher(file, depth=prefetch)
     # instantiate the parser
-    page_generator = read_zim_file(file)
-    for page in page_generator:
+    if entries is not None:
+        page_generator = read_zim_entries(file, entries, reader=reader)
+    else:
+        page_generator = read_zim_file(file, workers=workers, directory=directory, clusters=clusters, reader=reader)
+    for entry, page in page_generator:
         soup = get_html_tree_from_string(page)
+        alias_list = [alias_headword(alias) for alias in alias_map.get(entry['index'], ())]
         for tup in parser.generate_translation_tuples(soup):
             try:
                 print(','.join(tup))
+                # the same translations under every headword redirecting to this page
+                for alias in alias_list:
+                    print(','.join(tup[:1] + (alias,) + tup[2:]))
             except TypeError as e:
                 logging.debug(e)
                 logging.debug(tup)
                 logging.debug(soup)
                 continue
 
+    logging.info(file.clusterCache.stats())
+    if reader is not None:
+        logging.info(reader.stats())
+    spill_cache = getattr(file, 'spill', None)
+    if spill_cache is not None:
+        logging.info(spill_cache.stats())
+    if stats:
+        print_cache_stats(file)
+        if reader is not None:
+            print_prefetch_stats(reader)
+        if spill_cache is not None:
+            print_spill_stats(spill_cache)
+
+
+def merge_csv(filenames):
+    """Print the rows of the csv files written for each shard as one csv"""
+    print(','.join(headers))
+    for filename in filenames:
+        with open(filename) as file:
+            header = file.readline()
+            if header.rstrip('\n') != ','.join(headers):
+                raise ValueError("{} is not an output of parser.py".format(filename))
+            for line in file:
+                print(line, end='')
+
+
+def shard_spec(text):
+    """Parses 'i/N' into (i, N), for the i-th (from 1) of N shards"""
+    try:
+        i, n = (int(x) for x in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected i/N, e.g. 1/4, got '{}'".format(text))
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError("shard {} is not between 1 and {}".format(i, n))
+    return i, n
+
 
 def parse_online_html_provided_url_list(filename, edition=None):
     """Use the url list provided and parse online html"""
@@ -144,12 +348,66 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--url_zim', '-uz', help='use a zim file as the source of urls and get html from the Internet')
     group.add_argument('--url_list', '-ul', help='use a file containing a list of urls and get html from the Internet')
-    group.add_argument('--zim', '-z', help='use the zim file as input instead of html')
+    group.add_argument('--zim', '-z',
+                       help='use the zim file (or a pack made from it, or an http(s) url of it) as input instead of html')
+    group.add_argument('--merge', nargs='+', metavar='CSV', help='print the outputs of the shards of a zim file as one')
     parser.add_argument('--edition', '-e', help='explicitly specify the language edition, for either html or zim')
+    parser.add_argument('--mmap', '-m', action='store_true', help='memory-map the zim file instead of reading it')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='number of processes decompressing the zim file (0 for one per core)')
+    parser.add_argument('--prefetch', type=int, default=4, metavar='N',
+                        help='without workers, read and decompress up to N clusters ahead of the parsing in a '
+                             'thread (0 to read them inline)')
+    parser.add_argument('--cache_mb', type=int, default=64,
+                        help='memory for decompressed clusters of the zim file, in MB')
+    parser.add_argument('--cache_policy', choices=['lru', 'size'], default='lru',
+                        help='which clusters the cache evicts first: least recently used, or cheapest '
+                             'to decompress again per byte')
+    parser.add_argument('--spill', metavar='DIR',
+                        help='without workers, keep the decompressed clusters in DIR so that the next runs over '
+                             'the same zim file do not decompress them again')
+    parser.add_argument('--spill_mb', type=int, default=4096,
+                        help='disk space for the clusters kept with --spill, in MB')
+    parser.add_argument('--stats', action='store_true', help='print cluster cache statistics to stderr')
+    parser.add_argument('--index', '-x', action='store_true',
+                        help='use (and build on first use) an index file next to the zim file')
+    parser.add_argument('--aliases', '-a', action='store_true',
+                        help='also print the translations under the headwords redirecting to a page')
+    parser.add_argument('--shard', '-s', type=shard_spec, metavar='I/N',
+                        help='only parse the I-th of N parts of the zim file, split at cluster boundaries')
+    parser.add_argument('--words', metavar='FILE',
+                        help='only parse the pages of the words in FILE (one per line) in the zim file')
+
+    parser.add_argument('--sample', type=int, metavar='N',
+                        help='only parse N pages of the zim file picked at random, read in cluster order')
+    parser.add_argument('--strata', type=int, default=1, metavar='K',
+                        help='with --sample, pick as many pages from each of K groups of pages of about the same '
+                             'size (1 for a uniform sample)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random pick of --sample')
 
     args = parser.parse_args()
+    words = None
+    if args.words:
+        if not args.zim or is_pack(args.zim):
+            parser.error('--words needs a zim file (-z), which has a url list')
+        if args.shard:
+            parser.error('--words and --shard cannot be used together')
+        if args.workers != 1:
+            parser.error('--words and -w cannot be used together')
+        words = read_word_list(args.words)
+    if args.sample is not None:
+        if args.sample < 1:
+            parser.error('--sample needs at least 1 page')
+        if args.words or args.shard:
+            parser.error('--sample cannot be used with --words or --shard')
     if args.zim:
-        parse_zim(args.zim, args.edition)
+        parse_zim(args.zim, args.edition, use_mmap=args.mmap, workers=args.workers,
+                  cache_bytes=args.cache_mb << 20, cache_policy=args.cache_policy, stats=args.stats, use_index=args.index,
+                  aliases=args.aliases, shard=args.shard, prefetch=args.prefetch, spill=args.spill,
+                  spill_bytes=args.spill_mb << 20, words=words,
+                  sample=args.sample, strata=args.strata, seed=args.seed)
+    elif args.merge:
+        merge_csv(args.merge)
     elif args.url_list:
         parse_online_html_provided_url_list(args.url_list, args.edition)
     elif args.url_zim:
@@ -11,9 +11,20 @@ HEADING_TAG = re.compile(r'^h(?P<level>[1-6])$', re.I)
 class GeneralParser:
     """Provides a framework for writing individual parsers"""
 
+    # text found in the html of every page the parser gets translations
+    # from, e.g. the heading of the translation section; empty to keep all
+    translation_markers = ()
+
     def __init__(self):
         self.edition = None
 
+    def prefilter(self, html):
+        """
+        A quick test on the raw html of a page, before parsing it.
+        :return: False if the page has no translations for this parser
+        """
+        return not self.translation_markers or any(marker in html for marker in self.translation_markers)
+
     def get_heading_level(self, tag):
         """If the tag is a heading tag, return its level (1 through 6).
         Otherwise, return `None`."""
@@ -4,6 +4,7 @@ from bs4 import Tag, BeautifulSoup
 from parser.general import GeneralParser
 from parser.helper import get_html_tree_from_url, remove_parenthesis
 class AzParser(GeneralParser):
+    translation_markers = ('NavFrame',)
     
     tested_url = [
 
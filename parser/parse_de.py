@@ -9,6 +9,7 @@ from parser.helper import get_html_tree_from_url
 
 
 class DeParser(GeneralParser):
+    translation_markers = (u"Übersetzungen",)
     tested_url = [
         "https://de.wiktionary.org/wiki/gene",
         "https://de.wiktionary.org/wiki/play",
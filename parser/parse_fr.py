@@ -7,6 +7,8 @@ from parser.helper import get_html_tree_from_url, remove_parenthesis, COMMA_OR_S
 
 
 class FrParser(GeneralParser):
+    translation_markers = ("Traductions",)
+
     def __init__(self):
         super(FrParser, self).__init__()
         self.edition = 'fr'
@@ -6,6 +6,7 @@ from parser.helper import get_html_tree_from_url
 
 
 class JaParser(GeneralParser):
+    translation_markers = ('translations',)
     tested_url = [
         "https://ja.wiktionary.org/wiki/%E3%81%AA%E3%81%84",
         "https://ja.wiktionary.org/wiki/%E9%81%BA%E4%BC%9D%E5%AD%90",
@@ -9,6 +9,8 @@ from parser.helper import get_html_tree_from_url, remove_parenthesis, COMMA_OR_S
 
 
 class NlParser(GeneralParser):
+    translation_markers = ("Vertalingen",)
+
     def __init__(self):
         super(NlParser, self).__init__()
         self.edition = 'nl'
@@ -9,6 +9,8 @@ from .helper import get_heading_level, get_html_tree_from_url, remove_parenthesi
 COMMA_OR_SEMICOLON = re.compile('[,;]')
 
 class PlParser(GeneralParser):
+    translation_markers = (u'tłumaczenia:', u'znaczenia:')
+
     def __init__(self):
         super(PlParser, self).__init__()
         self.edition = 'pl'
@@ -9,6 +9,8 @@ COMMA_SEMI_PERIOD = re.compile('[,;.]')
 COMMA_OR_SEMICOLON = re.compile('[,;]')
 
 class RuParser(GeneralParser):
+    translation_markers = (u'Перевод', u'Значение')
+
     def __init__(self):
         super(RuParser, self).__init__()
         self.edition = 'ru'
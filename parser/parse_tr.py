@@ -6,6 +6,7 @@ from parser.helper import get_html_tree_from_url
 
 
 class TrParser(GeneralParser):
+    translation_markers = (u"Çeviriler",)
     tested_url = [
         "https://tr.wiktionary.org/wiki/ev",
         "https://tr.wiktionary.org/wiki/abartmak",
@@ -6,6 +6,7 @@ from parser.helper import get_html_tree_from_url
 
 
 class ViParser(GeneralParser):
+    translation_markers = (u"Dịch",)
     tested_url = [
         "https://vi.wiktionary.org/wiki/kh%C3%B4ng#Ti.E1.BA.BFng_Vi.E1.BB.87t",
         "https://vi.wiktionary.org/wiki/c%C3%A1m_%C6%A1n#Ti.E1.BA.BFng_Vi.E1.BB.87t",
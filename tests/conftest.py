@@ -0,0 +1,121 @@
+"""A tiny ZIM file written with zim.writer, shared by the tests.
+
+It holds pages of the de layout (see zim.writer.TEMPLATES) spread over
+small clusters compressed with every codec available, an image in an
+uncompressed cluster, a stylesheet, redirects (one of them to another
+redirect) and the metadata.
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+import uuid
+
+import pytest
+
+from zim.writer import ZimWriter, TEMPLATES
+from zim.zimpy_p3 import (COMPRESSION_ZLIB, COMPRESSION_BZIP2, COMPRESSION_LZMA, COMPRESSION_ZSTD,
+                          CLUSTER_CODECS)
+
+WORDS = ['Haus', 'Baum', 'Katze', 'Hund', 'Tisch', 'Stuhl', 'Buch', 'Wasser', 'Feuer', 'Erde', 'Luft', 'Stein',
+         'Sonne', 'Mond', 'Stern', 'Wolke']
+
+# the page of a word translated into these two languages, with the word
+# lowercased plus the suffix as translation
+TRANSLATIONS = [('Englisch', '_en'), ('Französisch', '_fr')]
+
+# url -> title of the redirect, and the url it points to
+REDIRECTS = {
+    'Häuser.html': ('Häuser', 'Haus.html'),
+    'Haeuser.html': ('Haeuser', 'Häuser.html'),
+    'Bäume.html': ('Bäume', 'Baum.html'),
+}
+
+CODECS = [COMPRESSION_ZLIB, COMPRESSION_BZIP2, COMPRESSION_LZMA] + \
+    ([COMPRESSION_ZSTD] if COMPRESSION_ZSTD in CLUSTER_CODECS else [])
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_page(word, index):
+    """The html of the page of word, which has translations when index is even"""
+    template = TEMPLATES['de']
+    translations = ''
+    if index % 2 == 0:
+        items = ''.join(template['item'].format(language=language, translation=word.lower() + suffix)
+                        for language, suffix in TRANSLATIONS)
+        translations = template['translations'].format(items=items)
+    return template['page'].format(word=word, pos=template['pos'][index % len(template['pos'])],
+                                   ipa=word.lower() + 'a', words=' '.join([word] * 60),
+                                   translations=translations)
+
+
+def expected_rows(words=WORDS):
+    """The rows parser.py prints for the tiny ZIM file (or one written with
+    other words), without the header: one with the headword alone for every
+    page, then its translations"""
+    rows = []
+    template = TEMPLATES['de']
+    for index, word in enumerate(words):
+        pos = template['pos'][index % len(template['pos'])]
+        rows.append(','.join(['de', word, 'Deutsch', '', '', '', pos, word.lower() + 'a']))
+        if index % 2 == 0:
+            for language, suffix in TRANSLATIONS:
+                rows.append(','.join(['de', word, 'Deutsch', word.lower() + suffix, language, '', pos,
+                                      word.lower() + 'a']))
+    return rows
+
+
+def page_url(word):
+    """The url of the page of word, with underscores for spaces"""
+    return word.replace(' ', '_') + '.html'
+
+
+def write_tiny_zim(filename, words=WORDS):
+    # about two pages per cluster, each group of pages with another codec
+    writer = ZimWriter(cluster_size=1024)
+    try:
+        per_codec = -(-len(words) // len(CODECS))
+        for index, word in enumerate(words):
+            writer.compression = CODECS[index // per_codec]
+            writer.add_article(b'A', page_url(word), word, make_page(word, index).encode('utf-8'))
+        writer.add_article(b'A', 'Bild.png', 'Bild', IMAGE, mimetype='image/png')
+        writer.add_article(b'-', 'style.css', '', b'body { color: black }', mimetype='text/css')
+        for url, (title, target) in REDIRECTS.items():
+            writer.add_redirect(b'A', url, title, b'A', target)
+        writer.add_metadata('Language', b'deu')
+        writer.add_metadata('Title', b'Wiktionary (de)')
+        writer.add_metadata('Creator', b'Wiktionary')
+        writer.main_page = (b'A', page_url(words[0]))
+        writer.write(filename, zim_uuid=uuid.UUID(int=16))
+    finally:
+        writer.close()
+
+
+@pytest.fixture(scope='session')
+def tiny_zim(tmp_path_factory):
+    """The path of the tiny ZIM file"""
+    path = str(tmp_path_factory.mktemp('zim') / 'tiny.zim')
+    write_tiny_zim(path)
+    return path
+
+
+@pytest.fixture(scope='session')
+def cli():
+    """parser.py as a module; the parser package keeps it from being
+    imported by name"""
+    path = os.path.join(ROOT, 'parser.py')
+    spec = importlib.util.spec_from_file_location('parser_cli', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_script(*args, cwd=None):
+    """Runs python with args in cwd (the root of the repository by default),
+    with the repository importable; returns the CompletedProcess, with
+    stdout and stderr as text"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable] + list(args), cwd=cwd or ROOT, env=env, capture_output=True, text=True)
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from conftest import WORDS, make_page
+from zim.zimpy_p3 import ClusterCache, SizeAwarePolicy, ZimFile
+
+
+class SizedCluster(object):
+    """A cluster of end - ptr bytes, taking delays[ptr] seconds to load"""
+    delays = {}
+
+    def __init__(self, file_buffer, ptr, end=None, lazy=False):
+        time.sleep(self.delays.get(ptr, 0))
+        self.nbytes = end - ptr
+        self.decompress_time = 0.0
+
+    def read_blob(self, blob_index):
+        return b''
+
+    def _decompress(self):
+        pass
+
+
+def cached(cache):
+    return sorted(ptr for file_id, ptr in cache.entries)
+
+
+def get(cache, ptr, size=100):
+    return cache.get(None, ptr, ptr + size)
+
+
+def test_lru_eviction():
+    cache = ClusterCache(cluster_class=SizedCluster, max_bytes=300, policy='lru')
+    for ptr in (0, 100, 200):
+        get(cache, ptr)
+    assert (cached(cache), cache.stats()['evictions']) == ([0, 100, 200], 0)
+    get(cache, 0)
+    get(cache, 300)
+    assert cached(cache) == [0, 200, 300]
+    get(cache, 100)
+    assert cached(cache) == [0, 100, 300]
+    # a cluster bigger than the rest leaves room for itself only
+    get(cache, 1000, size=250)
+    assert cached(cache) == [1000]
+    stats = cache.stats()
+    assert {name: stats[name] for name in ('hits', 'misses', 'evictions', 'entries', 'bytes')} == \
+        {'hits': 1, 'misses': 6, 'evictions': 5, 'entries': 1, 'bytes': 250}
+
+
+def test_cache_size_limit():
+    cache = ClusterCache(cache_size=2, cluster_class=SizedCluster, max_bytes=1000)
+    for ptr in (0, 100, 200, 0):
+        get(cache, ptr)
+    assert cached(cache) == [0, 200]
+    assert (cache.stats()['evictions'], cache.stats()['bytes']) == (2, 200)
+
+
+def test_size_aware_eviction():
+    SizedCluster.delays = {0: 0.036, 100: 0.012, 200: 0.004, 400: 0.1}
+    try:
+        cache = ClusterCache(cluster_class=SizedCluster, max_bytes=300, policy='size')
+        assert isinstance(cache.policy, SizeAwarePolicy)
+        for ptr in (0, 100, 200):
+            get(cache, ptr)
+        # the cheapest cluster to load again goes first, even the newest
+        get(cache, 300)
+        assert cached(cache) == [0, 100, 200]
+        # and the least recently used one stays if it is the dearest
+        get(cache, 400)
+        assert cached(cache) == [0, 100, 400]
+        stats = cache.stats()
+        assert (stats['misses'], stats['evictions'], stats['bytes'], stats['entries']) == (5, 2, 300, 3)
+    finally:
+        SizedCluster.delays = {}
+
+
+@pytest.mark.parametrize('policy', ['lru', 'size'])
+def test_zim_file_under_byte_budget(tiny_zim, policy):
+    zim_file = ZimFile(tiny_zim, cache_bytes=2500, cache_policy=policy)
+    cache = zim_file.clusterCache
+    reads = 0
+    for round in range(2):
+        for index, word in enumerate(WORDS):
+            data, mime, namespace = zim_file.get_article_by_url(b'A', word + '.html')
+            reads += 1
+            assert bytes(data) == make_page(word, index).encode('utf-8')
+            stats = cache.stats()
+            assert stats['bytes'] == sum(cluster.nbytes for cluster in cache.entries.values()) <= 2500
+    stats = cache.stats()
+    assert stats['evictions'] > 0
+    assert stats['hits'] + stats['misses'] == reads
+    assert stats['misses'] - stats['evictions'] == stats['entries']
@@ -0,0 +1,69 @@
+import pytest
+
+from conftest import WORDS, expected_rows, run_script
+from zim.pack import PackFile, is_pack
+from zim.zimpy_p3 import ZimFile, COMPRESSION_ZSTD, CLUSTER_CODECS
+
+CODEC = 'zstd' if COMPRESSION_ZSTD in CLUSTER_CODECS else 'lzma'
+
+# the pages of the de layout only have a translation section when their
+# index is even (see conftest.make_page)
+TRANSLATED = [word for index, word in enumerate(WORDS) if index % 2 == 0]
+
+
+def make_pack(tiny_zim, path, *options):
+    result = run_script('-m', 'zim.extract', '-i', tiny_zim, 'pack', '-o', path, '--codec', CODEC,
+                        '--cluster_kb', '2', *options)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+@pytest.fixture(scope='module')
+def packs(tiny_zim, tmp_path_factory):
+    """The paths of the packs of the tiny ZIM file, with every page and with
+    the pages the de parser picks"""
+    root = tmp_path_factory.mktemp('pack')
+    whole, filtered = str(root / 'all.pack'), str(root / 'de.pack')
+    assert make_pack(tiny_zim, whole, '--all').endswith(': %d articles packed into %s\n' % (len(WORDS), whole))
+    assert make_pack(tiny_zim, filtered, '-e', 'de').endswith(
+        ': %d articles packed into %s\n' % (len(TRANSLATED), filtered))
+    return whole, filtered
+
+
+def parse(cli, capsys, filename, **options):
+    cli.parse_zim(filename, 'de', **options)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == ','.join(cli.headers)
+    return sorted(lines[1:])
+
+
+def test_pack_keeps_directory_and_metadata(tiny_zim, packs):
+    zim_file = ZimFile(tiny_zim)
+    for path in packs:
+        assert is_pack(path)
+        pack = PackFile(path)
+        assert pack.metadata() == zim_file.metadata()
+        assert pack.get_uuid() == zim_file.get_uuid()
+        directory = pack.load_directory()
+        for i in range(len(directory)):
+            entry, index = zim_file.get_entry_by_url(b'A', directory.url(i))
+            assert (directory.indexes[i], directory.title(i)) == (index, entry['title'])
+        pages = {entry['url']: bytes(blob) for entry, blob in pack.iter_blobs_by_cluster()}
+        assert pages == {url: bytes(zim_file.get_article_by_url(b'A', url)[0]) for url in pages}
+    assert not is_pack(tiny_zim)
+
+
+def test_parse_whole_pack(cli, tiny_zim, packs, capsys):
+    assert parse(cli, capsys, packs[0]) == parse(cli, capsys, tiny_zim) == sorted(expected_rows())
+    assert parse(cli, capsys, packs[0], aliases=True) == parse(cli, capsys, tiny_zim, aliases=True)
+
+
+def test_prefilter_drops_pages_without_translations(cli, tiny_zim, packs, capsys):
+    directory = PackFile(packs[1]).load_directory()
+    assert sorted(directory.url(i) for i in range(len(directory))) == sorted(word + '.html' for word in TRANSLATED)
+    # the rows with translations are all there; only headword rows are lost
+    rows = [row for row in expected_rows() if row.split(',')[1] in TRANSLATED]
+    assert parse(cli, capsys, packs[1]) == sorted(rows)
+    # the redirects to Haus are kept, the one to Baum is not
+    aliases = PackFile(packs[1]).aliases()
+    assert sorted(title for titles in aliases.values() for title in titles) == ['Haeuser', 'Häuser']
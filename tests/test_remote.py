@@ -0,0 +1,146 @@
+import os
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import expected_rows
+from zim.remote import HttpFile
+from zim.zimpy_p3 import ZimFile
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves the files of the server's root like a static file server
+    with Range requests: /moved/<name> redirects to /<name>, and
+    /norange/<name> is served whole whatever the Range asked"""
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in two writes; don't let them wait for an ACK
+    disable_nagle_algorithm = True
+    etag = '"1"'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, headers=(), body=b''):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/moved/'):
+            return self.send(302, [('Location', '/' + self.path[len('/moved/'):])])
+        ranges = not self.path.startswith('/norange/')
+        path = os.path.join(self.server.root, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            return self.send(404)
+        with open(path, 'rb') as f:
+            data = f.read()
+        match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if not ranges or not match or (if_range is not None and if_range != self.etag):
+            return self.send(200, [('ETag', self.etag)], data)
+        start, end = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+        if start >= len(data):
+            return self.send(416, [('Content-Range', 'bytes */%d' % len(data))])
+        self.send(206, [('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data))), ('ETag', self.etag)],
+                  data[start:end + 1])
+
+
+@pytest.fixture(scope='module')
+def server(tiny_zim):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.root = os.path.dirname(tiny_zim)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d/' % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def url(server, tiny_zim):
+    return server + os.path.basename(tiny_zim)
+
+
+@pytest.fixture
+def data(tiny_zim):
+    with open(tiny_zim, 'rb') as f:
+        return f.read()
+
+
+def test_pread(url, data):
+    f = HttpFile(url, block_size=1024, cache_blocks=4, max_readahead=4)
+    assert f.size == len(data)
+    rnd = random.Random(0)
+    for _ in range(200):
+        offset = rnd.randrange(len(data))
+        size = rnd.randrange(1, 5000)
+        assert f.pread(size, offset) == data[offset:offset + size]
+    # short reads at and past the end of the file
+    assert f.pread(100, len(data) - 10) == data[-10:]
+    assert f.pread(100, len(data)) == b''
+    assert f.stats()['requests'] > 1
+
+
+def test_sequential_read(url, data):
+    f = HttpFile(url, block_size=1024, max_readahead=8)
+    chunks = []
+    while True:
+        chunk = f.read(700)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert b''.join(chunks) == data
+    # the read-ahead fetches several blocks per request
+    assert f.stats()['requests'] < len(data) // 1024
+
+
+def test_threads(url, data):
+    f = HttpFile(url, block_size=512, cache_blocks=8)
+    rnd = random.Random(1)
+    reads = [(rnd.randrange(1, 3000), rnd.randrange(len(data))) for _ in range(300)]
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda read: f.pread(*read), reads))
+    assert results == [data[offset:offset + size] for size, offset in reads]
+
+
+def test_redirect(server, tiny_zim, data):
+    f = HttpFile(server + 'moved/' + os.path.basename(tiny_zim))
+    assert f.url == server + os.path.basename(tiny_zim)
+    assert f.pread(len(data), 0) == data
+
+
+def test_server_without_ranges(server, tiny_zim):
+    with pytest.raises(IOError):
+        HttpFile(server + 'norange/' + os.path.basename(tiny_zim))
+
+
+def test_changed_file(url):
+    f = HttpFile(url, block_size=1024, cache_blocks=1)
+    f.pread(10, 0)
+    RangeHandler.etag = '"2"'
+    try:
+        with pytest.raises(IOError):
+            f.pread(10, f.size - 10)
+    finally:
+        RangeHandler.etag = '"1"'
+
+
+def test_zim_over_http(url, tiny_zim):
+    remote, local = ZimFile(url), ZimFile(tiny_zim)
+    assert remote.verify() == []
+    for index in range(local.header['articleCount']):
+        assert remote.read_directory_entry_by_index(index) == local.read_directory_entry_by_index(index)
+        assert remote.get_article_by_index(index) == local.get_article_by_index(index)
+
+
+def test_parse_zim_over_http(cli, url, capsys):
+    cli.parse_zim(url, 'de')
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(lines[1:]) == sorted(expected_rows())
@@ -0,0 +1,78 @@
+from collections import Counter
+
+import pytest
+
+from conftest import WORDS, expected_rows, run_script, ROOT
+from zim.zimpy_p3 import ZimFile
+
+HTML = ['text/html']
+
+
+@pytest.fixture(scope='module')
+def zim_file(tiny_zim):
+    return ZimFile(tiny_zim)
+
+
+def sample_urls(zim_file, count, **kwargs):
+    sample = zim_file.sample_articles(count, mimetypes=HTML, **kwargs)
+    # read in cluster order
+    assert list(sample.cluster) == sorted(sample.cluster)
+    return sorted(sample.url(i) for i in range(len(sample)))
+
+
+def test_same_seed_same_sample(zim_file, tiny_zim):
+    for strata in (1, 3):
+        sample = sample_urls(zim_file, 5, strata=strata, seed=7)
+        assert len(sample) == len(set(sample)) == 5
+        assert sample_urls(ZimFile(tiny_zim), 5, strata=strata, seed=7) == sample
+        # the directory the pick starts from does not matter
+        directory = zim_file.load_directory(namespace=b'A')
+        picked = zim_file.sample_articles(5, directory=directory, mimetypes=HTML, strata=strata, seed=7)
+        assert sorted(picked.url(i) for i in range(len(picked))) == sample
+
+
+def test_other_seed_other_sample(zim_file):
+    samples = {tuple(sample_urls(zim_file, 5, seed=seed)) for seed in range(5)}
+    assert len(samples) > 1
+
+
+def strata_of(zim_file, strata):
+    """The urls of the pages of each stratum: the pages sorted by the size
+    of their cluster over its number of entries, cut into strata runs"""
+    directory = zim_file.load_directory(namespace=b'A')
+    ptrs, ends = zim_file.cluster_ranges()
+    blobs = Counter(directory.cluster[i] for i in directory.select(redirects=False))
+    pages = sorted(((ends[directory.cluster[i]] - ptrs[directory.cluster[i]]) / blobs[directory.cluster[i]],
+                    directory.indexes[i], directory.url(i)) for i in directory.select(redirects=False, mimetypes=HTML))
+    return [{url for size, index, url in pages[len(pages) * k // strata:len(pages) * (k + 1) // strata]}
+            for k in range(strata)]
+
+
+@pytest.mark.parametrize('count, strata, shares', [(8, 4, [2, 2, 2, 2]), (6, 4, [1, 2, 1, 2]), (4, 2, [2, 2]),
+                                                   (16, 4, [4, 4, 4, 4])])
+def test_strata_shares(zim_file, count, strata, shares):
+    groups = strata_of(zim_file, strata)
+    for seed in range(3):
+        sample = sample_urls(zim_file, count, strata=strata, seed=seed)
+        assert [len(group.intersection(sample)) for group in groups] == shares
+
+
+@pytest.mark.parametrize('strata', [1, 3])
+@pytest.mark.parametrize('count', [len(WORDS), len(WORDS) + 1, 1000])
+def test_sample_of_everything(zim_file, count, strata):
+    assert sample_urls(zim_file, count, strata=strata) == sorted(word + '.html' for word in WORDS)
+
+
+def test_parse_zim_sample(cli, tiny_zim, capsys):
+    cli.parse_zim(tiny_zim, 'de', sample=5, strata=2, seed=3)
+    rows = capsys.readouterr().out.splitlines()[1:]
+    cli.parse_zim(tiny_zim, 'de', sample=5, strata=2, seed=3, use_mmap=True)
+    assert capsys.readouterr().out.splitlines()[1:] == rows
+    assert len({row.split(',')[1] for row in rows}) == 5
+    assert set(rows) <= set(expected_rows())
+
+
+@pytest.mark.parametrize('options', [['--sample', '0'], ['--sample', '2', '-s', '1/2']])
+def test_sample_rejected(tiny_zim, tmp_path, options):
+    result = run_script(ROOT + '/parser.py', '-z', tiny_zim, '-e', 'de', *options, cwd=str(tmp_path))
+    assert result.returncode == 2 and 'error: --sample' in result.stderr
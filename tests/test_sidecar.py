@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import run_script
+from zim.sidecar import SidecarIndex, load_sidecar, sidecar_path
+from zim.zimpy_p3 import ZimFile
+
+
+@pytest.fixture
+def zim_copy(tiny_zim, tmp_path):
+    """A copy of the tiny ZIM file, so that its index is written in tmp_path"""
+    path = str(tmp_path / 'tiny.zim')
+    shutil.copy(tiny_zim, path)
+    return path
+
+
+def test_build_and_load(zim_copy):
+    zim_file = ZimFile(zim_copy)
+    index = load_sidecar(zim_file)
+    assert os.path.exists(sidecar_path(zim_copy))
+    assert index.metadata == ZimFile(zim_copy).metadata()
+
+    reloaded = SidecarIndex(sidecar_path(zim_copy))
+    assert reloaded.matches(zim_file)
+    directory = reloaded.directory(zim_file.mimeTypeList)
+    full = zim_file.load_directory(namespace=b'A')
+    articles = full.select(namespace=b'A', redirects=False)
+    assert sorted(directory.indexes) == sorted(full.indexes[i] for i in articles)
+    for i in range(len(directory)):
+        entry = zim_file.read_directory_entry_by_index(directory.indexes[i])
+        assert (directory.url(i), directory.cluster[i], directory.blob[i]) == \
+            (entry['url'], entry['clusterNumber'], entry['blobNumber'])
+    # the rows come in cluster order
+    assert list(directory.cluster) == sorted(directory.cluster)
+
+
+def test_namespace_range(zim_copy):
+    plain = ZimFile(zim_copy)
+    indexed = ZimFile(zim_copy)
+    load_sidecar(indexed)
+    assert indexed.sidecar is not None
+    for namespace in (b'-', b'A', b'B', b'M', b'Z', b'\x00'):
+        assert indexed.namespace_range(namespace) == plain.namespace_range(namespace)
+    assert indexed.metadata() == plain.metadata()
+
+
+def rebuilt(zim_copy):
+    """Whether load_sidecar rebuilt the index of zim_copy"""
+    before = os.stat(sidecar_path(zim_copy)).st_mtime_ns
+    os.utime(sidecar_path(zim_copy), ns=(0, 0))
+    index = load_sidecar(ZimFile(zim_copy))
+    assert index.matches(ZimFile(zim_copy))
+    return os.stat(sidecar_path(zim_copy)).st_mtime_ns not in (0, before)
+
+
+def test_up_to_date_index_is_kept(zim_copy):
+    load_sidecar(ZimFile(zim_copy))
+    assert not rebuilt(zim_copy)
+
+
+def test_index_of_a_grown_file_is_rebuilt(zim_copy):
+    load_sidecar(ZimFile(zim_copy))
+    with open(zim_copy, 'ab') as f:
+        f.write(bytes(16))
+    assert rebuilt(zim_copy)
+
+
+def test_index_of_a_changed_checksum_is_rebuilt(zim_copy):
+    load_sidecar(ZimFile(zim_copy))
+    # same UUID and size, other contents
+    checksum_pos = ZimFile(zim_copy).header['checksumPos']
+    with open(zim_copy, 'r+b') as f:
+        f.seek(checksum_pos)
+        checksum = f.read(1)
+        f.seek(checksum_pos)
+        f.write(bytes([checksum[0] ^ 0xff]))
+    assert rebuilt(zim_copy)
+
+
+@pytest.mark.parametrize('contents', [b'', b'not an index', b'ZIMIDX\x00\x00' + bytes(4)])
+def test_unreadable_index_is_rebuilt(zim_copy, contents):
+    with open(sidecar_path(zim_copy), 'wb') as f:
+        f.write(contents)
+    assert rebuilt(zim_copy)
+
+
+def test_extract_with_index(zim_copy):
+    plain = run_script('-m', 'zim.extract', '-i', zim_copy, 'url')
+    indexed = run_script('-m', 'zim.extract', '-i', zim_copy, '-x', 'url')
+    assert plain.returncode == indexed.returncode == 0
+    assert os.path.exists(sidecar_path(zim_copy))
+    assert plain.stdout.splitlines() == indexed.stdout.splitlines()
+    assert len(plain.stdout.splitlines()) == 16
+
+
+@pytest.mark.parametrize('options', [{}, {'aliases': True}])
+def test_parse_zim_with_index(cli, zim_copy, capsys, options):
+    cli.parse_zim(zim_copy, 'de', **options)
+    plain = capsys.readouterr().out
+    for run in range(2):
+        # the first run builds the index, the second one reads it
+        cli.parse_zim(zim_copy, 'de', use_index=True, **options)
+        assert capsys.readouterr().out == plain
@@ -0,0 +1,82 @@
+import os
+import random
+
+import pytest
+
+from conftest import expected_rows
+from zim.zimpy_p3 import ZimFile, MmapZimFile, SplitMmapZimFile, PositionalFile, open_zim, split_parts
+
+
+@pytest.fixture(scope='module')
+def split_zim(tiny_zim, tmp_path_factory):
+    """The tiny ZIM file split into chunks foo.zimaa, foo.zimab... at offsets
+    inside a directory entry and inside clusters, with no foo.zim; returns
+    the path of foo.zim and the offsets the chunks start at"""
+    zim_file = ZimFile(tiny_zim)
+    ptrs, ends = zim_file.cluster_ranges()
+    entry = zim_file.read_url_pointer(5)
+    cuts = [entry + 3, (ptrs[2] + ends[2]) // 2, ptrs[6] + 1, ptrs[6] + 2]
+    with open(tiny_zim, 'rb') as f:
+        data = f.read()
+    path = str(tmp_path_factory.mktemp('split') / 'foo.zim')
+    for suffix, start, end in zip(['aa', 'ab', 'ac', 'ad', 'ae'], [0] + cuts, cuts + [len(data)]):
+        with open(path + suffix, 'wb') as f:
+            f.write(data[start:end])
+    return path, cuts
+
+
+def test_split_parts(split_zim, tiny_zim):
+    path, cuts = split_zim
+    chunks = [path + suffix for suffix in ['aa', 'ab', 'ac', 'ad', 'ae']]
+    assert split_parts(path) == split_parts(path + 'aa') == chunks
+    assert split_parts(tiny_zim) == [tiny_zim]
+    assert not os.path.exists(path)
+
+
+def test_pread_across_chunks(split_zim, tiny_zim):
+    path, cuts = split_zim
+    with open(tiny_zim, 'rb') as f:
+        data = f.read()
+    f = PositionalFile(path)
+    assert f.size == len(data)
+    rnd = random.Random(0)
+    reads = [(rnd.randrange(1, 600), rnd.randrange(len(data))) for _ in range(300)]
+    reads += [(2, cut - 1) for cut in cuts] + [(len(data), 0), (100, len(data) - 10), (10, len(data))]
+    for size, offset in reads:
+        assert f.pread(size, offset) == data[offset:offset + size]
+    f.seek(cuts[0] - 2)
+    assert f.read(4) == data[cuts[0] - 2:cuts[0] + 2]
+    assert f.tell() == cuts[0] + 2
+    f.close()
+
+
+@pytest.mark.parametrize('use_mmap', [False, True], ids=['read', 'mmap'])
+@pytest.mark.parametrize('name', ['zim', 'zimaa'])
+def test_read_split_zim(split_zim, tiny_zim, use_mmap, name):
+    path, cuts = split_zim
+    whole = ZimFile(tiny_zim)
+    split = open_zim(path[:-3] + name, use_mmap=use_mmap)
+    assert type(split) is (SplitMmapZimFile if use_mmap else ZimFile)
+    assert split.verify() == []
+    for index in range(whole.header['articleCount']):
+        assert split.read_directory_entry_by_index(index) == whole.read_directory_entry_by_index(index)
+        data, mime, namespace = split.get_article_by_index(index)
+        expected = whole.get_article_by_index(index)
+        assert (bytes(data) if data is not None else None, mime, namespace) == \
+            (bytes(expected[0]) if expected[0] is not None else None, expected[1], expected[2])
+    assert [entry.as_dict() for entry in split.read_directory_entries()] == \
+        [entry.as_dict() for entry in whole.read_directory_entries()]
+    assert {entry['url']: bytes(blob) for entry, blob in split.iter_blobs_by_cluster()} == \
+        {entry['url']: bytes(blob) for entry, blob in whole.iter_blobs_by_cluster()}
+    split.close()
+
+
+@pytest.mark.parametrize('options', [{}, {'use_mmap': True}])
+def test_parse_split_zim(cli, split_zim, capsys, options):
+    cli.parse_zim(split_zim[0] + 'aa', 'de', **options)
+    assert sorted(capsys.readouterr().out.splitlines()[1:]) == sorted(expected_rows())
+
+
+def test_mmap_reader_refuses_chunks(split_zim):
+    with pytest.raises(IOError):
+        MmapZimFile(split_zim[0])
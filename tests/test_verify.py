@@ -0,0 +1,71 @@
+import shutil
+import struct
+
+import pytest
+
+from conftest import run_script
+from zim.zimpy_p3 import ZimFile, MmapZimFile
+
+
+@pytest.fixture
+def zim_copy(tiny_zim, tmp_path):
+    path = str(tmp_path / 'tiny.zim')
+    shutil.copy(tiny_zim, path)
+    return path
+
+
+def patch(path, offset, data):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def flip_checksum(path, header):
+    patch(path, header['checksumPos'], b'\x00' * 16)
+    return "MD5 checksum does not match"
+
+
+def cluster_pointer_past_eof(path, header):
+    patch(path, header['clusterPtrPos'] + 8 * 3, struct.pack('<Q', header['checksumPos'] + 1000))
+    return "Cluster pointers [3] outside the file"
+
+
+def entry_pointer_past_eof(path, header):
+    patch(path, header['urlPtrPos'] + 8 * 5, struct.pack('<Q', 1 << 40))
+    return "Directory entry pointers [5] outside the file"
+
+
+def unsorted_urls(path, header):
+    with open(path, 'rb') as f:
+        f.seek(header['urlPtrPos'] + 8 * 5)
+        first, second = struct.unpack('<QQ', f.read(16))
+    patch(path, header['urlPtrPos'] + 8 * 5, struct.pack('<QQ', second, first))
+    return "URLs are not in order at entry 6"
+
+
+def truncated_cluster(path, header):
+    zim_file = ZimFile(path)
+    ptrs, ends = zim_file.cluster_ranges()
+    last = len(ptrs) - 1
+    with open(path, 'r+b') as f:
+        f.truncate((ptrs[last] + ends[last]) // 2)
+    return "Clusters [%d] are cut off by the end of the file" % last
+
+
+@pytest.mark.parametrize('reader', [ZimFile, MmapZimFile], ids=lambda reader: reader.__name__)
+@pytest.mark.parametrize('corrupt', [flip_checksum, cluster_pointer_past_eof, entry_pointer_past_eof, unsorted_urls,
+                                     truncated_cluster])
+def test_verify_finds_problem(zim_copy, reader, corrupt):
+    problem = corrupt(zim_copy, ZimFile(zim_copy).header)
+    problems = reader(zim_copy).verify()
+    assert any(found.startswith(problem) for found in problems), problems
+    result = run_script('-m', 'zim.extract', '-i', zim_copy, 'verify')
+    assert result.returncode == 1
+    assert problem in result.stdout
+
+
+def test_verify_skip_checksum(zim_copy):
+    flip_checksum(zim_copy, ZimFile(zim_copy).header)
+    assert ZimFile(zim_copy).verify(checksum=False) == []
+    result = run_script('-m', 'zim.extract', '-i', zim_copy, 'verify', '--skip_checksum')
+    assert (result.returncode, result.stdout) == (0, zim_copy + ': OK\n')
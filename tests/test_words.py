@@ -0,0 +1,75 @@
+import random
+import unicodedata
+
+import pytest
+
+from conftest import expected_rows, page_url, run_script, write_tiny_zim, ROOT
+from zim.zimpy_p3 import ZimFile, merge_join
+
+WORDS = ['Haus', 'New York', 'Äpfel', 'Größe', 'Baum', 'Katze', 'rote Bete', 'Zug']
+# the words parsed from a word list, listed in any order and form
+LISTED = ['Größe', 'Haus', 'New York', 'Äpfel', 'rote Bete']
+
+
+@pytest.fixture(scope='module')
+def words_zim(tmp_path_factory):
+    """A ZIM file with pages for WORDS, some with spaces and non-ASCII letters"""
+    path = str(tmp_path_factory.mktemp('words') / 'words.zim')
+    write_tiny_zim(path, words=WORDS)
+    return path
+
+
+@pytest.fixture
+def word_list(tmp_path):
+    """A word list with duplicates, NFD forms, spaces, blank lines and
+    missing words, out of order"""
+    path = tmp_path / 'words.txt'
+    lines = ['Größe', 'Haus', '  New York  ', unicodedata.normalize('NFD', 'Äpfel'), '', 'Nichts', 'Haus',
+             'rote_Bete', 'Häuser', 'haus', 'Größe.html']
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def test_word_url(cli):
+    assert cli.word_url(' New York ') == 'New_York.html'
+    assert cli.word_url(unicodedata.normalize('NFD', 'Äpfel')) == 'Äpfel.html'
+    assert cli.word_url('Haus.html') == 'Haus.html'
+
+
+def test_read_word_list(cli, word_list):
+    words = cli.read_word_list(word_list)
+    assert '' not in words and 'New York' in words and len(words) == 10
+
+
+def test_find_words(cli, words_zim, word_list):
+    zim_file = ZimFile(words_zim)
+    entries, redirected = cli.find_words(zim_file, cli.read_word_list(word_list))
+    assert sorted(entry['url'] for entry in entries) == sorted(page_url(word) for word in LISTED)
+    assert redirected == {zim_file.get_entry_by_url(b'A', 'Haus.html')[1]: ['Häuser']}
+
+
+def test_parse_zim_words(cli, words_zim, word_list, capsys):
+    cli.parse_zim(words_zim, 'de', words=cli.read_word_list(word_list))
+    rows = capsys.readouterr().out.splitlines()[1:]
+    pages = [row for row in expected_rows(WORDS) if row.split(',')[1] in LISTED]
+    # each page once, and the rows of Haus under Häuser as well
+    aliases = [row.replace(',Haus,', ',Häuser,') for row in pages if row.split(',')[1] == 'Haus']
+    assert sorted(rows) == sorted(pages + aliases)
+
+
+@pytest.mark.parametrize('options', [['-w', '2'], ['-w', '0'], ['-s', '1/2'], ['--sample', '3']])
+def test_words_rejected_with(words_zim, word_list, tmp_path, options):
+    result = run_script(ROOT + '/parser.py', '-z', words_zim, '-e', 'de', '--words', word_list, *options,
+                        cwd=str(tmp_path))
+    assert result.returncode == 2
+    assert 'error: --' in result.stderr and result.stdout == ''
+
+
+def test_merge_join():
+    rnd = random.Random(0)
+    keys = sorted(rnd.sample(range(1000), 200))
+    for count in (0, 1, 5, 50, 300):
+        targets = sorted(set(rnd.randrange(-10, 1010) for _ in range(count)))
+        for lo, hi in ((0, len(keys)), (30, 120)):
+            expected = [(target, keys.index(target)) for target in targets if target in keys[lo:hi]]
+            assert list(merge_join(keys.__getitem__, targets, lo, hi)) == expected
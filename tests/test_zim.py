@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import WORDS, REDIRECTS, IMAGE, make_page, expected_rows, run_script
+from zim.parallel import ParallelClusterReader
+from zim.prefetch import ClusterPrefetcher
+from zim.zimpy_p3 import ZimFile, MmapZimFile, html_mimetypes
+
+READERS = [ZimFile, MmapZimFile]
+
+
+@pytest.fixture(params=READERS, ids=lambda reader: reader.__name__)
+def zim_file(request, tiny_zim):
+    zim_file = request.param(tiny_zim)
+    yield zim_file
+    zim_file.close()
+
+
+def page(word):
+    return make_page(word, WORDS.index(word)).encode('utf-8')
+
+
+def test_verify(zim_file):
+    assert zim_file.verify() == []
+
+
+def test_metadata(zim_file):
+    metadata = zim_file.metadata()
+    assert metadata['language'] == b'deu'
+    assert metadata['title'] == b'Wiktionary (de)'
+
+
+def test_get_article_by_url(zim_file):
+    for word in WORDS:
+        data, mime, namespace = zim_file.get_article_by_url(b'A', word + '.html')
+        assert (bytes(data), mime, namespace) == (page(word), 'text/html', b'A')
+    data, mime, namespace = zim_file.get_article_by_url(b'A', 'Bild.png')
+    assert (bytes(data), mime) == (IMAGE, 'image/png')
+    assert zim_file.get_article_by_url(b'A', 'Nichts.html') == (None, None, None)
+
+
+def test_redirects(zim_file):
+    for url in REDIRECTS:
+        target = url
+        while target in REDIRECTS:
+            target = REDIRECTS[target][1]
+        data, mime, namespace = zim_file.get_article_by_url(b'A', url)
+        assert bytes(data) == page(target[:-5])
+    entry, index = zim_file.get_entry_by_url(b'A', 'Häuser.html')
+    data, target, namespace = zim_file.get_article_by_url(b'A', 'Haeuser.html', follow_redirect=False)
+    assert (data, target) == (None, index)
+
+
+def test_get_entry_by_title(zim_file):
+    for word in WORDS:
+        entry, index = zim_file.get_entry_by_title(b'A', word)
+        assert entry['url'] == word + '.html'
+        assert zim_file.read_directory_entry_by_index(index)['title'] == word
+    entry, index = zim_file.get_entry_by_title(b'A', 'Bäume')
+    assert entry['redirectIndex'] == zim_file.get_entry_by_url(b'A', 'Baum.html')[1]
+    assert zim_file.get_entry_by_title(b'A', 'Nichts') == (None, None)
+
+
+def test_lookup_every_entry(zim_file):
+    for index in range(zim_file.header['articleCount']):
+        entry = zim_file.read_directory_entry_by_index(index)
+        assert zim_file.get_entry_by_url(entry['namespace'], entry['url'])[1] == index
+        if entry['title']:
+            found, found_index = zim_file.get_entry_by_title(entry['namespace'], entry['title'])
+            assert (found['title'], found_index) == (entry['title'], index)
+    assert zim_file.get_entry_by_url(b'B', 'Haus.html') == (None, None)
+    assert zim_file.get_entry_by_url(b'A', '') == (None, None)
+    assert zim_file.get_entry_by_url(b'A', '\uffff') == (None, None)
+
+
+def search_keys(zim_file, order):
+    """The (key, url) of every entry of namespace A, in url or title order,
+    found by reading the whole directory"""
+    entries = [zim_file.read_directory_entry_by_index(index) for index in range(zim_file.header['articleCount'])]
+    keys = [((entry['url'] if order == 'url' else entry['title'] or entry['url']).encode('utf-8'), entry['url'])
+            for entry in entries if entry['namespace'] == b'A']
+    return sorted(keys)
+
+
+PREFIXES = ['H', 'Haus', 'Hä', 'Bä', 'Bild', '', 'Zzz', '\uffff', 'Nichts']
+
+
+@pytest.mark.parametrize('order', ['url', 'title'])
+def test_prefix_search(zim_file, order):
+    keys = search_keys(zim_file, order)
+    for prefix in PREFIXES:
+        expected = [url for key, url in keys if key.startswith(prefix.encode('utf-8'))]
+        found = [entry['url'] for entry in zim_file.prefix_search(prefix, order=order)]
+        assert found == expected, prefix
+        for limit in (0, 1, 2):
+            assert [entry['url'] for entry in zim_file.prefix_search(prefix, limit=limit, order=order)] == \
+                expected[:limit]
+    # the empty prefix lists the whole namespace
+    assert len(list(zim_file.prefix_search('', order=order))) == len(WORDS) + 1 + len(REDIRECTS)
+    assert [entry['url'] for entry in zim_file.prefix_search('Hä', order=order)] == ['Häuser.html']
+    assert [entry['namespace'] for entry in zim_file.prefix_search('style', namespace=b'-')] == [b'-']
+    with pytest.raises(ValueError):
+        list(zim_file.prefix_search('H', order='size'))
+
+
+def test_extract_search(tiny_zim):
+    result = run_script('-m', 'zim.extract', '-i', tiny_zim, 'search', 'H')
+    assert (result.returncode, result.stdout.splitlines()) == (0, ['Haeuser.html', 'Haus.html', 'Hund.html',
+                                                                  'Häuser.html'])
+    result = run_script('-m', 'zim.extract', '-i', tiny_zim, '-m', 'search', 'B', '-n', '2', '-t')
+    assert result.stdout.splitlines() == ['Baum', 'Bild']
+    result = run_script('-m', 'zim.extract', '-i', tiny_zim, 'search', 'Bä', '--title')
+    assert result.stdout.splitlines() == ['Bäume']
+
+
+def test_readers_agree(tiny_zim):
+    zim_file, mmap_file = ZimFile(tiny_zim), MmapZimFile(tiny_zim)
+    for index in range(zim_file.header['articleCount']):
+        assert zim_file.read_directory_entry_by_index(index) == mmap_file.read_directory_entry_by_index(index)
+        data, mime, namespace = zim_file.get_article_by_index(index)
+        mmap_data, mmap_mime, mmap_namespace = mmap_file.get_article_by_index(index)
+        assert (bytes(data), mime, namespace) == (bytes(mmap_data), mmap_mime, mmap_namespace)
+
+
+def test_read_directory_entries(zim_file):
+    entries = zim_file.read_directory_entries()
+    assert len(entries) == zim_file.header['articleCount']
+    for index, entry in enumerate(entries):
+        assert entry.as_dict() == zim_file.read_directory_entry_by_index(index)
+
+
+def test_iter_blobs_by_cluster_reads_clusters_once(zim_file):
+    zim_file.metadata()
+    pages = {entry['url']: bytes(blob) for entry, blob
+             in zim_file.iter_blobs_by_cluster(mimetypes=html_mimetypes(zim_file.mimeTypeList))}
+    assert pages == {word + '.html': page(word) for word in WORDS}
+    assert zim_file.clusterCache.stats()['max_loads_per_cluster'] == 1
+
+
+def test_threads_share_file(zim_file):
+    indexes = list(range(zim_file.header['articleCount'])) * 4
+    with ThreadPoolExecutor(8) as executor:
+        articles = list(executor.map(zim_file.get_article_by_index, indexes))
+    fresh = ZimFile(zim_file.filename)
+    for index, (data, mime, namespace) in zip(indexes, articles):
+        expected = fresh.get_article_by_index(index)
+        assert (bytes(data), mime, namespace) == (bytes(expected[0]), expected[1], expected[2])
+
+
+@pytest.mark.parametrize('options', [{}, {'use_mmap': True}, {'prefetch': 0}, {'shard': (1, 1)}])
+def test_parse_zim(cli, tiny_zim, capsys, options):
+    cli.parse_zim(tiny_zim, 'de', **options)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == ','.join(cli.headers)
+    assert sorted(lines[1:]) == sorted(expected_rows())
+
+
+def test_parse_zim_aliases(cli, tiny_zim, capsys):
+    cli.parse_zim(tiny_zim, 'de', aliases=True)
+    rows = capsys.readouterr().out.splitlines()[1:]
+    haus = [row for row in expected_rows() if row.split(',')[1] == 'Haus']
+    for alias in ('Häuser', 'Haeuser'):
+        assert sorted(row for row in rows if row.split(',')[1] == alias) == \
+            sorted(row.replace(',Haus,', ',%s,' % alias) for row in haus)
+
+
+def iter_async(zim_file, **kwargs):
+    from zim.aio import AsyncZimFile
+
+    async def collect():
+        async with AsyncZimFile(zim_file=zim_file) as zim:
+            return [item async for item in zim.iter_articles(**kwargs)]
+    items = asyncio.run(collect())
+    # the ZimFile passed in is left open
+    assert zim_file.get_article_by_index(0)[1] is not None
+    return items
+
+
+def iter_parallel(zim_file, **kwargs):
+    reader = ParallelClusterReader(zim_file, workers=2)
+    try:
+        return list(reader.iter_blobs_by_cluster(**kwargs))
+    finally:
+        reader.close()
+
+
+@pytest.mark.parametrize('iterate', [
+    lambda zim_file, **kwargs: list(zim_file.iter_blobs_by_cluster(**kwargs)),
+    lambda zim_file, **kwargs: list(ClusterPrefetcher(zim_file, depth=2).iter_blobs_by_cluster(**kwargs)),
+    iter_parallel,
+    iter_async,
+], ids=['inline', 'prefetch', 'parallel', 'async'])
+def test_cluster_readers_agree(zim_file, iterate):
+    directory = zim_file.load_directory(namespace=b'A')
+    urls = [directory.url(index) for cluster_index, group
+            in directory.cluster_groups(b'A', ['text/html']) for index in group]
+    pages = iterate(zim_file, mimetypes=['text/html'])
+    assert [entry['url'] for entry, blob in pages] == urls
+    assert {entry['url']: bytes(blob) for entry, blob in pages} == {word + '.html': page(word) for word in WORDS}
+
+
+def test_spill(tiny_zim, tmp_path):
+    cold = ZimFile(tiny_zim)
+    cold.use_spill(str(tmp_path))
+    pages = {entry['url']: bytes(blob) for entry, blob in cold.iter_blobs_by_cluster()}
+    assert pages['Bild.png'] == IMAGE
+    stats = cold.spill.stats()
+    assert (stats['hits'], stats['uncompressed']) == (0, 1) and stats['misses'] > 0
+    warm = ZimFile(tiny_zim)
+    warm.use_spill(str(tmp_path))
+    assert {entry['url']: bytes(blob) for entry, blob in warm.iter_blobs_by_cluster()} == pages
+    stats = warm.spill.stats()
+    # the image cluster, stored uncompressed, is read from the .zim and is no miss
+    assert (stats['misses'], stats['hit_rate'], stats['uncompressed']) == (0, 1.0, 1)
+
+
+@pytest.mark.parametrize('count', [2, 3, 5, 40])
+def test_plan_shards(zim_file, count):
+    plan = zim_file.plan_shards(count, mimetypes=['text/html'])
+    # consecutive ranges of cluster numbers covering the whole file
+    assert len(plan) == count
+    assert (plan[0].start, plan[-1].stop) == (0, zim_file.header['clusterCount'])
+    assert all(shard.stop == next_shard.start for shard, next_shard in zip(plan, plan[1:]))
+    directory = zim_file.load_directory(namespace=b'A')
+    wanted = {directory.cluster[i] for i in directory.select(namespace=b'A', redirects=False, mimetypes=['text/html'])}
+    assert all(sum(cluster in shard for shard in plan) == 1 for cluster in wanted)
+    assert sum(1 for shard in plan if wanted.intersection(shard)) == min(count, len(wanted))
+    # every page is read by exactly one shard
+    urls = [[entry['url'] for entry, blob in zim_file.iter_blobs_by_cluster(mimetypes=['text/html'], clusters=shard)]
+            for shard in plan]
+    assert sorted(sum(urls, [])) == sorted(word + '.html' for word in WORDS)
+    # balanced by compressed size, up to a cluster
+    ptrs, ends = zim_file.cluster_ranges()
+    sizes = [sum(ends[c] - ptrs[c] for c in wanted.intersection(shard)) for shard in plan]
+    assert max(sizes) <= sum(sizes) / count + max(ends[c] - ptrs[c] for c in wanted)
+
+
+def test_plan_shards_needs_a_shard(zim_file):
+    with pytest.raises(ValueError):
+        zim_file.plan_shards(0)
+
+
+@pytest.mark.parametrize('count', [2, 3])
+def test_merge_shards(cli, tiny_zim, tmp_path, capsys, count):
+    cli.parse_zim(tiny_zim, 'de')
+    whole = capsys.readouterr().out
+    parts = []
+    for i in range(1, count + 1):
+        cli.parse_zim(tiny_zim, 'de', shard=(i, count))
+        parts.append(str(tmp_path / ('part%d.csv' % i)))
+        with open(parts[-1], 'w') as f:
+            f.write(capsys.readouterr().out)
+    cli.merge_csv(parts)
+    assert capsys.readouterr().out == whole
+
+
+def test_merge_rejects_other_csv(cli, tmp_path):
+    other = tmp_path / 'other.csv'
+    other.write_text('a,b\n1,2\n')
+    with pytest.raises(ValueError):
+        cli.merge_csv([str(other)])
+
+
+def test_shard_spec(cli):
+    assert cli.shard_spec('2/4') == (2, 4)
+    for text in ('0/4', '5/4', '1', 'a/b'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            cli.shard_spec(text)
+
+
+def test_bench_entries(tiny_zim, capsys):
+    from zim.bench import bench_entries, read_bytewise
+    bench_entries(tiny_zim)
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split(',')[0] for line in lines[1:]] == ['bytewise', 'single', 'file', 'batch', 'columns']
+    assert lines[1].endswith(',1.0')
+    zim_file = ZimFile(tiny_zim)
+    f = zim_file.f
+    for index in range(zim_file.header['articleCount']):
+        entry = zim_file.read_directory_entry_by_index(index)
+        ptr = zim_file.read_url_pointer(index)
+        f.seek(ptr + (12 if 'redirectIndex' in entry else 16))
+        assert (read_bytewise(f), read_bytewise(f)) == (entry['url'], entry['title'])
+
+
+def test_read_zim_file_closes_its_workers(cli, tiny_zim, monkeypatch):
+    from zim.parallel import ParallelClusterReader
+    closed = []
+    close = ParallelClusterReader.close
+
+    def record(reader):
+        # whether the workers were still running
+        closed.append(reader.executor is not None)
+        close(reader)
+    monkeypatch.setattr(ParallelClusterReader, 'close', record)
+    zim_file = ZimFile(tiny_zim)
+    # pages left unread
+    pages = cli.read_zim_file(zim_file, workers=2)
+    next(pages)
+    pages.close()
+    assert closed == [True]
+    assert sum(1 for page in cli.read_zim_file(zim_file, workers=2)) == len(WORDS)
+    assert closed == [True, True]
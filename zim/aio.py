@@ -0,0 +1,129 @@
+"""Read a .zim from asyncio code.
+
+AsyncZimFile runs the blocking reads and decompression of a ZimFile on a
+thread pool of its own and awaits them, so the event loop is never blocked.
+Requests for blobs of a cluster that is already being loaded wait for that
+load and then read from the cluster cache of the ZimFile, instead of taking
+a thread each to decompress the same cluster.
+
+    async with AsyncZimFile('wiktionary_de.zim') as zim:
+        html, mime, namespace = await zim.get_article_by_url(b'A', 'Haus.html')
+"""
+import asyncio
+import itertools
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from zim.zimpy_p3 import open_zim
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncZimFile(object):
+    """Awaitable access to a ZimFile (or one opened from filename with
+    open_zim and kwargs), with at most max_workers blocking calls running at
+    once"""
+
+    def __init__(self, filename=None, zim_file=None, max_workers=4, **kwargs):
+        # a zim_file passed in stays open: its owner closes it
+        self.owns_file = zim_file is None
+        self.zim_file = zim_file if zim_file is not None else open_zim(filename, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='zim')
+        # cluster number -> future of the read loading it into the cache
+        self.loading = {}
+        self.shared = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """close() without blocking the event loop while the reads in flight
+        finish"""
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        """Waits for the reads in flight, then closes the ZimFile if it was
+        opened from filename"""
+        self.executor.shutdown(wait=True)
+        if self.owns_file:
+            self.zim_file.close()
+
+    async def run(self, function, *args):
+        """Awaits function(*args) run on the thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def _loaded(self, cluster_index, future):
+        if self.loading.get(cluster_index) is future:
+            del self.loading[cluster_index]
+
+    async def read_blob(self, cluster_index, blob_index):
+        """Awaitable ZimFile.read_blob. The first request for a cluster loads
+        it into the cache; requests made meanwhile wait for that load, then
+        read their blob from the cache."""
+        pending = self.loading.get(cluster_index)
+        if pending is not None:
+            self.shared += 1
+            # whatever its outcome, the cluster is decompressed at most as
+            # far as the blob read needs from now on
+            await asyncio.wait([pending])
+            return await self.run(self.zim_file.read_blob, cluster_index, blob_index)
+        future = asyncio.ensure_future(self.run(self.zim_file.read_blob, cluster_index, blob_index))
+        self.loading[cluster_index] = future
+        future.add_done_callback(lambda f: self._loaded(cluster_index, f))
+        # a cancelled request does not cancel the load others may wait for
+        return await asyncio.shield(future)
+
+    async def get_article_by_index(self, index, follow_redirect=True):
+        """Awaitable ZimFile.get_article_by_index"""
+        entry = await self.run(self.zim_file.resolve_entry, index, follow_redirect)
+        if 'redirectIndex' in entry:
+            return None, entry['redirectIndex'], entry['namespace']
+        data = await self.read_blob(entry['clusterNumber'], entry['blobNumber'])
+        return data, self.zim_file.mimeTypeList[entry['mimetype']], entry['namespace']
+
+    async def get_article_by_url(self, namespace, url, follow_redirect=True):
+        """Awaitable ZimFile.get_article_by_url"""
+        entry, index = await self.run(self.zim_file.get_entry_by_url, namespace, url)
+        if index is None:
+            return None, None, None
+        return await self.get_article_by_index(index, follow_redirect=follow_redirect)
+
+    def read_blobs(self, cluster_index, blob_indexes):
+        """The blobs blob_indexes of a cluster, read together on the thread
+        pool: blobs of an uncompressed cluster are read from the file only
+        when asked for"""
+        cluster_data = self.zim_file.read_cluster(cluster_index)
+        return [cluster_data.read_blob(blob_index) for blob_index in blob_indexes]
+
+    async def iter_articles(self, namespace=b'A', directory=None, mimetypes=None, ahead=2):
+        """Async generator of (entry, blob) as ZimFile.iter_blobs_by_cluster
+        yields them, with up to ahead clusters loaded while the caller works
+        on the blobs of the current one"""
+        zim_file = self.zim_file
+        if directory is None:
+            directory = await self.run(zim_file.load_directory, namespace)
+        groups = directory.cluster_groups(namespace, mimetypes)
+        loads = deque()
+        try:
+            for cluster_index, group in itertools.chain(groups, [(None, None)]):
+                if cluster_index is not None:
+                    blob_indexes = [directory.blob[index] for index in group]
+                    loads.append((group, asyncio.ensure_future(self.run(self.read_blobs, cluster_index,
+                                                                        blob_indexes))))
+                    if len(loads) <= ahead:
+                        continue
+                while loads and (cluster_index is None or len(loads) > ahead):
+                    group, load = loads.popleft()
+                    blobs = await load
+                    for index, blob in zip(group, blobs):
+                        yield directory.entry(index), blob
+        finally:
+            for group, load in loads:
+                load.cancel()
+
+    def stats(self):
+        return {'loading': len(self.loading), 'shared': self.shared}
@@ -0,0 +1,139 @@
+"""Benchmarks of the .zim reader.
+
+$ python -m zim.bench -i ZIMFILE parallel -w 1 2 4 8
+$ python -m zim.bench -i ZIMFILE entries -n 100000
+"""
+import argparse
+import time
+
+from zim.zimpy_p3 import ZimFile, ArticleEntryFormat, RedirectEntryFormat, PositionalFile, open_zim, NULL
+
+
+def bench_parallel(filename, workers_list=(1, 2, 4, 8)):
+    """Decompresses every cluster with each number of workers and prints the throughput"""
+    from zim.parallel import ParallelClusterReader
+
+    baseline = None
+    print("workers,seconds,compressed_MB/s,uncompressed_MB/s,speedup")
+    for workers in workers_list:
+        file = ZimFile(filename=filename)
+        reader = ParallelClusterReader(file, workers=workers)
+        compressed = sum(end - ptr for ptr, end in zip(reader.ptrs, reader.ends))
+        start = time.perf_counter()
+        uncompressed = sum(len(raw) for cluster_index, raw in reader.iter_clusters())
+        elapsed = time.perf_counter() - start
+        reader.close()
+        file.close()
+        if baseline is None:
+            baseline = elapsed
+        print("{},{:.3f},{:.1f},{:.1f},{:.2f}".format(
+            workers, elapsed, compressed / elapsed / 1e6, uncompressed / elapsed / 1e6, baseline / elapsed))
+
+
+def read_bytewise(f, encoding='utf-8'):
+    """read_null_terminated as it was before entries were decoded in blocks:
+    one read(1) per byte"""
+    s = b""
+    while True:
+        b = f.read(1)
+        if b == NULL:
+            return s.decode(encoding)
+        if not b:
+            raise IOError("Unterminated string")
+        s = s + b
+
+
+def decode_bytewise(file, count):
+    """The entry formats on a seekable file, with the strings read a byte
+    at a time as they were (the baseline)"""
+    article_format, redirect_format = ArticleEntryFormat(), RedirectEntryFormat()
+    f = PositionalFile(file.filename)
+    for index in range(count):
+        ptr = file.read_url_pointer(index)
+        f.seek(ptr)
+        entry_format = redirect_format if f.read(2) == b'\xff\xff' else article_format
+        d = entry_format.unpack_format_from_file(f, ptr)
+        url = read_bytewise(f)
+        title = read_bytewise(f)
+        parameter = f.read(dict(d)['parameterLen'])
+        dict(d + [('url', url), ('title', title), ('parameter', parameter)])
+    f.close()
+
+
+def decode_single(file, count):
+    """One read_directory_entry_by_index (a read and a dict) per entry"""
+    for index in range(count):
+        file.read_directory_entry_by_index(index)
+
+
+def decode_file(file, count):
+    """The unpack_from_file of the entry formats, on a seekable file"""
+    article_format, redirect_format = ArticleEntryFormat(), RedirectEntryFormat()
+    f = PositionalFile(file.filename)
+    for index in range(count):
+        ptr = file.read_url_pointer(index)
+        f.seek(ptr)
+        entry_format = redirect_format if f.read(2) == b'\xff\xff' else article_format
+        dict(entry_format.unpack_from_file(f, ptr))
+    f.close()
+
+
+def decode_batch(file, count):
+    """read_directory_entries: blocks of entries into DirectoryEntry objects"""
+    file.read_directory_entries(0, count)
+
+
+def decode_columns(file, count):
+    """load_directory: every entry into the columns of a Directory"""
+    file.load_directory()
+
+
+DECODERS = [('bytewise', decode_bytewise), ('single', decode_single), ('file', decode_file), ('batch', decode_batch),
+            ('columns', decode_columns)]
+
+
+def bench_entries(filename, count=None, use_mmap=False):
+    """Decodes the first count directory entries (all of them by default,
+    always all for columns) with each decoder and prints the throughput,
+    and the speedup over the bytewise decoder"""
+    baseline = None
+    print("decoder,entries,seconds,entries/s,speedup")
+    for name, decode in DECODERS:
+        file = open_zim(filename, use_mmap=use_mmap)
+        n = file.header['articleCount']
+        if count is not None and name != 'columns':
+            n = min(count, n)
+        start = time.perf_counter()
+        decode(file, n)
+        elapsed = time.perf_counter() - start
+        file.close()
+        rate = n / elapsed
+        if baseline is None:
+            baseline = rate
+        print("{},{},{:.3f},{:.0f},{:.1f}".format(name, n, elapsed, rate, rate / baseline))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reading a ZIM file")
+    parser.add_argument('--input', '-i', help="The input zim file", required=True)
+    subparsers = parser.add_subparsers(help='commands', dest='command')
+    subparsers.required = True
+
+    parser_a = subparsers.add_parser('parallel', help='Decompress all clusters with 1, 2, 4 and 8 processes')
+    parser_a.add_argument('--workers', '-w', type=int, nargs='+', default=[1, 2, 4, 8],
+                          help='The numbers of worker processes to compare')
+
+    parser_b = subparsers.add_parser('entries', help='Decode directory entries one by one and in batches')
+    parser_b.add_argument('--count', '-n', type=int, help='Number of entries to decode (default: all)')
+    parser_b.add_argument('--mmap', '-m', action='store_true', help='Use the mmap reader')
+
+    args = parser.parse_args()
+
+    if args.command == 'parallel':
+        bench_parallel(filename=args.input, workers_list=args.workers)
+    elif args.command == 'entries':
+        bench_entries(filename=args.input, count=args.count, use_mmap=args.mmap)
+
+
+if __name__ == '__main__':
+    main()
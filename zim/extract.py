@@ -1,61 +1,106 @@
 """Dump the html pages out of .zim; OR print all urls.
 """
 import argparse
+import importlib
 
 import os
-from zim.zimpy_p3 import ZimFile
+import sys
+from zim.zimpy_p3 import open_zim, html_mimetypes
 
 
-def yield_url(file):
+def open_articles(filename, use_mmap=False, use_index=False):
+    """Opens the zim file and returns it, its metadata and the Directory of
+    its articles, taken from the sidecar index with use_index (None otherwise)"""
+    file = open_zim(filename, use_mmap=use_mmap)
+    if not use_index:
+        return file, None, None
+    from zim.sidecar import load_sidecar
+    index = load_sidecar(file)
+    return file, index.metadata, index.directory(file.mimeTypeList)
+
+
+def yield_url(file, directory=None):
     namespace = b'A'
-    for article in file.articles():
-        if article['namespace'] != namespace:
-            continue
-        body = file.get_article_by_index(
-            article['index'], follow_redirect=False)[0]
-        if not body:
-            continue
-        else:
-            yield article['url']
+    # read the blobs in cluster order, but print the urls in url order
+    blobs = file.iter_blobs_by_cluster(namespace=namespace, directory=directory,
+                                       mimetypes=html_mimetypes(file.mimeTypeList))
+    for index, url in sorted((entry['index'], entry['url']) for entry, body in blobs if body):
+        yield url
 
 
-def print_url(filename, full=False, edition=None):
-    file = ZimFile(filename=filename)
+def print_url(filename, full=False, edition=None, use_mmap=False, use_index=False):
+    file, metadata, directory = open_articles(filename, use_mmap=use_mmap, use_index=use_index)
 
     if not full:
-        for url in yield_url(file):
+        for url in yield_url(file, directory):
             print(url)
         return
 
     if not edition:
-        import parser.lang_code_conversion as languages
-        edition_lang_code = file.metadata()['language'].decode('utf-8')
-        # print(edition_lang_code)
-        edition = languages.get_wikt_code_from_iso639_3(edition_lang_code)
+        edition = edition_of(file, metadata)
 
-    for url in yield_url(file):
+    for url in yield_url(file, directory):
         print("https://{}.wiktionary.org/wiki/{}".format(edition, url[:-5]))
 
 
-def print_html(filename, path):
-    file = ZimFile(filename=filename)
+def print_html(filename, path, use_mmap=False, use_index=False):
+    file, metadata, directory = open_articles(filename, use_mmap=use_mmap, use_index=use_index)
     namespace = b'A'
-    for article in file.articles():
-        if article['namespace'] != namespace:
-            continue
-        body = file.get_article_by_index(
-            article['index'], follow_redirect=False)[0]
+    for entry, body in file.iter_blobs_by_cluster(namespace=namespace, directory=directory,
+                                                  mimetypes=html_mimetypes(file.mimeTypeList)):
         if not body:
             continue
         else:
-            url = article['url']
+            url = entry['url']
             with open(os.path.join(path, url), 'w+') as output_file:
-                print(body.decode('utf-8'), file=output_file)
+                print(str(body, 'utf-8'), file=output_file)
+
+
+def print_search(filename, prefix, limit=10, by_title=False, use_mmap=False):
+    file = open_zim(filename, use_mmap=use_mmap)
+    for entry in file.prefix_search(prefix, limit=limit, order='title' if by_title else 'url'):
+        print(entry['title'] if by_title and entry['title'] else entry['url'])
+
+
+def print_verify(filename, skip_checksum=False, use_mmap=False):
+    file = open_zim(filename, use_mmap=use_mmap)
+    problems = file.verify(checksum=not skip_checksum)
+    for problem in problems:
+        print("{}: {}".format(filename, problem))
+    if problems:
+        sys.exit(1)
+    print("{}: OK".format(filename))
+
+
+def edition_of(file, metadata=None):
+    """The Wiktionary edition code of the zim file, from its metadata"""
+    import parser.lang_code_conversion as languages
+    edition_lang_code = (metadata or file.metadata())['language'].decode('utf-8')
+    return languages.get_wikt_code_from_iso639_3(edition_lang_code)
+
+
+def print_pack(filename, output, edition=None, keep_all=False, codec='zstd', cluster_kb=1024, use_mmap=False):
+    from zim.pack import write_pack
+    from zim.zimpy_p3 import COMPRESSION_ZSTD, COMPRESSION_LZMA
+    file = open_zim(filename, use_mmap=use_mmap)
+    if keep_all:
+        def keep(html):
+            return True
+    else:
+        edition = edition or edition_of(file)
+        module = importlib.import_module('.parse_' + edition, package='parser')
+        keep = getattr(module, edition.capitalize() + "Parser")().prefilter
+    compression = {'zstd': COMPRESSION_ZSTD, 'lzma': COMPRESSION_LZMA}[codec]
+    count = write_pack(file, output, keep, compression=compression, cluster_size=cluster_kb << 10)
+    print("{}: {} articles packed into {}".format(filename, count, output))
 
 
 def main():
     parser = argparse.ArgumentParser(description="Print all urls in a ZIM file as a list")
     parser.add_argument('--input', '-i', help="The input zim file", required=True)
+    parser.add_argument('--mmap', '-m', action='store_true', help="Memory-map the zim file instead of reading it")
+    parser.add_argument('--index', '-x', action='store_true',
+                        help="Use (and build on first use) an index file next to the zim file")
     subparsers = parser.add_subparsers(help='commands', dest='command')
     subparsers.required = True
 
@@ -66,12 +111,38 @@ def main():
     parser_b = subparsers.add_parser('html', help='Extract all html from ZIM')
     parser_b.add_argument('--output', '-o', help='The output directory of the html file', required=True)
 
+    parser_c = subparsers.add_parser('search', help='Print the urls (or titles) of articles starting with a prefix')
+    parser_c.add_argument('prefix', help='The beginning of the url or title')
+    parser_c.add_argument('--limit', '-n', type=int, default=10, help='The maximum number of results')
+    parser_c.add_argument('--title', '-t', action='store_true', help='Search titles instead of urls')
+
+    parser_d = subparsers.add_parser('verify', help='Check the checksum and the structure of the ZIM file')
+    parser_d.add_argument('--skip_checksum', action='store_true', help='Do not compute the MD5 checksum')
+
+    parser_e = subparsers.add_parser('pack', help='Write the articles that may have translations to a pack file '
+                                                  'parser.py can read instead of the ZIM file')
+    parser_e.add_argument('--output', '-o', help='The pack file to write', required=True)
+    parser_e.add_argument('--edition', '-e', help='The edition whose parser chooses the articles')
+    parser_e.add_argument('--all', '-a', action='store_true', help='Keep every article')
+    parser_e.add_argument('--codec', choices=['zstd', 'lzma'], default='zstd', help='Compression of the pack')
+    parser_e.add_argument('--cluster_kb', type=int, default=1024, help='Size of the clusters of the pack before '
+                                                                        'compression, in KB')
+
     args = parser.parse_args()
 
     if args.command == 'html':
-        print_html(filename=args.input, path=args.output)
+        print_html(filename=args.input, path=args.output, use_mmap=args.mmap, use_index=args.index)
     elif args.command == 'url':
-        print_url(filename=args.input, full=args.full, edition=args.edition)
+        print_url(filename=args.input, full=args.full, edition=args.edition, use_mmap=args.mmap,
+                  use_index=args.index)
+    elif args.command == 'search':
+        print_search(filename=args.input, prefix=args.prefix, limit=args.limit, by_title=args.title,
+                     use_mmap=args.mmap)
+    elif args.command == 'pack':
+        print_pack(filename=args.input, output=args.output, edition=args.edition, keep_all=args.all,
+                   codec=args.codec, cluster_kb=args.cluster_kb, use_mmap=args.mmap)
+    elif args.command == 'verify':
+        print_verify(filename=args.input, skip_checksum=args.skip_checksum, use_mmap=args.mmap)
     else:
         print("Please specify a command.")
 
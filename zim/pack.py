@@ -0,0 +1,213 @@
+"""A pack: the articles of a .zim an edition parser may find translations
+in (see GeneralParser.prefilter), with their directory entries, the
+redirects to them and the metadata of the .zim.
+
+The articles are stored in ZIM style clusters, zstd compressed by default,
+so PackFile reads them with the same ClusterData and ClusterCache as
+ZimFile, and parser.py takes a pack wherever it takes a .zim.
+
+Layout: as the sidecar index, a header, then one (offset, length) pair per
+section, then the sections, then the clusters.
+"""
+import logging
+import os
+import shutil
+import struct
+import sys
+import uuid
+from array import array
+
+from zim.sidecar import SECTION, align, little_endian, pack_metadata, unpack_metadata
+from zim.zimpy_p3 import (Directory, ZimFile, ClusterCache, MimeTypeListFormat, PositionalFile,
+                          COMPRESSION_ZSTD, REDIRECT_MIMETYPE, html_mimetypes, pack_cluster)
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ZIMPACK\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sI16sQ')
+COLUMNS = [('indexes', 'I'), ('namespace', 'B'), ('mimetype', 'H'), ('cluster', 'I'), ('blob', 'I'),
+           ('redirect', 'I'), ('offsets', 'Q')]
+# the articles and the redirects to them are each stored as a Directory
+SECTIONS = (['metadata', 'mimetypes', 'clusters'] +
+            [kind + '.' + name for kind in ('article', 'redirect') for name, typecode in COLUMNS + [('pool', 'B')]])
+
+
+def is_pack(filename):
+    """Whether filename is a pack (rather than a .zim)"""
+    if not os.path.isfile(filename):
+        # a .zim split into chunks
+        return False
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class PackFile(object):
+    """A pack opened for reading, with the part of the ZimFile interface
+    parser.py uses"""
+
+    def __init__(self, filename, cache_size=None, cache_bytes=64 << 20, cache_policy='lru'):
+        self.filename = filename
+        self.f = PositionalFile(filename)
+        head = self.f.pread(HEADER.size + SECTION.size * len(SECTIONS), 0)
+        magic, version, self.uuid, self.article_count = HEADER.unpack_from(head)
+        if magic != MAGIC or version != VERSION:
+            self.f.close()
+            raise IOError("%s is not a pack of version %s" % (filename, VERSION))
+        self.sections = {}
+        for i, name in enumerate(SECTIONS):
+            self.sections[name] = SECTION.unpack_from(head, HEADER.size + i * SECTION.size)
+        self.mimeTypeList = MimeTypeListFormat().unpack(self.section('mimetypes'))
+        self.clusterCache = ClusterCache(cache_size=cache_size, max_bytes=cache_bytes, policy=cache_policy)
+        # one more pointer than clusters: the end of the last one
+        self.cluster_pointers = self.column('clusters', 'Q')
+
+    def close(self):
+        self.clusterCache.clear()
+        self.f.close()
+
+    def section(self, name):
+        offset, length = self.sections[name]
+        return self.f.pread(length, offset)
+
+    def column(self, name, typecode):
+        column = array(typecode)
+        column.frombytes(self.section(name))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    def get_uuid(self):
+        """Returns the UUID of the .zim the pack was made from"""
+        return uuid.UUID(bytes=self.uuid)
+
+    def metadata(self):
+        return unpack_metadata(self.section('metadata'))
+
+    def read_directory(self, kind):
+        d = Directory(self.mimeTypeList)
+        for name, typecode in COLUMNS:
+            setattr(d, name, self.column(kind + '.' + name, typecode))
+        d.namespace = bytearray(d.namespace)
+        d.pool = self.section(kind + '.pool')
+        return d
+
+    def load_directory(self, namespace=None):
+        """Returns the articles as a Directory (with indexes set), in cluster order"""
+        return self.read_directory('article')
+
+    def aliases(self, namespace=b'A'):
+        """Returns {ZIM index of an article: [titles of the redirects to it]}"""
+        redirects = self.read_directory('redirect')
+        aliases = {}
+        for i in range(len(redirects)):
+            aliases.setdefault(redirects.redirect[i], []).append(redirects.title(i) or redirects.url(i))
+        return aliases
+
+    def cluster_ranges(self):
+        return self.cluster_pointers[:-1], self.cluster_pointers[1:]
+
+    def read_cluster(self, cluster_index):
+        """Reads and decompresses a whole cluster, see ClusterCache.read_cluster"""
+        ptr, end = self.cluster_pointers[cluster_index], self.cluster_pointers[cluster_index + 1]
+        return self.clusterCache.read_cluster(self.f, ptr, end)
+
+    def read_blob(self, cluster_index, blob_index):
+        ptr, end = self.cluster_pointers[cluster_index], self.cluster_pointers[cluster_index + 1]
+        return self.clusterCache.read_blob(self.f, ptr, end, blob_index)
+
+    # these only go through load_directory, cluster_ranges and read_cluster
+    plan_shards = ZimFile.plan_shards
+    sample_articles = ZimFile.sample_articles
+    iter_blobs_by_cluster = ZimFile.iter_blobs_by_cluster
+
+
+def directory_sections(kind, directory):
+    """The sections holding directory, as {section name: bytes}"""
+    sections = {}
+    for name, typecode in COLUMNS:
+        column = getattr(directory, name)
+        if not isinstance(column, array):
+            column = array(typecode, column)
+        sections[kind + '.' + name] = little_endian(column)
+    sections[kind + '.pool'] = bytes(directory.pool)
+    return sections
+
+
+def write_pack(zim_file, path, keep, compression=COMPRESSION_ZSTD, cluster_size=1 << 20):
+    """Writes the namespace 'A' html pages of zim_file whose html keep(html)
+    accepts, and the redirects to them, to a pack at path, atomically.
+    Articles are grouped into clusters of about cluster_size bytes before
+    compression. Returns the number of articles kept."""
+    directory = zim_file.load_directory(namespace=b'A')
+    start = directory.indexes.start
+    kept = []
+    clusters = array('I')
+    blobs = array('I')
+    ptrs = [0]
+    pending = []
+    pending_size = 0
+
+    tmp = path + '.tmp'
+    clusters_tmp = path + '.clusters.tmp'
+    with open(clusters_tmp, 'wb') as clusters_file:
+        def flush():
+            data = pack_cluster(pending, compression)
+            clusters_file.write(data)
+            ptrs.append(ptrs[-1] + len(data))
+            del pending[:]
+
+        pages = zim_file.iter_blobs_by_cluster(namespace=b'A', directory=directory,
+                                               mimetypes=html_mimetypes(zim_file.mimeTypeList))
+        for entry, blob in pages:
+            if not keep(str(blob, 'utf-8')):
+                continue
+            kept.append(entry['index'] - start)
+            clusters.append(len(ptrs) - 1)
+            blobs.append(len(pending))
+            pending.append(blob)
+            pending_size += len(blob)
+            if pending_size >= cluster_size:
+                flush()
+                pending_size = 0
+        if pending:
+            flush()
+
+    articles = directory.subset(kept)
+    articles.cluster = clusters
+    articles.blob = blobs
+
+    # the redirects, pointing straight at the article they end at
+    final = directory.resolve_redirects()
+    targets = set(articles.indexes)
+    redirect_indexes = [i for i in range(len(directory))
+                        if directory.mimetype[i] == REDIRECT_MIMETYPE and final[i] in targets]
+    redirects = directory.subset(redirect_indexes)
+    redirects.redirect = array('I', [final[i] for i in redirect_indexes])
+
+    sections = {'metadata': pack_metadata(zim_file.metadata()),
+                'mimetypes': MimeTypeListFormat().pack(zim_file.mimeTypeList)}
+    sections.update(directory_sections('article', articles))
+    sections.update(directory_sections('redirect', redirects))
+    sections['clusters'] = bytes(8 * len(ptrs))
+
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    # the clusters follow the sections, so their pointers are known once the
+    # sizes of the sections are
+    base = offset + sum(len(align(data)) for data in sections.values())
+    sections['clusters'] = little_endian(array('Q', [base + ptr for ptr in ptrs]))
+    table = b''
+    body = b''
+    for name in SECTIONS:
+        table += SECTION.pack(offset + len(body), len(sections[name]))
+        body += align(sections[name])
+
+    header = HEADER.pack(MAGIC, VERSION, zim_file.get_uuid().bytes, len(articles))
+    with open(tmp, 'wb') as f:
+        f.write(header + table + body)
+        with open(clusters_tmp, 'rb') as clusters_file:
+            shutil.copyfileobj(clusters_file, f)
+    os.remove(clusters_tmp)
+    os.replace(tmp, path)
+    logger.info("Packed %d of %d articles of %s into %s" % (len(articles), len(directory), zim_file.filename, path))
+    return len(articles)
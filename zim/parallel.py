@@ -0,0 +1,97 @@
+"""Decompress the clusters of a .zim in a pool of processes.
+
+Each worker opens the file once and is handed cluster ranges taken from the
+cluster pointer list. Results come back in submission order, with at most
+max_pending clusters in flight, so memory stays bounded however large the file.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from zim.zimpy_p3 import open_positional, decompress_cluster, split_blobs, cluster_flags
+
+# the file opened by _open_worker_file in each worker process
+_worker_file = None
+
+
+def _open_worker_file(filename):
+    global _worker_file
+    _worker_file = open_positional(filename)
+
+
+def _read_cluster(f, start, end, blob_indexes):
+    data = f.pread(end - start, start)
+    raw = decompress_cluster(data)
+    if blob_indexes is None:
+        return raw
+    return split_blobs(raw, blob_indexes, cluster_flags(data[0])[1])
+
+
+def _read_cluster_in_worker(start, end, blob_indexes):
+    return _read_cluster(_worker_file, start, end, blob_indexes)
+
+
+class ParallelClusterReader(object):
+    """Reads and decompresses clusters of a ZimFile in worker processes.
+
+    With workers=1 everything runs in the calling process, which is the
+    baseline the parallel runs are compared to.
+    """
+
+    def __init__(self, zim_file, workers=None, max_pending=None):
+        self.zim_file = zim_file
+        self.ptrs, self.ends = zim_file.cluster_ranges()
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+        if self.workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                initializer=_open_worker_file,
+                                                initargs=(zim_file.filename,))
+        self.max_pending = max_pending or 2 * self.workers
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _map(self, tasks):
+        """Yields (cluster_index, result) for (cluster_index, blob_indexes)
+        tasks, in order, with at most max_pending clusters submitted ahead"""
+        loads = self.zim_file.clusterCache.loads
+        if self.executor is None:
+            f = self.zim_file.f
+            for cluster_index, blob_indexes in tasks:
+                ptr = self.ptrs[cluster_index]
+                loads[ptr] += 1
+                yield cluster_index, _read_cluster(f, ptr, self.ends[cluster_index], blob_indexes)
+            return
+
+        pending = deque()
+        for cluster_index, blob_indexes in tasks:
+            ptr = self.ptrs[cluster_index]
+            loads[ptr] += 1
+            pending.append((cluster_index, self.executor.submit(
+                _read_cluster_in_worker, ptr, self.ends[cluster_index], blob_indexes)))
+            if len(pending) >= self.max_pending:
+                cluster_index, future = pending.popleft()
+                yield cluster_index, future.result()
+        while pending:
+            cluster_index, future = pending.popleft()
+            yield cluster_index, future.result()
+
+    def iter_clusters(self, cluster_indexes=None):
+        """Generator of (cluster_index, uncompressed cluster content)"""
+        if cluster_indexes is None:
+            cluster_indexes = range(len(self.ptrs))
+        return self._map((cluster_index, None) for cluster_index in cluster_indexes)
+
+    def iter_blobs_by_cluster(self, namespace=b'A', directory=None, clusters=None, mimetypes=None):
+        """Same as ZimFile.iter_blobs_by_cluster, with the clusters decompressed
+        and split into blobs by the workers"""
+        if directory is None:
+            directory = self.zim_file.load_directory(namespace=namespace)
+        groups = directory.cluster_groups(namespace, mimetypes, clusters)
+        tasks = ((cluster_index, [directory.blob[index] for index in group]) for cluster_index, group in groups)
+        for (cluster_index, group), (_, blobs) in zip(groups, self._map(tasks)):
+            for index, blob in zip(group, blobs):
+                yield directory.entry(index), blob
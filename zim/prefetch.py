@@ -0,0 +1,108 @@
+"""Read and decompress the clusters of a .zim in a background thread.
+
+While the caller parses the blobs of one cluster, a thread reads and
+decompresses the next ones, in the order the caller will want them, at most
+depth clusters ahead so memory stays bounded. File reads and the
+decompressors release the GIL, so the I/O and decompression overlap with
+the parsing even on one core. Each time the caller has to wait for a
+cluster the thread has not finished yet counts as a stall.
+"""
+import logging
+import threading
+import time
+from contextlib import closing
+from queue import Queue, Full
+
+from zim.zimpy_p3 import entries_by_cluster
+
+logger = logging.getLogger(__name__)
+
+# what the thread puts in the queue after the last cluster
+_DONE = (None, None, None)
+
+
+class ClusterPrefetcher(object):
+    """Reads and decompresses clusters of a ZimFile (or a PackFile) up to
+    depth clusters ahead of the consumer, in a thread"""
+
+    def __init__(self, zim_file, depth=4):
+        self.zim_file = zim_file
+        self.depth = max(depth, 1)
+        self.clusters = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+
+    def _prefetch(self, cluster_indexes, queue, stop):
+        def put(item):
+            # give up if the consumer went away while the queue is full
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        try:
+            for cluster_index in cluster_indexes:
+                if not put((cluster_index, self.zim_file.read_cluster(cluster_index), None)):
+                    return
+        except Exception as e:
+            put((None, None, e))
+            return
+        put(_DONE)
+
+    def iter_clusters(self, cluster_indexes):
+        """Generator of (cluster_index, cluster data) for cluster_indexes, in
+        their order"""
+        queue = Queue(self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._prefetch, args=(cluster_indexes, queue, stop),
+                                  name='zim-prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                if queue.empty():
+                    start = time.perf_counter()
+                    item = queue.get()
+                    if item is not _DONE:
+                        self.stalls += 1
+                        self.stall_time += time.perf_counter() - start
+                else:
+                    item = queue.get()
+                cluster_index, cluster_data, error = item
+                if error is not None:
+                    raise error
+                if item is _DONE:
+                    return
+                self.clusters += 1
+                yield cluster_index, cluster_data
+        finally:
+            stop.set()
+            thread.join()
+
+    def iter_blobs_by_cluster(self, namespace=b'A', directory=None, clusters=None, mimetypes=None):
+        """Same as ZimFile.iter_blobs_by_cluster, with the clusters read and
+        decompressed ahead by the thread"""
+        if directory is None:
+            directory = self.zim_file.load_directory(namespace=namespace)
+        groups = directory.cluster_groups(namespace, mimetypes, clusters)
+        cluster_indexes = [cluster_index for cluster_index, group in groups]
+        with closing(self.iter_clusters(cluster_indexes)) as prefetched:
+            for (cluster_index, group), (_, cluster_data) in zip(groups, prefetched):
+                for index in group:
+                    yield directory.entry(index), cluster_data.read_blob(directory.blob[index])
+
+    def iter_blobs_of_entries(self, entries, mimetypes=None):
+        """Same as ZimFile.iter_blobs_of_entries, with the clusters read and
+        decompressed ahead by the thread"""
+        groups = entries_by_cluster(entries, self.zim_file.mimeTypeList, mimetypes)
+        cluster_indexes = [cluster_index for cluster_index, group in groups]
+        with closing(self.iter_clusters(cluster_indexes)) as prefetched:
+            for (cluster_index, group), (_, cluster_data) in zip(groups, prefetched):
+                for entry in group:
+                    yield entry, cluster_data.read_blob(entry['blobNumber'])
+
+    def stats(self):
+        return {'depth': self.depth, 'clusters': self.clusters, 'stalls': self.stalls,
+                'stall_time': self.stall_time}
@@ -0,0 +1,215 @@
+"""Read a .zim served over HTTP(S) without downloading it.
+
+HttpFile has the interface of PositionalFile, so ZimFile reads a url as it
+reads a local file. Bytes are fetched with Range requests in aligned blocks
+kept in an LRU cache, over keep-alive connections taken from a small pool.
+When misses follow each other through the file, as in a scan of clusters in
+order, each request also fetches the blocks after the missing ones, twice as
+many each time up to max_readahead.
+"""
+import http.client
+import logging
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+def is_url(filename):
+    return filename.startswith(('http://', 'https://'))
+
+
+class HttpFile(object):
+    """A read-only file at an HTTP(S) url, read with Range requests. Any
+    number of threads can read it at once; seek(), tell() and read() keep a
+    position per thread."""
+
+    def __init__(self, url, block_size=1 << 20, cache_blocks=64, max_readahead=16, timeout=60, connections=4):
+        self.name = url
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.max_readahead = max_readahead
+        self.timeout = timeout
+        self.connections = connections
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pool = []
+        self.blocks = OrderedDict()
+        self.readahead = 0
+        self.next_miss = None
+        self.etag = None
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.set_url(url)
+        # the first block also tells the size of the file
+        self.size = None
+        self.fetch(0, 1)
+
+    def set_url(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise IOError("Not an http(s) url: %s" % url)
+        self.url = url
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        with self.lock:
+            for conn in self.pool:
+                conn.close()
+            self.pool = []
+
+    def connect(self):
+        with self.lock:
+            if self.pool:
+                return self.pool.pop()
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def release(self, conn):
+        with self.lock:
+            if len(self.pool) < self.connections:
+                self.pool.append(conn)
+                return
+        conn.close()
+
+    def fileno(self):
+        raise IOError("%s is not a local file" % self.name)
+
+    def close(self):
+        with self.lock:
+            for conn in self.pool:
+                conn.close()
+            self.pool = []
+            self.blocks.clear()
+
+    def request(self, start, end):
+        """Returns the bytes from start to end (exclusive) of the file, in
+        one Range request, retried once on a fresh connection"""
+        headers = {'Range': 'bytes=%d-%d' % (start, end - 1)}
+        # a strong ETag makes the server send the whole (new) file instead of
+        # a range of it if it changed since the first request
+        if self.etag and not self.etag.startswith('W/'):
+            headers['If-Range'] = self.etag
+        for attempt in range(6):
+            conn = self.connect()
+            try:
+                conn.request('GET', self.path, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                if attempt:
+                    raise IOError("Cannot read %s: %s" % (self.url, e))
+                logger.debug("Retrying %s on a new connection (%s)" % (self.url, e))
+                continue
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(conn)
+            if response.status in REDIRECTS and response.getheader('Location'):
+                self.set_url(urljoin(self.url, response.getheader('Location')))
+                continue
+            if response.status == 200:
+                raise IOError("%s changed or its server does not support Range requests" % self.url)
+            if response.status == 416:
+                # asked past the end of the file
+                return b''
+            if response.status != 206:
+                raise IOError("Cannot read %s: HTTP %s %s" % (self.url, response.status, response.reason))
+            match = CONTENT_RANGE.match(response.getheader('Content-Range', ''))
+            if not match or int(match.group(1)) != start:
+                raise IOError("Unexpected Content-Range from %s" % self.url)
+            if self.size is None:
+                self.size = int(match.group(3))
+                self.etag = response.getheader('ETag')
+            with self.lock:
+                self.requests += 1
+                self.bytes_fetched += len(data)
+            return data
+        raise IOError("Too many redirects from %s" % self.url)
+
+    def fetch(self, first, last):
+        """Fetches blocks first to last (exclusive) and the read-ahead after
+        them into the cache, and returns blocks first to last"""
+        with self.lock:
+            if first == self.next_miss:
+                self.readahead = min(max(2 * self.readahead, 1), self.max_readahead)
+            else:
+                self.readahead = 0
+            end = last + self.readahead
+            if self.size is not None:
+                end = min(end, -(-self.size // self.block_size))
+            self.next_miss = end
+        data = self.request(first * self.block_size, end * self.block_size)
+        blocks = [data[offset:offset + self.block_size] for offset in range(0, len(data), self.block_size)]
+        with self.lock:
+            for block, block_data in enumerate(blocks, first):
+                self.blocks[block] = block_data
+                self.blocks.move_to_end(block)
+            while len(self.blocks) > max(self.cache_blocks, len(blocks)):
+                self.blocks.popitem(last=False)
+        return blocks[:last - first]
+
+    def pread(self, size, offset):
+        """Returns size bytes (less at the end of the file) read at offset"""
+        end = min(offset + size, self.size)
+        if end <= offset:
+            return b''
+        first, last = offset // self.block_size, (end - 1) // self.block_size + 1
+        chunks = []
+        block = first
+        while block < last:
+            with self.lock:
+                data = self.blocks.get(block)
+                if data is not None:
+                    self.blocks.move_to_end(block)
+                    self.hits += 1
+            if data is None:
+                # one request for the run of missing blocks
+                missing = block + 1
+                with self.lock:
+                    self.misses += 1
+                    while missing < last and missing not in self.blocks:
+                        missing += 1
+                chunks.extend(self.fetch(block, missing))
+                block = missing
+            else:
+                chunks.append(data)
+                block += 1
+        data = b''.join(chunks)
+        start = offset - first * self.block_size
+        return data[start:start + end - offset]
+
+    def tell(self):
+        return getattr(self.local, 'pos', 0)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.tell()
+        elif whence == 2:
+            offset += self.size
+        self.local.pos = offset
+        return offset
+
+    def read(self, size=-1):
+        pos = self.tell()
+        if size is None or size < 0:
+            size = max(self.size - pos, 0)
+        data = self.pread(size, pos)
+        self.local.pos = pos + len(data)
+        return data
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'bytes_fetched': self.bytes_fetched, 'hits': self.hits,
+                    'misses': self.misses, 'blocks': len(self.blocks), 'block_size': self.block_size}
@@ -0,0 +1,196 @@
+"""Build-once index stored next to a .zim (foo.zim.idx).
+
+It holds the metadata, the namespace boundaries and the namespace 'A'
+non-redirect articles (url, title, cluster and blob), in cluster order.
+It is keyed by the UUID, the size and the MD5 checksum of the .zim, and
+rebuilt by load_sidecar whenever those no longer match. The namespace
+boundaries answer ZimFile.namespace_range once the index is loaded.
+
+Layout: a header, then one (offset, length) pair per section, then the
+sections. The column sections are 8-byte aligned so that they can be
+used straight from a memory map.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from urllib.parse import urlsplit
+
+from zim.remote import is_url
+from zim.zimpy_p3 import Directory, NO_REDIRECT
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ZIMIDX\x00\x00'
+VERSION = 2
+HEADER = struct.Struct('<8sI16sQ16sQ')
+SECTIONS = ['namespaces', 'metadata', 'indexes', 'mimetype', 'cluster', 'blob', 'offsets', 'pool']
+SECTION = struct.Struct('<QQ')
+NAMESPACE = struct.Struct('<cxxxII')
+METADATA = struct.Struct('<II')
+
+
+def sidecar_path(filename):
+    if is_url(filename):
+        # next to the program rather than the remote file
+        return os.path.basename(urlsplit(filename).path) + '.idx'
+    return filename + '.idx'
+
+
+class SidecarIndex(object):
+    """A sidecar index opened through a read-only memory map"""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < HEADER.size or self.mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise IOError("%s is not a sidecar index" % path)
+        magic, version, self.uuid, self.file_size, self.checksum, self.article_count = \
+            HEADER.unpack_from(self.mm, 0)
+        if version != VERSION:
+            self.close()
+            raise IOError("%s is not a sidecar index of version %s" % (path, VERSION))
+        self.sections = {}
+        for i, name in enumerate(SECTIONS):
+            self.sections[name] = SECTION.unpack_from(self.mm, HEADER.size + i * SECTION.size)
+        self.namespaces = self._read_namespaces()
+        self.metadata = self._read_metadata()
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+    def section(self, name):
+        offset, length = self.sections[name]
+        return self.mm[offset:offset + length]
+
+    def _read_namespaces(self):
+        data = self.section('namespaces')
+        namespaces = {}
+        for namespace, start, end in NAMESPACE.iter_unpack(data):
+            namespaces[namespace] = (start, end)
+        return namespaces
+
+    def namespace_range(self, namespace):
+        """Returns the range of indexes of the entries in namespace, empty
+        where the namespace would be if it has none"""
+        if namespace in self.namespaces:
+            return range(*self.namespaces[namespace])
+        start = min((start for other, (start, end) in self.namespaces.items() if other > namespace),
+                    default=max((end for start, end in self.namespaces.values()), default=0))
+        return range(start, start)
+
+    def _read_metadata(self):
+        return unpack_metadata(self.section('metadata'))
+
+    def matches(self, zim_file):
+        """Whether the index was built from this very ZIM file"""
+        return (self.uuid == zim_file.get_uuid().bytes and self.file_size == zim_file.f.size
+                and self.checksum == zim_checksum(zim_file))
+
+    def column(self, name, typecode):
+        column = array(typecode)
+        column.frombytes(self.section(name))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    def directory(self, mime_types):
+        """Returns the articles as a Directory (with indexes set), in cluster order"""
+        d = Directory(mime_types)
+        d.indexes = self.column('indexes', 'I')
+        d.mimetype = self.column('mimetype', 'H')
+        d.cluster = self.column('cluster', 'I')
+        d.blob = self.column('blob', 'I')
+        d.offsets = self.column('offsets', 'Q')
+        d.pool = self.section('pool')
+        d.namespace = bytearray(b'A') * len(d.mimetype)
+        d.redirect = array('I', [NO_REDIRECT]) * len(d.mimetype)
+        return d
+
+
+def unpack_metadata(data):
+    """Decodes the metadata section: {name: value as bytes}"""
+    metadata = {}
+    pos = 0
+    while pos < len(data):
+        name_len, value_len = METADATA.unpack_from(data, pos)
+        pos += METADATA.size
+        name = bytes(data[pos:pos + name_len]).decode('utf-8')
+        metadata[name] = bytes(data[pos + name_len:pos + name_len + value_len])
+        pos += name_len + value_len
+    return metadata
+
+
+def pack_metadata(metadata):
+    """Encodes {name: value as bytes} as a metadata section"""
+    return b''.join(METADATA.pack(len(name.encode('utf-8')), len(value)) + name.encode('utf-8') + value
+                    for name, value in sorted(metadata.items()))
+
+
+def align(data, size=8):
+    return data + bytes(-len(data) % size)
+
+
+def little_endian(column):
+    """The bytes of an array in little endian order"""
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def zim_checksum(zim_file):
+    """The MD5 checksum stored at the end of zim_file"""
+    return bytes(zim_file.f.pread(16, zim_file.header['checksumPos']))
+
+
+def build_sidecar(zim_file, path):
+    """Builds the sidecar index of zim_file at path, atomically"""
+    directory = zim_file.load_directory()
+    articles = directory.subset(directory.cluster_order(directory.select(namespace=b'A', redirects=False)))
+
+    namespaces = b''.join(NAMESPACE.pack(namespace, start, end)
+                          for namespace, (start, end) in sorted(directory.namespace_ranges().items()))
+    metadata = pack_metadata(zim_file.metadata())
+    sections = [namespaces, metadata, little_endian(articles.indexes), little_endian(articles.mimetype),
+                little_endian(articles.cluster), little_endian(articles.blob), little_endian(articles.offsets),
+                bytes(articles.pool)]
+
+    header = HEADER.pack(MAGIC, VERSION, zim_file.get_uuid().bytes,
+                         zim_file.f.size, zim_checksum(zim_file), len(articles))
+    offset = len(header) + SECTION.size * len(SECTIONS)
+    table = b''
+    body = b''
+    for data in sections:
+        table += SECTION.pack(offset + len(body), len(data))
+        body += align(data)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header + table + body)
+    os.replace(tmp, path)
+
+
+def load_sidecar(zim_file, path=None):
+    """Opens the sidecar index of zim_file, building it first if it is
+    missing or was built from another file. zim_file uses it from then on
+    (see ZimFile.namespace_range)"""
+    path = path or sidecar_path(zim_file.filename)
+    if os.path.exists(path):
+        try:
+            index = SidecarIndex(path)
+            if index.matches(zim_file):
+                zim_file.sidecar = index
+                return index
+            index.close()
+            logger.info("Sidecar index %s is stale; rebuilding it" % path)
+        except (IOError, ValueError, struct.error) as e:
+            logger.info("Cannot read sidecar index %s (%s); rebuilding it" % (path, e))
+    build_sidecar(zim_file, path)
+    zim_file.sidecar = SidecarIndex(path)
+    return zim_file.sidecar
@@ -0,0 +1,165 @@
+"""Keep decompressed clusters on disk across runs.
+
+A SpillCache stores each cluster a ZimFile decompresses in a file of its own
+under root/<UUID of the .zim>/, so a later run over the same .zim maps the
+file instead of decompressing the cluster again. Files are written
+atomically and dropped least recently used first once they hold more than
+max_bytes in all, whatever .zim they belong to.
+
+A file is a header holding the time the cluster took to decompress, then
+the cluster as an uncompressed ZIM cluster, read with MmapClusterData.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from zim.zimpy_p3 import MmapClusterData, COMPRESSION_NONE, EXTENDED_CLUSTER
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ZIMSPILL'
+HEADER = struct.Struct('<8sd')
+SUFFIX = '.cluster'
+
+
+class SpillCache(object):
+    """The decompressed clusters of the .zim with UUID zim_uuid stored under
+    root, at most max_bytes of clusters of any .zim under root"""
+
+    def __init__(self, root, zim_uuid, max_bytes=4 << 30):
+        self.root = root
+        self.path = os.path.join(root, zim_uuid.hex)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # reads of clusters stored uncompressed in the .zim, which are not
+        # spilled and count as neither hits nor misses
+        self.uncompressed = 0
+        self.uncompressed_clusters = set()
+        self.bytes_saved = 0
+        self.time_saved = 0.0
+        self.bytes_written = 0
+        os.makedirs(self.path, exist_ok=True)
+        # every file under root, least recently used first
+        self.files = OrderedDict()
+        self.bytes = 0
+        found = []
+        for name in os.listdir(root):
+            directory = os.path.join(root, name)
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.name.endswith(SUFFIX):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.path, stat.st_size))
+        for mtime, path, size in sorted(found):
+            self.files[path] = size
+            self.bytes += size
+
+    def cluster_path(self, cluster_index):
+        return os.path.join(self.path, str(cluster_index) + SUFFIX)
+
+    def get(self, cluster_index):
+        """Returns the cluster as a MmapClusterData, or None if it is not stored"""
+        path = self.cluster_path(cluster_index)
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)
+        except (IOError, ValueError):
+            # missing, empty, or dropped by another process meanwhile
+            return None
+        magic, decompress_time = HEADER.unpack_from(mm) if len(mm) > HEADER.size else (None, 0.0)
+        if magic != MAGIC:
+            logger.warning("Dropping %s, which is not a spilled cluster" % path)
+            mm.close()
+            self.remove(path)
+            return None
+        cluster = MmapClusterData(memoryview(mm), HEADER.size, len(mm))
+        with self.lock:
+            if path in self.files:
+                self.files.move_to_end(path)
+            self.hits += 1
+            self.bytes_saved += len(mm) - HEADER.size - 1
+            self.time_saved += decompress_time
+        return cluster
+
+    def put(self, cluster_index, cluster):
+        """Stores a completely decompressed cluster (a ClusterData)"""
+        if not cluster.compressed:
+            # nothing to save: it is read straight from the .zim
+            return
+        flag = COMPRESSION_NONE | (EXTENDED_CLUSTER if cluster.offset_size == 8 else 0)
+        size = HEADER.size + 1 + len(cluster.uncomp_buf)
+        if size > self.max_bytes:
+            return
+        path = self.cluster_path(cluster_index)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, cluster.decompress_time))
+                f.write(bytes([flag]))
+                f.write(cluster.uncomp_buf)
+            os.replace(tmp, path)
+        except (IOError, OSError) as e:
+            logger.warning("Cannot spill cluster %s to %s: %s" % (cluster_index, path, e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self.lock:
+            self.bytes += size - self.files.pop(path, 0)
+            self.files[path] = size
+            self.bytes_written += size
+            victims = []
+            while self.bytes > self.max_bytes and len(self.files) > 1:
+                victim, victim_size = self.files.popitem(last=False)
+                self.bytes -= victim_size
+                victims.append(victim)
+        for victim in victims:
+            self.remove(victim)
+
+    def remove(self, path):
+        with self.lock:
+            self.bytes -= self.files.pop(path, 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def read_cluster(self, cluster_index, load):
+        """Returns the cluster from the disk, or load(cluster_index) stored
+        on the disk for the next time"""
+        if cluster_index in self.uncompressed_clusters:
+            with self.lock:
+                self.uncompressed += 1
+            return load(cluster_index)
+        cluster = self.get(cluster_index)
+        if cluster is not None:
+            return cluster
+        cluster = load(cluster_index)
+        with self.lock:
+            if cluster.compressed:
+                self.misses += 1
+            else:
+                self.uncompressed += 1
+                self.uncompressed_clusters.add(cluster_index)
+        self.put(cluster_index, cluster)
+        return cluster
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'uncompressed': self.uncompressed,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'bytes_saved': self.bytes_saved,
+                    'time_saved': self.time_saved,
+                    'bytes_written': self.bytes_written,
+                    'files': len(self.files),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes}
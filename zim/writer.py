@@ -0,0 +1,268 @@
+"""Write .zim files, e.g. synthetic Wiktionary dumps for tests and benchmarks.
+
+$ python -m zim.writer -o de.zim -n 10000 -e de
+
+ZimWriter lays out the header, the mime type list, the pointer lists, the
+directory entries and the clusters with the formats of zim.zimpy_p3, and
+ends the file with its MD5 checksum. generate_zim fills it with pages made
+from the TEMPLATES of an edition, which its parser finds translations in.
+The same arguments always give the same file.
+"""
+import argparse
+import hashlib
+import random
+import tempfile
+import uuid
+from array import array
+
+from zim.sidecar import little_endian
+from zim.zimpy_p3 import (HeaderFormat, ArticleEntryFormat, RedirectEntryFormat, MimeTypeListFormat,
+                          COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_BZIP2, COMPRESSION_LZMA, COMPRESSION_ZSTD,
+                          REDIRECT_MIMETYPE, NO_REDIRECT, pack_cluster)
+
+MAGIC_NUMBER = 72173914
+VERSION = 5
+
+CODECS = {
+    'none': COMPRESSION_NONE,
+    'zlib': COMPRESSION_ZLIB,
+    'bz2': COMPRESSION_BZIP2,
+    'lzma': COMPRESSION_LZMA,
+    'zstd': COMPRESSION_ZSTD,
+}
+
+
+class ZimWriter(object):
+    """Collects the entries of a ZIM file and writes it.
+
+    Blobs are put into clusters of about cluster_size bytes in the order they
+    are added; those of mimetypes outside text/ (images...) go to clusters
+    of their own, which are not compressed. Compressed clusters are spooled
+    to a temporary file until write() is called.
+    """
+
+    def __init__(self, compression=COMPRESSION_LZMA, cluster_size=1 << 20):
+        self.compression = compression
+        self.cluster_size = cluster_size
+        self.mime_types = []
+        # (namespace, url) -> [title, mimetype, cluster or target (namespace, url), blob]
+        self.entries = {}
+        self.main_page = None
+        self.clusters = tempfile.TemporaryFile()
+        self.cluster_pointers = [0]
+        # blobs waiting to be written, their entries and their size, per
+        # compression of the cluster they go to
+        self.pending = {}
+
+    def close(self):
+        self.clusters.close()
+
+    def _mimetype(self, mimetype):
+        if mimetype not in self.mime_types:
+            self.mime_types.append(mimetype)
+        return self.mime_types.index(mimetype)
+
+    def _flush(self, compression):
+        blobs, waiting, size = self.pending.pop(compression)
+        data = pack_cluster(blobs, compression)
+        self.clusters.write(data)
+        self.cluster_pointers.append(self.cluster_pointers[-1] + len(data))
+        for entry in waiting:
+            entry[2] = len(self.cluster_pointers) - 2
+
+    def add_article(self, namespace, url, title, content, mimetype='text/html'):
+        if (namespace, url) in self.entries:
+            raise ValueError("Entry %s/%s is added twice" % (namespace.decode('utf-8'), url))
+        compression = self.compression if mimetype.startswith('text/') else COMPRESSION_NONE
+        blobs, waiting, size = self.pending.setdefault(compression, ([], [], [0]))
+        # the cluster number is set once the cluster is written
+        entry = [title, self._mimetype(mimetype), None, len(blobs)]
+        self.entries[(namespace, url)] = entry
+        blobs.append(content)
+        waiting.append(entry)
+        size[0] += len(content)
+        if size[0] >= self.cluster_size:
+            self._flush(compression)
+
+    def add_redirect(self, namespace, url, title, target_namespace, target_url):
+        if (namespace, url) in self.entries:
+            raise ValueError("Entry %s/%s is added twice" % (namespace.decode('utf-8'), url))
+        self.entries[(namespace, url)] = [title, REDIRECT_MIMETYPE, (target_namespace, target_url), None]
+
+    def add_metadata(self, name, value):
+        self.add_article(b'M', name, '', value, mimetype='text/plain')
+
+    def write(self, filename, zim_uuid=None):
+        """Writes the ZIM file. The entries and clusters are kept, so write
+        can be called again after more entries are added."""
+        for compression in list(self.pending):
+            self._flush(compression)
+        keys = sorted(self.entries)
+        index = dict((key, i) for i, key in enumerate(keys))
+        titles = sorted(range(len(keys)), key=lambda i: (keys[i][0], (self.entries[keys[i]][0] or keys[i][1])))
+
+        entries = []
+        for namespace, url in keys:
+            title, mimetype, target, blob = self.entries[(namespace, url)]
+            fields = {'mimetype': mimetype, 'namespace': namespace, 'revision': 0, 'url': url, 'title': title}
+            if mimetype == REDIRECT_MIMETYPE:
+                if target not in index:
+                    raise ValueError("Redirect %s/%s to missing entry %s/%s" % (
+                        namespace.decode('utf-8'), url, target[0].decode('utf-8'), target[1]))
+                fields['redirectIndex'] = index[target]
+                entries.append(RedirectEntryFormat().pack(fields))
+            else:
+                fields['clusterNumber'] = target
+                fields['blobNumber'] = blob
+                entries.append(ArticleEntryFormat().pack(fields))
+
+        mime_list = MimeTypeListFormat().pack(self.mime_types)
+        url_ptr_pos = HeaderFormat().size + len(mime_list)
+        title_ptr_pos = url_ptr_pos + 8 * len(keys)
+        pos = title_ptr_pos + 4 * len(keys)
+        url_pointers = array('Q')
+        for entry in entries:
+            url_pointers.append(pos)
+            pos += len(entry)
+        cluster_ptr_pos = pos
+        cluster_count = len(self.cluster_pointers) - 1
+        clusters_pos = cluster_ptr_pos + 8 * cluster_count
+        cluster_pointers = array('Q', [clusters_pos + ptr for ptr in self.cluster_pointers[:-1]])
+
+        zim_uuid = zim_uuid or uuid.uuid4()
+        header = {'magicNumber': MAGIC_NUMBER, 'version': VERSION,
+                  'articleCount': len(keys), 'clusterCount': cluster_count,
+                  'urlPtrPos': url_ptr_pos, 'titlePtrPos': title_ptr_pos, 'clusterPtrPos': cluster_ptr_pos,
+                  'mimeListPos': HeaderFormat().size,
+                  'mainPage': index[self.main_page] if self.main_page in index else NO_REDIRECT,
+                  'layoutPage': NO_REDIRECT,
+                  'checksumPos': clusters_pos + self.cluster_pointers[-1]}
+        for i, byte in enumerate(zim_uuid.bytes):
+            header['uuid%d' % i] = byte
+
+        md5 = hashlib.md5()
+        with open(filename, 'wb') as f:
+            def write(data):
+                md5.update(data)
+                f.write(data)
+            write(HeaderFormat().pack(header) + mime_list)
+            write(little_endian(url_pointers))
+            write(little_endian(array('I', titles)))
+            write(b''.join(entries))
+            write(little_endian(cluster_pointers))
+            self.clusters.seek(0)
+            while True:
+                chunk = self.clusters.read(1 << 20)
+                if not chunk:
+                    break
+                write(chunk)
+            f.write(md5.digest())
+
+
+# Pages of the editions, in the layout the edition parser reads. {words}
+# stands for filler text; sections are left out of the pages without
+# translations.
+TEMPLATES = {
+    'de': {
+        'language': 'deu',
+        'languages': ['Englisch', 'Französisch', 'Italienisch', 'Spanisch', 'Niederländisch', 'Polnisch'],
+        'pos': ['Substantiv', 'Verb', 'Adjektiv', 'Adverb'],
+        'page': '<html><head><title>{word}</title></head><body><h1>{word}</h1><div id="mw-content-text">'
+                '<h2>{word} (Deutsch)</h2><h3>{pos}</h3><p><span class="ipa">{ipa}</span></p>'
+                '<p>{words}</p>{translations}</div></body></html>',
+        'translations': '<h4>Übersetzungen</h4><div class="NavFrame"><ul>{items}</ul></div>',
+        'item': '<li>{language}: {translation}</li>',
+    },
+    'fr': {
+        'language': 'fra',
+        'languages': ['Allemand', 'Anglais', 'Espagnol', 'Italien', 'Néerlandais', 'Polonais'],
+        'pos': ['Nom commun', 'Verbe', 'Adjectif', 'Adverbe'],
+        'page': '<html><head><title>{word}</title></head><body><h1>{word}</h1><div id="mw-content-text">'
+                '<h2>Français</h2><h3>{pos}</h3><p><b>{word}</b> <span class="API">{ipa}</span></p>'
+                '<p>{words}</p>{translations}<p></p></div></body></html>',
+        'translations': '<h4><span>Traductions</span></h4><div class="boite"><ul>{items}</ul></div>',
+        'item': '<li>{language} : {translation}</li>',
+    },
+    'ja': {
+        'language': 'jpn',
+        'languages': ['英語', 'ドイツ語', 'フランス語', 'イタリア語', 'スペイン語', '中国語'],
+        'pos': ['名詞', '動詞', '形容詞', '副詞'],
+        'page': '<html><head><title>{word}</title></head><body><h1>{word}</h1><div id="mw-content-text">'
+                '<h2>日本語</h2><p><span class="IPA">{ipa}</span></p><h3>{pos}</h3>'
+                '<p>{words}</p>{translations}</div></body></html>',
+        'translations': '<table class="translations"><tr><td><ul>{items}</ul></td></tr></table>',
+        'item': '<li>{language}: {translation}</li>',
+    },
+}
+
+SYLLABLES = ['ba', 'be', 'di', 'do', 'fa', 'ge', 'ha', 'ki', 'lo', 'ma', 'ne', 'no', 'pa', 'ri', 'sa', 'su',
+             'ta', 'te', 'vo', 'za', 'an', 'er', 'in', 'ol', 'us']
+
+
+def make_word(rnd, syllables=(1, 4)):
+    return ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(*syllables)))
+
+
+def make_page(rnd, word, template, translation_ratio=0.3, words=(20, 400)):
+    """The html of the page of word, with translations on translation_ratio of the pages"""
+    translations = ''
+    if rnd.random() < translation_ratio:
+        items = ''.join(template['item'].format(language=language, translation=make_word(rnd))
+                        for language in rnd.sample(template['languages'], rnd.randint(1, len(template['languages']))))
+        translations = template['translations'].format(items=items)
+    return template['page'].format(word=word, pos=rnd.choice(template['pos']), ipa=make_word(rnd, (1, 3)),
+                                   words=' '.join(make_word(rnd) for _ in range(rnd.randint(*words))),
+                                   translations=translations)
+
+
+def generate_zim(filename, count=1000, redirect_ratio=0.1, cluster_size=1 << 20, compression=COMPRESSION_LZMA,
+                 edition='de', translation_ratio=0.3, seed=0):
+    """Writes a ZIM file of count namespace 'A' pages of edition (a key of
+    TEMPLATES) and about redirect_ratio * count redirects to them, plus the
+    metadata. The file only depends on the arguments."""
+    rnd = random.Random(seed)
+    template = TEMPLATES[edition]
+    writer = ZimWriter(compression=compression, cluster_size=cluster_size)
+    try:
+        words = set()
+        while len(words) < count:
+            words.add(make_word(rnd) + ('' if rnd.random() < 0.5 else str(len(words))))
+        # random order, so that cluster order is not url order
+        words = sorted(words)
+        rnd.shuffle(words)
+        for word in words:
+            writer.add_article(b'A', word + '.html', word, make_page(rnd, word, template, translation_ratio).encode('utf-8'))
+        for i in range(int(count * redirect_ratio)):
+            target = rnd.choice(words)
+            alias = target.capitalize() if i % 2 else target + '_' + make_word(rnd)
+            if (b'A', alias + '.html') not in writer.entries:
+                writer.add_redirect(b'A', alias + '.html', alias, b'A', target + '.html')
+        writer.add_metadata('Language', template['language'].encode('utf-8'))
+        writer.add_metadata('Title', ('Wiktionary (%s)' % edition).encode('utf-8'))
+        writer.add_metadata('Creator', b'Wiktionary')
+        writer.add_metadata('Date', b'2000-01-01')
+        writer.main_page = (b'A', words[0] + '.html')
+        writer.write(filename, zim_uuid=uuid.UUID(int=rnd.getrandbits(128)))
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic ZIM file of Wiktionary pages")
+    parser.add_argument('--output', '-o', help="The zim file to write", required=True)
+    parser.add_argument('--count', '-n', type=int, default=1000, help="The number of pages")
+    parser.add_argument('--redirects', '-r', type=float, default=0.1, help="The number of redirects per page")
+    parser.add_argument('--cluster_kb', type=int, default=1024, help="Size of the clusters before compression, in KB")
+    parser.add_argument('--codec', choices=sorted(CODECS), default='lzma', help="Compression of the clusters")
+    parser.add_argument('--edition', '-e', choices=sorted(TEMPLATES), default='de', help="Layout of the pages")
+    parser.add_argument('--translations', '-t', type=float, default=0.3,
+                        help="The share of the pages with a translation section")
+    parser.add_argument('--seed', '-s', type=int, default=0, help="Seed of the random generator")
+    args = parser.parse_args()
+    generate_zim(args.output, count=args.count, redirect_ratio=args.redirects, cluster_size=args.cluster_kb << 10,
+                 compression=CODECS[args.codec], edition=args.edition, translation_ratio=args.translations,
+                 seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
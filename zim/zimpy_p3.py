@@ -9,10 +9,19 @@ There might still be errors in the file.
 """
 
 import re
+import os
+import hashlib
+import mmap
+import itertools
+import bisect
+import operator
+import random
 import struct
-import string
 import logging
+import time
 import uuid
+import threading
+from collections import Counter, OrderedDict
 
 import sys
 
@@ -32,28 +41,34 @@ else:
         # namespace until we get it resolved upstream
         from backportslzma import lzma
 
+import bz2
+import zlib
+
 try:
-    # repose.lru does not help much in production
-    # web serving.  It makes a HUGE difference in
-    # pre-processing.  So we don't want to make it
-    # a hard dependency.
-    from repoze.lru import LRUCache
+    # zstd is in the standard library from Python 3.14 on. Before that the
+    # zstandard package provides it; without either, zstd clusters can't be
+    # read unless a decompressor is registered with register_codec.
+    from compression import zstd
+    zstandard = None
 except ImportError as e:
-    class LRUCache(object):
-        def __init__(self, cache_size):
-            return
-
-        def get(self, key, value=None):
-            return value
-
-        def put(self, key, value):
-            return
+    zstd = None
+    try:
+        import zstandard
+    except ImportError as e:
+        zstandard = None
 
-        def clear(self):
-            return
+try:
+    # numpy turns directory filters into vectorized masks. Without it
+    # Directory.select falls back to C-level map() over the columns.
+    import numpy
+except ImportError as e:
+    numpy = None
 
 # in python 3, use bytesIO to r/w bytes
 from io import BytesIO
+from array import array
+
+from zim.remote import HttpFile, is_url
 
 logger = logging.getLogger(__name__)
 
@@ -119,25 +134,107 @@ CLUSTER_FORMAT = [
 # A null byte
 NULL = struct.pack('B', 0)
 
+# mimetype of a redirect entry
+REDIRECT_MIMETYPE = 0xffff
+# value of Directory.redirect for entries that are not redirects
+NO_REDIRECT = 0xffffffff
+
+# compressionType of a cluster, in the low 4 bits of its first byte
+COMPRESSION_NONE = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_BZIP2 = 3
+COMPRESSION_LZMA = 4
+COMPRESSION_ZSTD = 5
+# flag in the first byte of a cluster whose blob offsets are 64 bit
+EXTENDED_CLUSTER = 0x10
+
+# compressionType -> callable returning a streaming decompressor, i.e. an
+# object with decompress(data) and eof like lzma.LZMADecompressor
+CLUSTER_CODECS = {
+    COMPRESSION_ZLIB: zlib.decompressobj,
+    COMPRESSION_BZIP2: bz2.BZ2Decompressor,
+    COMPRESSION_LZMA: lzma.LZMADecompressor,
+}
+if zstd is not None:
+    CLUSTER_CODECS[COMPRESSION_ZSTD] = zstd.ZstdDecompressor
+elif zstandard is not None:
+    CLUSTER_CODECS[COMPRESSION_ZSTD] = lambda: zstandard.ZstdDecompressor().decompressobj()
+
+# compressionType -> function compressing the whole content of a cluster,
+# for the files written in ZIM style clusters (see pack_cluster)
+CLUSTER_COMPRESSORS = {
+    COMPRESSION_NONE: bytes,
+    COMPRESSION_ZLIB: zlib.compress,
+    COMPRESSION_BZIP2: bz2.compress,
+    COMPRESSION_LZMA: lzma.compress,
+}
+if zstd is not None:
+    CLUSTER_COMPRESSORS[COMPRESSION_ZSTD] = zstd.compress
+elif zstandard is not None:
+    CLUSTER_COMPRESSORS[COMPRESSION_ZSTD] = lambda data: zstandard.ZstdCompressor().compress(data)
+
+ENTRY_HEAD = struct.Struct('<HBc')
+ARTICLE_TARGET = struct.Struct('<II')
+REDIRECT_TARGET = struct.Struct('<I')
+ARTICLE_ENTRY = struct.Struct('<HBcIII')
+REDIRECT_ENTRY = struct.Struct('<HBcII')
+
 
 def format_from_rich(rich_format):
     return "<" + "".join([x[0] for x in rich_format])
 
 
-def read_null_terminated(f, encoding='utf-8'):
-    s = b""
+def read_null_terminated(f, encoding='utf-8', chunk_size=64):
+    """Reads a null terminated string from a seekable file, chunk_size
+    bytes at a time, and leaves the file right after the null byte"""
+    chunks = []
     while True:
-        b = f.read(1)
-        if b == NULL:
-            return s.decode(encoding)
-        s = s + b
+        chunk = f.read(chunk_size)
+        end = chunk.find(NULL)
+        if end >= 0:
+            chunks.append(chunk[:end])
+            f.seek(end + 1 - len(chunk), os.SEEK_CUR)
+            return b''.join(chunks).decode(encoding)
+        if not chunk:
+            raise IOError("Unterminated string")
+        chunks.append(chunk)
+
+
+def unpack_null_terminated(buffer, offset, encoding='utf-8'):
+    """Decodes the null terminated string starting at offset of a buffer
+    supporting find (bytes or mmap). Returns the string and the offset
+    right after the terminating null byte."""
+    end = buffer.find(NULL, offset)
+    if end < 0:
+        raise IOError("Unterminated string at offset %s" % offset)
+    return buffer[offset:end].decode(encoding), end + 1
+
+
+def register_codec(compression_type, decompressor_factory):
+    """Makes clusters of compression_type readable. decompressor_factory is
+    called once per cluster and must return an object with decompress(data)
+    and eof, like lzma.LZMADecompressor."""
+    CLUSTER_CODECS[compression_type] = decompressor_factory
+
+
+def get_decompressor(compression_type):
+    try:
+        return CLUSTER_CODECS[compression_type]()
+    except KeyError:
+        raise IOError("No decompressor for cluster compression type %s" % compression_type)
+
+
+def cluster_flags(flag):
+    """Returns the compression type and the size of the blob offsets of a
+    cluster given its first byte"""
+    return flag & 0x0f, 8 if flag & EXTENDED_CLUSTER else 4
 
 
 def binary_search(f, t, min, max):
     while 1:
         if max < min:
             return None
-        m = (min + max) / 2
+        m = (min + max) // 2
         v = f(m)
         if v < t:
             min = m + 1
@@ -147,10 +244,255 @@ def binary_search(f, t, min, max):
             return m
 
 
+def lower_bound(key, target, lo, hi):
+    """Returns the first index in [lo, hi) whose key(index) is not below
+    target (hi if there is none); key must be sorted over the range"""
+    while lo < hi:
+        m = (lo + hi) // 2
+        if key(m) < target:
+            lo = m + 1
+        else:
+            hi = m
+    return lo
+
+
+def merge_join(key, targets, lo, hi):
+    """Generator of (target, index) for each of targets (sorted, without
+    duplicates) equal to key(index) for an index in [lo, hi), key being
+    sorted over the range. The targets are matched in one forward walk:
+    from the last match the walk steps ahead 1, 2, 4... keys until it passes
+    the next target, then searches only that gap, so k targets among n keys
+    cost O(k log(n / k)) probes, and dense targets a plain scan."""
+    position = lo
+    for target in targets:
+        bound = position
+        step = 1
+        while bound < hi and key(bound) < target:
+            position = bound + 1
+            bound = position + step
+            step *= 2
+        position = lower_bound(key, target, position, min(bound, hi))
+        if position < hi and key(position) == target:
+            yield target, position
+            position += 1
+
+
+def entries_by_cluster(entries, mime_types, mimetypes=None):
+    """Returns [(cluster number, [entries in it by blob])] in cluster order
+    for the non-redirect entries (dicts) of one of mimetypes (names in
+    mime_types, the mime type list of the file) if given"""
+    if mimetypes is not None:
+        mimetypes = set(mime_types.index(m) for m in mimetypes if m in mime_types)
+    entries = sorted((entry for entry in entries if 'redirectIndex' not in entry
+                      and (mimetypes is None or entry['mimetype'] in mimetypes)),
+                     key=lambda entry: (entry['clusterNumber'], entry['blobNumber']))
+    return [(cluster_index, list(group)) for cluster_index, group
+            in itertools.groupby(entries, key=operator.itemgetter('clusterNumber'))]
+
+
+def unpack_entry_strings(buffer, offset, end=None):
+    """Returns the namespace, url and title of the directory entry at offset
+    as bytes, or None when the entry runs past end (of the buffer)"""
+    if end is None:
+        end = len(buffer)
+    if offset + 12 > end:
+        return None
+    mimetype, _, namespace = ENTRY_HEAD.unpack_from(buffer, offset)
+    url_start = offset + (12 if mimetype == REDIRECT_MIMETYPE else 16)
+    url_end = buffer.find(NULL, url_start, end)
+    title_end = buffer.find(NULL, url_end + 1, end) if url_end >= 0 else -1
+    if title_end < 0:
+        return None
+    return namespace, buffer[url_start:url_end], buffer[url_end + 1:title_end]
+
+
 def full_url(namespace, url):
     return str(namespace) + '/' + str(url)
 
 
+def as_bytes(s):
+    return s.encode('utf-8') if isinstance(s, str) else s
+
+
+def html_mimetypes(mime_types):
+    """The names in mime_types of html pages: text/html, with or without
+    parameters"""
+    return [m for m in mime_types if m.split(';')[0].strip() == 'text/html']
+
+
+SPLIT_SUFFIXES = [a + b for a, b in itertools.product('abcdefghijklmnopqrstuvwxyz', repeat=2)]
+
+
+def split_parts(filename):
+    """Returns the files holding the archive filename: filename itself, or
+    for an archive split into chunks (foo.zimaa, foo.zimab...) the chunks in
+    order. filename may name either the whole archive (foo.zim) or its first
+    chunk."""
+    if re.search(r'\.zim[a-z]{2}$', filename):
+        filename = filename[:-2]
+    elif os.path.exists(filename):
+        return [filename]
+    parts = []
+    for suffix in SPLIT_SUFFIXES:
+        if not os.path.exists(filename + suffix):
+            break
+        parts.append(filename + suffix)
+    # let opening it raise the usual error
+    return parts or [filename]
+
+
+class PositionalFile(object):
+    """A read-only file read with os.pread, so any number of threads can
+    read it at once. seek(), tell() and read() keep a position per thread.
+    Without os.pread (Windows) reads are serialized by a lock instead.
+
+    An archive split into chunks (see split_parts) is read as the one file
+    their concatenation would be, without making it."""
+
+    def __init__(self, filename):
+        self.name = filename
+        self.parts = split_parts(filename)
+        self.fds = []
+        self.starts = []
+        self.size = 0
+        try:
+            for part in self.parts:
+                fd = os.open(part, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+                self.fds.append(fd)
+                self.starts.append(self.size)
+                self.size += os.fstat(fd).st_size
+        except OSError:
+            self.close()
+            raise
+        self.ends = self.starts[1:] + [self.size]
+        self.lock = None if hasattr(os, 'pread') else threading.Lock()
+        self.local = threading.local()
+
+    def fileno(self):
+        """The descriptor of the file, or of the first chunk of a split archive"""
+        return self.fds[0]
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+    def part(self, offset):
+        """Returns the index of the chunk holding offset"""
+        return max(bisect.bisect_right(self.starts, offset) - 1, 0)
+
+    def pread(self, size, offset):
+        """Returns size bytes (less at the end of the file) read at offset"""
+        if len(self.fds) == 1:
+            return self._pread(self.fds[0], size, offset)
+        chunks = []
+        i = self.part(offset)
+        while size > 0 and i < len(self.fds) and offset < self.size:
+            data = self._pread(self.fds[i], min(size, self.ends[i] - offset), offset - self.starts[i])
+            if not data:
+                break
+            chunks.append(data)
+            offset += len(data)
+            size -= len(data)
+            i += 1
+        return b''.join(chunks)
+
+    def _pread(self, fd, size, offset):
+        if self.lock is not None:
+            with self.lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                return os.read(fd, size)
+        data = os.pread(fd, size, offset)
+        # a single pread may stop short of very large sizes
+        while 0 < len(data) < size:
+            more = os.pread(fd, size - len(data), offset + len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+    def tell(self):
+        return getattr(self.local, 'pos', 0)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.tell()
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.local.pos = offset
+        return offset
+
+    def read(self, size=-1):
+        pos = self.tell()
+        if size is None or size < 0:
+            size = max(self.size - pos, 0)
+        data = self.pread(size, pos)
+        self.local.pos = pos + len(data)
+        return data
+
+
+def open_positional(filename):
+    """Opens filename as a PositionalFile, or as an HttpFile for an http(s) url"""
+    if is_url(filename):
+        return HttpFile(filename)
+    return PositionalFile(filename)
+
+
+class SplitMap(object):
+    """Read-only memory maps of the chunks of a split archive, indexed and
+    sliced as one memoryview of the whole archive would be. A slice inside
+    one chunk is a view of its map; one spanning two chunks is a copy."""
+
+    def __init__(self, positional_file):
+        f = positional_file
+        self.maps = []
+        self.views = []
+        self.starts = []
+        self.ends = []
+        for fd, start, end in zip(f.fds, f.starts, f.ends):
+            # mmap refuses empty files
+            if end > start:
+                self.maps.append(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))
+                self.views.append(memoryview(self.maps[-1]))
+                self.starts.append(start)
+                self.ends.append(end)
+        self.size = f.size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                raise ValueError("SplitMap slices must be contiguous")
+            stop = max(start, stop)
+            i = max(bisect.bisect_right(self.starts, start) - 1, 0)
+            if stop <= self.ends[i]:
+                return self.views[i][start - self.starts[i]:stop - self.starts[i]]
+            chunks = []
+            while start < stop:
+                chunks.append(self.views[i][start - self.starts[i]:min(stop, self.ends[i]) - self.starts[i]])
+                start = self.ends[i]
+                i += 1
+            return memoryview(b''.join(chunks))
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("SplitMap index out of range")
+        i = bisect.bisect_right(self.starts, key) - 1
+        return self.views[i][key - self.starts[i]]
+
+    def release(self):
+        for view in self.views:
+            view.release()
+
+    def close(self):
+        """Closes the maps; raises BufferError while slices of them are alive"""
+        for m in self.maps:
+            m.close()
+
+
 class Format(object):
     def __init__(self, rich_format):
         self.rich_fmt = rich_format
@@ -176,6 +518,12 @@ class Format(object):
         """Override this to get more complex behavior"""
         return self.unpack_format(buffer, offset)
 
+    def pack(self, fields):
+        """The bytes of fields (a dict, or pairs as unpack returns them), the
+        reverse of unpack. Override this to get more complex behavior"""
+        fields = dict(fields)
+        return self.compiled.pack(*[fields[name] for _, name in self.rich_fmt])
+
     def unpack_from_file(self, f, seek=None):
         """Override this to get more complex behavior"""
         return self.unpack_format_from_file(f, seek)
@@ -191,119 +539,455 @@ class ClusterFormat(Format):
         super(ClusterFormat, self).__init__(CLUSTER_FORMAT)
 
 
+class LRUPolicy(object):
+    """Evicts the least recently used cluster"""
+
+    def __init__(self):
+        self.order = OrderedDict()
+
+    def touch(self, key, cluster):
+        self.order[key] = None
+        self.order.move_to_end(key)
+
+    def remove(self, key):
+        del self.order[key]
+
+    def victim(self):
+        return next(iter(self.order))
+
+
+class SizeAwarePolicy(object):
+    """GreedyDual-Size: evicts the cluster with the lowest decompression time
+    per byte held, aged so that clusters not used for a while go first"""
+
+    def __init__(self):
+        self.priority = {}
+        self.inflation = 0.0
+
+    def touch(self, key, cluster):
+        self.priority[key] = self.inflation + cluster.decompress_time / max(cluster.nbytes, 1)
+
+    def remove(self, key):
+        self.inflation = self.priority.pop(key)
+
+    def victim(self):
+        return min(self.priority, key=self.priority.get)
+
+
+CACHE_POLICIES = {
+    'lru': LRUPolicy,
+    'size': SizeAwarePolicy,
+}
+
+
+class PendingLoad(object):
+    """A cluster one thread is loading into a ClusterCache, which threads
+    missing the same cluster meanwhile wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.cluster = None
+        self.error = None
+
+
 class ClusterCache(object):
-    def __init__(self, cache_size):
-        self.lru = LRUCache(cache_size)
+    """Cache of clusters bounded by the bytes they hold (max_bytes) and,
+    if cache_size is set, by their number. policy is a key of
+    CACHE_POLICIES or an object with touch, remove and victim methods."""
+
+    def __init__(self, cache_size=None, cluster_class=None, max_bytes=64 << 20, policy='lru'):
+        self.cache_size = cache_size
+        self.max_bytes = max_bytes
+        self.policy = CACHE_POLICIES[policy]() if isinstance(policy, str) else policy
+        self.cluster_class = cluster_class or ClusterData
+        self.entries = {}
+        self.sizes = {}
+        self.bytes = 0
         self.hits = 0
         self.misses = 0
-
-    def get(self, file_buffer, ptr):
-        v = self.lru.get((file_buffer, ptr))
-        if v is not None:
-            self.hits += 1
+        self.evictions = 0
+        self.decompress_time = 0.0
+        # number of times each cluster (by pointer) was read whole and
+        # decompressed by read_cluster, as iterations over the clusters do;
+        # the clusters get() loads to read a few blobs are misses
+        self.loads = Counter()
+        # guards the entries and counters when threads share the cache
+        self.lock = threading.RLock()
+        # key -> PendingLoad of the clusters being loaded
+        self.pending = {}
+
+    def load(self, file_buffer, ptr, end=None, lazy=False):
+        """Reads and decompresses the cluster at ptr without caching it"""
+        start = time.perf_counter()
+        cluster = self.cluster_class(file_buffer, ptr, end, lazy)
+        cluster.decompress_time = time.perf_counter() - start
+        with self.lock:
+            self.decompress_time += cluster.decompress_time
+        return cluster
+
+    def get(self, file_buffer, ptr, end=None):
+        """Returns the cluster at ptr from the cache, or loads it. Clusters
+        loaded here are decompressed only as far as the blobs read need.
+        Loads run outside the lock, so threads missing different clusters
+        read them at the same time, while threads missing a cluster that
+        is being loaded wait for that load instead of reading it again."""
+        # key on identity: hashing a memoryview would hash the whole file
+        key = (id(file_buffer), ptr)
+        with self.lock:
+            v = self.entries.get(key)
+            if v is not None:
+                self.hits += 1
+                self.policy.touch(key, v)
+                return v
+            pending = self.pending.get(key)
+            if pending is None:
+                pending = self.pending[key] = PendingLoad()
+                loading = True
+            else:
+                loading = False
+        if not loading:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            with self.lock:
+                self.hits += 1
+            return pending.cluster
+        try:
+            # lazy, so this is one read plus the blob offsets
+            v = self.load(file_buffer, ptr, end, lazy=True)
+            with self.lock:
+                self.misses += 1
+                self.entries[key] = v
+                self.sizes[key] = 0
+                self.policy.touch(key, v)
+                self._resize(key)
+            pending.cluster = v
             return v
-        v = ClusterData(file_buffer, ptr)
-        self.lru.put((file_buffer, ptr), v)
-        self.misses += 1
-        return v
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+            pending.done.set()
+
+    def read_cluster(self, file_buffer, ptr, end=None):
+        """Returns the cluster at ptr completely decompressed: the one in the
+        cache if it is there, so that it is not read a second time, or else
+        one loaded without caching it"""
+        key = (id(file_buffer), ptr)
+        with self.lock:
+            cluster = self.entries.get(key)
+            if cluster is None:
+                self.loads[ptr] += 1
+            else:
+                self.hits += 1
+                self.policy.touch(key, cluster)
+        if cluster is None:
+            return self.load(file_buffer, ptr, end)
+        start = time.perf_counter()
+        cluster._decompress()
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.decompress_time += elapsed
+            cluster.decompress_time += elapsed
+            if self.entries.get(key) is cluster:
+                self._resize(key)
+        return cluster
+
+    def read_blob(self, file_buffer, ptr, end, blob_index):
+        """Reads a blob through the cache, accounting for the bytes the
+        cluster grows by while it is decompressed further"""
+        cluster = self.get(file_buffer, ptr, end)
+        start = time.perf_counter()
+        blob = cluster.read_blob(blob_index)
+        elapsed = time.perf_counter() - start
+        key = (id(file_buffer), ptr)
+        with self.lock:
+            self.decompress_time += elapsed
+            cluster.decompress_time += elapsed
+            if self.entries.get(key) is cluster:
+                self._resize(key)
+        return blob
+
+    def _resize(self, key):
+        nbytes = self.entries[key].nbytes
+        self.bytes += nbytes - self.sizes[key]
+        self.sizes[key] = nbytes
+        while self.entries and (self.bytes > self.max_bytes or
+                                (self.cache_size is not None and len(self.entries) > self.cache_size)):
+            self._evict(self.policy.victim())
+
+    def _evict(self, key):
+        self.policy.remove(key)
+        del self.entries[key]
+        self.bytes -= self.sizes.pop(key)
+        self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return self._stats()
+
+    def _stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'decompress_time': self.decompress_time,
+                'clusters_loaded': len(self.loads),
+                'max_loads_per_cluster': max(self.loads.values()) if self.loads else 0}
 
     def clear(self):
         logger.debug("CACHE HITS " + str(self.hits) + " VS MISSES " + str(self.misses))
-        self.lru.clear()
+        with self.lock:
+            for key in list(self.entries):
+                self.policy.remove(key)
+            self.entries.clear()
+            self.sizes.clear()
+            self.bytes = 0
 
 
 class ClusterData(object):
-    def __init__(self, file_buffer, ptr):
-        cluster_info = dict(ClusterFormat().unpack_from_file(file_buffer, ptr))
-        self.compressed = cluster_info['compressionType'] == 4
+    """A cluster of a ZIM file.
+
+    When end (the offset where the cluster stops) is known, a compressed
+    cluster is read with a single read of exactly its size. With lazy set,
+    it is then only decompressed as far as the blobs read so far reach.
+
+    file_buffer is a PositionalFile; threads may read blobs concurrently.
+    """
 
+    def __init__(self, file_buffer, ptr, end=None, lazy=False):
         self.file_buf = file_buffer
         self.uncomp_buf = None
+        self.comp_data = None
         self.ptr = ptr
+        self.end = end
+        self.decompress_time = 0.0
+        self.lock = threading.Lock()
+
+        self.compression, self.offset_size = cluster_flags(self.read_flag())
+        self.compressed = self.compression > COMPRESSION_NONE
 
         self.offsets = []
 
         if self.compressed:
-            self._decompress()
+            self._start_decompression()
+            if not lazy:
+                self._decompress()
 
         self.read_offsets()
 
-    def _decompress(self, chunk_size=32000):
-        """Decompresses the cluster if compression flag was found. Stores
-        uncompressed results internally."""
+    def read_flag(self):
+        """Returns the byte holding the compression of the cluster"""
+        return self.file_buf.pread(1, self.ptr)[0]
+
+    @property
+    def nbytes(self):
+        """Memory held by the cluster: its compressed bytes until it is
+        completely decompressed, plus what is decompressed so far"""
+        nbytes = 8 * len(self.offsets)
+        if self.uncomp_buf is not None:
+            nbytes += len(self.uncomp_buf)
+        if self.comp_data is not None:
+            nbytes += len(self.comp_data)
+        return nbytes
+
+    def compressed_data(self):
+        """Returns the compressed bytes of the cluster read in one go, or None
+        when the end of the cluster is unknown"""
+        if self.end is None:
+            return None
+        return memoryview(self.file_buf.pread(self.end - self.ptr - 1, self.ptr + 1))
+
+    def _start_decompression(self):
+        self.decomp = get_decompressor(self.compression)
+        self.comp_data = self.compressed_data()
+        self.comp_pos = 0
+        # Store uncompressed cluster data for use as uncompressed data
+        self.uncomp_buf = bytearray()
+
+    def _decompress(self, size=None, chunk_size=32000):
+        """Decompresses the cluster if compression flag was found, until at
+        least size bytes are uncompressed (all of them when size is None).
+        Stores uncompressed results internally."""
 
         if not self.compressed:
             return
 
-        self.file_buf.seek(self.ptr + 1)
+        with self.lock:
+            decomp = self.decomp
+            while not decomp.eof and (size is None or len(self.uncomp_buf) < size):
+                if self.comp_data is not None:
+                    comp_data = self.comp_data[self.comp_pos:self.comp_pos + chunk_size]
+                else:
+                    comp_data = self.file_buf.pread(chunk_size, self.ptr + 1 + self.comp_pos)
+                if not comp_data:
+                    raise IOError("Truncated cluster at %s" % self.ptr)
+                self.comp_pos += len(comp_data)
 
-        # Store uncompressed cluster data for use as uncompressed data
-        self.uncomp_buf = BytesIO()
+                uncomp_data = decomp.decompress(comp_data)
 
-        decomp = lzma.LZMADecompressor()
-        while not decomp.eof:
-            comp_data = self.file_buf.read(chunk_size)
+                self.uncomp_buf += uncomp_data
 
-            uncomp_data = decomp.decompress(comp_data)
+            if decomp.eof and isinstance(self.uncomp_buf, bytearray):
+                # done: drop the compressed data and freeze the result
+                self.comp_data = None
+                self.uncomp_buf = self.finish(self.uncomp_buf)
 
-            self.uncomp_buf.write(uncomp_data)
+            return self.uncomp_buf
 
-        return self.uncomp_buf
+    def finish(self, uncomp_buf):
+        return bytes(uncomp_buf)
 
     def source_buffer(self):
         """Returns the buffer to read from, either the file buffer
-        passed or the uncompressed lzma data. Will seek to the
+        passed or the uncompressed data. Will seek to the
         beginning of the cluster after the 1 byte compression flag"""
 
         if self.compressed:
-            self.uncomp_buf.seek(0)
-            return self.uncomp_buf
+            return BytesIO(self.uncomp_buf)
         else:
             self.file_buf.seek(self.ptr + 1)
             return self.file_buf
 
     def unpack_blob_index(self, buf):
-        ptr = struct.unpack('I', buf)[0]
+        ptr = struct.unpack('<Q' if self.offset_size == 8 else '<I', buf)[0]
         return ptr
 
     def read_offsets(self):
         """Reads the cluster header with the offsets of the blobs"""
 
-        src_buf = self.source_buffer()
+        if self.compressed:
+            self._decompress(self.offset_size)
+            nblob = self.unpack_blob_index(self.uncomp_buf[:self.offset_size]) // self.offset_size
+            self._decompress(nblob * self.offset_size)
+            self.offsets = read_blob_offsets(self.uncomp_buf, self.offset_size)
+            return self.offsets
+
+        offset0 = self.unpack_blob_index(self.file_buf.pread(self.offset_size, self.ptr + 1))
+        self.offsets = read_blob_offsets(self.file_buf.pread(offset0, self.ptr + 1), self.offset_size)
+        return self.offsets
 
-        raw = src_buf.read(4)
-        offset0 = self.unpack_blob_index(raw)
-        self.offsets.append(offset0)
-        nblob = int(offset0 / 4)
+    def read_blob(self, blob_index):
+        """Reads a blob from the cluster"""
 
-        for idx in range(nblob - 1):
-            raw = src_buf.read(4)
-            offset = self.unpack_blob_index(raw)
-            self.offsets.append(offset)
+        if blob_index >= len(self.offsets) - 1:
+            raise IOError("Blob index exceeds number of blobs available: %s" % blob_index)
 
+        if self.compressed:
+            # stop decompressing once the end of the blob is reached
+            self._decompress(self.offsets[blob_index + 1])
+            blob_data = self.uncomp_buf[self.offsets[blob_index]:self.offsets[blob_index + 1]]
+            return bytes(blob_data) if isinstance(blob_data, bytearray) else blob_data
+
+        blob_size = self.offsets[blob_index + 1] - self.offsets[blob_index]
+
+        # For uncompressed data, read from the file
+        return self.file_buf.pread(blob_size, self.ptr + 1 + self.offsets[blob_index])
+
+
+class MmapClusterData(ClusterData):
+    """Cluster read from a memoryview of the whole file. Blobs are returned
+    as memoryview slices of either the mapped file (uncompressed clusters)
+    or the decompressed cluster, so no blob is copied once the cluster is
+    completely decompressed."""
+
+    def read_flag(self):
+        return self.file_buf[self.ptr]
+
+    @property
+    def nbytes(self):
+        # the compressed bytes are a view of the map, not memory of our own
+        nbytes = 8 * len(self.offsets)
+        if self.uncomp_buf is not None:
+            nbytes += len(self.uncomp_buf)
+        return nbytes
+
+    def compressed_data(self):
+        end = self.end if self.end is not None else len(self.file_buf)
+        return self.file_buf[self.ptr + 1:end]
+
+    def finish(self, uncomp_buf):
+        return memoryview(bytes(uncomp_buf))
+
+    def source_buffer(self):
+        """Returns a memoryview starting right after the compression flag"""
+
+        if self.compressed:
+            return self.uncomp_buf
+        return self.compressed_data()
+
+    def read_offsets(self):
+        if self.compressed:
+            return super(MmapClusterData, self).read_offsets()
+        self.offsets = read_blob_offsets(self.source_buffer(), self.offset_size)
         return self.offsets
 
     def read_blob(self, blob_index):
-        """Reads a blob from the cluster"""
+        if self.compressed:
+            return super(MmapClusterData, self).read_blob(blob_index)
 
         if blob_index >= len(self.offsets) - 1:
             raise IOError("Blob index exceeds number of blobs available: %s" % blob_index)
 
-        src_buf = self.source_buffer()
+        start = self.ptr + 1
+        return self.file_buf[start + self.offsets[blob_index]:start + self.offsets[blob_index + 1]]
 
-        blob_size = self.offsets[blob_index + 1] - self.offsets[blob_index]
 
-        # For uncompressed data, seek from beginning of file
-        # Otherwise seek the compressed data with just and offset
-        if not self.compressed:
-            seek_beg = self.ptr + 1
-        else:
-            seek_beg = 0
-        src_buf.seek(seek_beg + self.offsets[blob_index])
+def read_blob_offsets(raw, offset_size=4):
+    """Returns the list of blob offsets at the start of uncompressed cluster content"""
+    code = 'Q' if offset_size == 8 else 'I'
+    nblob = struct.unpack_from('<' + code, raw, 0)[0] // offset_size
+    return list(struct.unpack_from('<%d%s' % (nblob, code), raw, 0))
+
+
+def decompress_cluster(data):
+    """Returns the uncompressed content of a cluster (after the compression
+    flag) from its bytes in the file, starting with the flag"""
+    compression, offset_size = cluster_flags(data[0])
+    if compression > COMPRESSION_NONE:
+        return get_decompressor(compression).decompress(memoryview(data)[1:])
+    return bytes(memoryview(data)[1:])
 
-        blob_data = src_buf.read(blob_size)
 
-        return blob_data
+def split_blobs(raw, blob_indexes=None, offset_size=4):
+    """Splits uncompressed cluster content into its blobs, or only the blobs
+    listed in blob_indexes"""
+    offsets = read_blob_offsets(raw, offset_size)
+    nblob = len(offsets)
+    if blob_indexes is None:
+        blob_indexes = range(nblob - 1)
+    return [raw[offsets[b]:offsets[b + 1]] for b in blob_indexes]
+
+
+def pack_cluster(blobs, compression=COMPRESSION_LZMA):
+    """Returns the bytes of a cluster holding blobs, starting with its
+    compression flag: the reverse of decompress_cluster and split_blobs"""
+    try:
+        compress = CLUSTER_COMPRESSORS[compression]
+    except KeyError:
+        raise IOError("No compressor for cluster compression type %s" % compression)
+    offset_size = 4
+    if 4 * (len(blobs) + 1) + sum(len(blob) for blob in blobs) > 0xffffffff:
+        offset_size = 8
+    offsets = [offset_size * (len(blobs) + 1)]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    code = 'Q' if offset_size == 8 else 'I'
+    raw = struct.pack('<%d%s' % (len(offsets), code), *offsets) + b''.join(blobs)
+    flag = compression | (EXTENDED_CLUSTER if offset_size == 8 else 0)
+    return bytes([flag]) + compress(raw)
+
+
+def cluster_ends(ptrs, end_of_clusters):
+    """For each cluster pointer, the offset of the next cluster in the file
+    (end_of_clusters for the last one)"""
+    positions = sorted(set(ptrs))
+    following = dict(zip(positions, positions[1:] + [end_of_clusters]))
+    return array('Q', [following[ptr] for ptr in ptrs])
 
 
 class ArticleEntryFormat(Format):
@@ -311,7 +995,22 @@ class ArticleEntryFormat(Format):
         super(ArticleEntryFormat, self).__init__(ARTICLE_ENTRY_FORMAT)
 
     def unpack(self, buffer, offset=0):
-        raise Exception("Unimplemented")
+        d = self.unpack_format(buffer, offset)
+        url, pos = unpack_null_terminated(buffer, offset + self.size)
+        title, pos = unpack_null_terminated(buffer, pos)
+        parameter = buffer[pos:pos + dict(d)['parameterLen']]
+        d.extend([('url', url),
+                  ('title', title),
+                  ('parameter', parameter)]
+                 )
+        return d
+
+    def pack(self, fields):
+        fields = dict(fields)
+        parameter = fields.get('parameter', b'')
+        fields['parameterLen'] = len(parameter)
+        return (super(ArticleEntryFormat, self).pack(fields) + fields['url'].encode('utf-8') + NULL +
+                fields['title'].encode('utf-8') + NULL + parameter)
 
     def unpack_from_file(self, f, seek=None):
         d = super(ArticleEntryFormat, self).unpack_from_file(f, seek)
@@ -330,7 +1029,22 @@ class RedirectEntryFormat(Format):
         super(RedirectEntryFormat, self).__init__(REDIRECT_ENTRY_FORMAT)
 
     def unpack(self, buffer, offset=0):
-        raise Exception("Unimplemented")
+        d = self.unpack_format(buffer, offset)
+        url, pos = unpack_null_terminated(buffer, offset + self.size)
+        title, pos = unpack_null_terminated(buffer, pos)
+        parameter = buffer[pos:pos + dict(d)['parameterLen']]
+        d.extend([('url', url),
+                  ('title', title),
+                  ('parameter', parameter)]
+                 )
+        return d
+
+    def pack(self, fields):
+        fields = dict(fields)
+        parameter = fields.get('parameter', b'')
+        fields['parameterLen'] = len(parameter)
+        return (super(RedirectEntryFormat, self).pack(fields) + fields['url'].encode('utf-8') + NULL +
+                fields['title'].encode('utf-8') + NULL + parameter)
 
     def unpack_from_file(self, f, seek=None):
         d = super(RedirectEntryFormat, self).unpack_from_file(f, seek)
@@ -349,7 +1063,15 @@ class MimeTypeListFormat(Format):
         super(MimeTypeListFormat, self).__init__("")
 
     def unpack(self, buffer, offset=0):
-        raise Exception("Unimplemented")
+        mimetypes = []
+        while True:
+            s, offset = unpack_null_terminated(buffer, offset)
+            if s == "":
+                return mimetypes
+            mimetypes.append(s)
+
+    def pack(self, mimetypes):
+        return b''.join(m.encode('utf-8') + NULL for m in mimetypes) + NULL
 
     def unpack_from_file(self, f, seek=None):
         if seek is not None:
@@ -362,16 +1084,368 @@ class MimeTypeListFormat(Format):
             mimetypes.append(s)
 
 
+def unpack_directory_entries(buffer, ptrs, start, base, directory):
+    """Decodes directory entries from buffer, which holds the file bytes
+    from offset base on, into the columns of directory. Starts with
+    ptrs[start] and stops at the first entry not entirely inside buffer.
+    Returns the index of that entry (len(ptrs) when all were decoded)."""
+    end = len(buffer)
+    pool = directory.pool
+    offsets = directory.offsets
+    for i in range(start, len(ptrs)):
+        offset = ptrs[i] - base
+        if offset < 0 or offset + 12 > end:
+            return i
+        mimetype, _, namespace = ENTRY_HEAD.unpack_from(buffer, offset)
+        if mimetype == REDIRECT_MIMETYPE:
+            cluster, blob = 0, 0
+            redirect, = REDIRECT_TARGET.unpack_from(buffer, offset + 8)
+            url_start = offset + 12
+        else:
+            if offset + 16 > end:
+                return i
+            cluster, blob = ARTICLE_TARGET.unpack_from(buffer, offset + 8)
+            redirect = NO_REDIRECT
+            url_start = offset + 16
+        url_end = buffer.find(NULL, url_start, end)
+        title_end = buffer.find(NULL, url_end + 1, end) if url_end >= 0 else -1
+        if title_end < 0:
+            return i
+        directory.namespace += namespace
+        directory.mimetype.append(mimetype)
+        directory.cluster.append(cluster)
+        directory.blob.append(blob)
+        directory.redirect.append(redirect)
+        pool += buffer[url_start:url_end]
+        offsets.append(len(pool))
+        pool += buffer[url_end + 1:title_end]
+        offsets.append(len(pool))
+    return len(ptrs)
+
+
+class DirectoryEntry(object):
+    """A directory entry decoded by unpack_entries. The fields are those
+    of the dict read_directory_entry_by_index returns; clusterNumber and
+    blobNumber are None for a redirect, redirectIndex for an article."""
+    __slots__ = ('index', 'mimetype', 'namespace', 'revision', 'clusterNumber', 'blobNumber', 'redirectIndex',
+                 'url', 'title', 'parameter')
+
+    def __init__(self, index, mimetype, namespace, revision, cluster, blob, redirect, url, title, parameter):
+        self.index = index
+        self.mimetype = mimetype
+        self.namespace = namespace
+        self.revision = revision
+        self.clusterNumber = cluster
+        self.blobNumber = blob
+        self.redirectIndex = redirect
+        self.url = url
+        self.title = title
+        self.parameter = parameter
+
+    def is_redirect(self):
+        return self.mimetype == REDIRECT_MIMETYPE
+
+    def as_dict(self):
+        """Returns the entry as the dict read_directory_entry_by_index gives"""
+        d = {'index': self.index,
+             'mimetype': self.mimetype,
+             'parameterLen': len(self.parameter),
+             'namespace': self.namespace,
+             'revision': self.revision,
+             'url': self.url,
+             'title': self.title,
+             'parameter': self.parameter}
+        if self.is_redirect():
+            d['redirectIndex'] = self.redirectIndex
+        else:
+            d['clusterNumber'] = self.clusterNumber
+            d['blobNumber'] = self.blobNumber
+        return d
+
+    def __repr__(self):
+        return 'DirectoryEntry(%r)' % self.as_dict()
+
+
+def unpack_entries(buffer, ptrs, start, base, first_index, entries):
+    """Decodes directory entries from buffer, which holds the file bytes
+    from offset base on, into DirectoryEntry objects appended to entries.
+    ptrs[i] is the pointer of the entry at index first_index + i. Starts
+    with ptrs[start] and stops at the first entry not entirely inside
+    buffer; returns its position in ptrs (len(ptrs) when all were decoded)."""
+    end = len(buffer)
+    view = memoryview(buffer)
+    for i in range(start, len(ptrs)):
+        offset = ptrs[i] - base
+        if offset < 0 or offset + REDIRECT_ENTRY.size > end:
+            return i
+        if ENTRY_HEAD.unpack_from(buffer, offset)[0] == REDIRECT_MIMETYPE:
+            mimetype, parameter_len, namespace, revision, redirect = REDIRECT_ENTRY.unpack_from(buffer, offset)
+            cluster = blob = None
+            url_start = offset + REDIRECT_ENTRY.size
+        else:
+            if offset + ARTICLE_ENTRY.size > end:
+                return i
+            mimetype, parameter_len, namespace, revision, cluster, blob = ARTICLE_ENTRY.unpack_from(buffer, offset)
+            redirect = None
+            url_start = offset + ARTICLE_ENTRY.size
+        url_end = buffer.find(NULL, url_start, end)
+        title_end = buffer.find(NULL, url_end + 1, end) if url_end >= 0 else -1
+        if title_end < 0 or title_end + 1 + parameter_len > end:
+            return i
+        entries.append(DirectoryEntry(first_index + i, mimetype, namespace, revision, cluster, blob, redirect,
+                                      str(view[url_start:url_end], 'utf-8'),
+                                      str(view[url_end + 1:title_end], 'utf-8'),
+                                      bytes(view[title_end + 1:title_end + 1 + parameter_len])))
+    return len(ptrs)
+
+
+class Directory(object):
+    """All directory entries of a ZIM file decoded into compact columns.
+
+    Entry i lives in namespace[i], mimetype[i], cluster[i], blob[i] and
+    redirect[i] (NO_REDIRECT unless it is a redirect). Its url and title
+    are pool[offsets[2i]:offsets[2i+1]] and pool[offsets[2i+1]:offsets[2i+2]].
+    A Directory made by subset() holds some entries only; indexes[i] is
+    then the index of entry i in the ZIM file.
+    """
+
+    def __init__(self, mime_types):
+        self.mime_types = mime_types
+        self.namespace = bytearray()
+        self.mimetype = array('H')
+        self.cluster = array('I')
+        self.blob = array('I')
+        self.redirect = array('I')
+        self.offsets = array('Q', [0])
+        self.pool = bytearray()
+        self.indexes = None
+
+    def __len__(self):
+        return len(self.mimetype)
+
+    def url(self, index):
+        return self.pool[self.offsets[2 * index]:self.offsets[2 * index + 1]].decode('utf-8')
+
+    def title(self, index):
+        return self.pool[self.offsets[2 * index + 1]:self.offsets[2 * index + 2]].decode('utf-8')
+
+    def is_redirect(self, index):
+        return self.mimetype[index] == REDIRECT_MIMETYPE
+
+    def entry(self, index):
+        """Returns the entry as the dict read_directory_entry_by_index gives"""
+        d = {'mimetype': self.mimetype[index],
+             'namespace': bytes(self.namespace[index:index + 1]),
+             'url': self.url(index),
+             'title': self.title(index),
+             'index': self.indexes[index] if self.indexes is not None else index}
+        if self.is_redirect(index):
+            d['redirectIndex'] = self.redirect[index]
+        else:
+            d['clusterNumber'] = self.cluster[index]
+            d['blobNumber'] = self.blob[index]
+        return d
+
+    def subset(self, indexes):
+        """Returns a Directory holding only the entries at indexes, in that order"""
+        d = Directory(self.mime_types)
+        d.indexes = array('I', (self.indexes[i] for i in indexes) if self.indexes is not None else indexes)
+        for i in indexes:
+            d.namespace += self.namespace[i:i + 1]
+            d.mimetype.append(self.mimetype[i])
+            d.cluster.append(self.cluster[i])
+            d.blob.append(self.blob[i])
+            d.redirect.append(self.redirect[i])
+            d.pool += self.pool[self.offsets[2 * i]:self.offsets[2 * i + 1]]
+            d.offsets.append(len(d.pool))
+            d.pool += self.pool[self.offsets[2 * i + 1]:self.offsets[2 * i + 2]]
+            d.offsets.append(len(d.pool))
+        return d
+
+    def namespace_ranges(self):
+        """Returns {namespace: (first index, last index + 1)}; entries are
+        sorted by namespace so each namespace is one contiguous range"""
+        ranges = {}
+        start = 0
+        for namespace, group in itertools.groupby(self.namespace):
+            end = start + sum(1 for _ in group)
+            ranges[bytes([namespace])] = (start, end)
+            start = end
+        return ranges
+
+    def mask(self, namespace=None, redirects=True, mimetypes=None, clusters=None):
+        """Returns a bytes object with 1 for each entry in the namespace, of one
+        of the mimetypes (names), unless redirects is set not a redirect and,
+        if clusters (a range of cluster numbers) is given, stored in one of them."""
+        wanted = None
+        if mimetypes is not None:
+            wanted = set(self.mime_types.index(m) for m in mimetypes if m in self.mime_types)
+            if redirects:
+                wanted.add(REDIRECT_MIMETYPE)
+
+        if numpy is not None:
+            m = numpy.ones(len(self), dtype=bool)
+            if namespace is not None:
+                m &= numpy.frombuffer(self.namespace, dtype=numpy.uint8) == ord(namespace)
+            mimes = numpy.frombuffer(self.mimetype, dtype=numpy.uint16)
+            if wanted is not None:
+                m &= numpy.isin(mimes, list(wanted))
+            elif not redirects:
+                m &= mimes != REDIRECT_MIMETYPE
+            if clusters is not None:
+                c = numpy.frombuffer(self.cluster, dtype=numpy.uint32)
+                m &= (c >= clusters.start) & (c < clusters.stop) & (mimes != REDIRECT_MIMETYPE)
+            return m.tobytes()
+
+        m = None
+        if namespace is not None:
+            table = bytearray(256)
+            table[ord(namespace)] = 1
+            m = self.namespace.translate(table)
+        if wanted is not None:
+            mime_mask = bytes(map(wanted.__contains__, self.mimetype))
+        elif not redirects:
+            mime_mask = bytes(map(REDIRECT_MIMETYPE.__ne__, self.mimetype))
+        else:
+            mime_mask = None
+        if m is None:
+            m = mime_mask
+        elif mime_mask is not None:
+            m = bytes(map(operator.and_, m, mime_mask))
+        if clusters is not None:
+            # redirects have no cluster
+            cluster_mask = bytes(map(operator.and_, map(clusters.__contains__, self.cluster),
+                                     map(REDIRECT_MIMETYPE.__ne__, self.mimetype)))
+            m = cluster_mask if m is None else bytes(map(operator.and_, m, cluster_mask))
+        return bytes(m) if m is not None else b'\x01' * len(self)
+
+    def select(self, namespace=None, redirects=True, mimetypes=None, clusters=None):
+        """Returns an array with the indexes of the entries matching mask()"""
+        m = self.mask(namespace, redirects, mimetypes, clusters)
+        if numpy is not None:
+            indexes = numpy.flatnonzero(numpy.frombuffer(m, dtype=bool))
+            return array('I', indexes.astype(numpy.uint32).tobytes())
+        return array('I', itertools.compress(range(len(self)), m))
+
+    def resolve_redirects(self):
+        """Returns, for every entry, the ZIM index of the entry it finally
+        stands for: itself for a non-redirect, the end of the chain for a
+        redirect, NO_REDIRECT when the chain loops or leaves this Directory.
+        Works on a whole directory or a namespace range of it."""
+        n = len(self)
+        base = 0
+        if self.indexes is not None:
+            if not isinstance(self.indexes, range):
+                raise ValueError("Redirects can only be resolved over a contiguous directory")
+            base = self.indexes.start
+
+        if numpy is not None:
+            is_redirect = numpy.frombuffer(self.mimetype, dtype=numpy.uint16) == REDIRECT_MIMETYPE
+            target = numpy.frombuffer(self.redirect, dtype=numpy.uint32).astype(numpy.int64) - base
+            # entry n is a sentinel standing for every target out of range
+            final = numpy.append(numpy.where(is_redirect, target, numpy.arange(n)), n)
+            final[:n][is_redirect & ((target < 0) | (target >= n))] = n
+            is_redirect = numpy.append(is_redirect, False)
+            # pointer jumping: every round doubles the length of the chains collapsed
+            for _ in range(n.bit_length() + 1):
+                jumped = final[final]
+                if numpy.array_equal(jumped, final):
+                    break
+                final = jumped
+            # whatever still points to a redirect is on or leads into a cycle
+            unresolved = is_redirect[final] | (final == n)
+            final = numpy.where(unresolved, NO_REDIRECT, final + base)[:n]
+            return array('I', final.astype(numpy.uint32).tobytes())
+
+        final = array('I', [NO_REDIRECT]) * n
+        done = bytearray(n)
+        for i in range(n):
+            path = []
+            j = i
+            while 0 <= j < n and not done[j] and self.mimetype[j] == REDIRECT_MIMETYPE and j not in path:
+                path.append(j)
+                j = self.redirect[j] - base
+            if not 0 <= j < n or j in path:
+                result = NO_REDIRECT
+            elif done[j]:
+                result = final[j]
+            else:
+                result = j + base
+                done[j] = 1
+                final[j] = result
+            for k in path:
+                done[k] = 1
+                final[k] = result
+        return final
+
+    def aliases(self):
+        """Returns {ZIM index of an entry: [titles of the redirects to it]}"""
+        aliases = {}
+        final = self.resolve_redirects()
+        for i in itertools.compress(range(len(self)), self.mask(mimetypes=[], redirects=True)):
+            if final[i] != NO_REDIRECT:
+                aliases.setdefault(final[i], []).append(self.title(i) or self.url(i))
+        return aliases
+
+    def cluster_mask(self, namespace=None, mimetypes=None, count=None):
+        """Returns a bytearray with 1 for each cluster (count of them, or up
+        to the last one used) holding a non-redirect entry of namespace and
+        of one of the mimetypes. The clusters left at 0 need not be read."""
+        indexes = self.select(namespace=namespace, redirects=False, mimetypes=mimetypes)
+        if count is None:
+            count = max((self.cluster[i] for i in indexes), default=-1) + 1
+        m = bytearray(count)
+        for i in indexes:
+            m[self.cluster[i]] = 1
+        return m
+
+    def cluster_groups(self, namespace=None, mimetypes=None, clusters=None):
+        """Returns [(cluster number, [indexes of its entries by blob])] in
+        cluster order for the non-redirect entries matching mask(), the
+        order in which the readers walk the clusters, each read once"""
+        indexes = self.cluster_order(self.select(namespace=namespace, redirects=False,
+                                                 mimetypes=mimetypes, clusters=clusters))
+        return [(cluster_index, list(group)) for cluster_index, group
+                in itertools.groupby(indexes, key=self.cluster.__getitem__)]
+
+    def cluster_order(self, indexes):
+        """Returns the indexes sorted by cluster and then blob, so a walk over
+        them reads every cluster once, front to back"""
+        if numpy is not None:
+            indexes = numpy.frombuffer(indexes, dtype=numpy.uint32)
+            clusters = numpy.frombuffer(self.cluster, dtype=numpy.uint32)[indexes]
+            blobs = numpy.frombuffer(self.blob, dtype=numpy.uint32)[indexes]
+            order = numpy.lexsort((blobs, clusters))
+            return array('I', indexes[order].tobytes())
+        return array('I', sorted(indexes, key=lambda i: (self.cluster[i], self.blob[i])))
+
+
 class ZimFile(object):
-    def __init__(self, filename, cache_size=4):
+    # the class reading the clusters handed out by clusterCache
+    cluster_class = ClusterData
+
+    def __init__(self, filename, cache_size=None, cache_bytes=64 << 20, cache_policy='lru', key_cache_size=1 << 16):
         self.filename = filename
         self.redirectEntryFormat = RedirectEntryFormat()
         self.articleEntryFormat = ArticleEntryFormat()
         self.clusterFormat = ClusterFormat()
-        self.f = open(filename, "rb")
-        self.header = dict(HeaderFormat().unpack_from_file(self.f))
-        self.mimeTypeList = MimeTypeListFormat().unpack_from_file(self.f, self.header['mimeListPos'])
-        self.clusterCache = ClusterCache(cache_size=cache_size)
+        # all reads are positional, so threads can share the ZimFile
+        self.f = self.open_file(filename)
+        self.header = dict(HeaderFormat().unpack(self.f.pread(HeaderFormat().size, 0)))
+        self.mimeTypeList = self.read_decoded(MimeTypeListFormat().unpack, self.header['mimeListPos'])
+        self.clusterCache = ClusterCache(cache_size=cache_size, cluster_class=self.cluster_class,
+                                         max_bytes=cache_bytes, policy=cache_policy)
+        self._cluster_ends = None
+        self.spill = None
+        # the SidecarIndex of the file, once load_sidecar has opened it
+        self.sidecar = None
+        self.key_cache_size = key_cache_size
+        self._url_keys = {}
+        self._title_keys = {}
+
+    def open_file(self, filename):
+        """Returns the PositionalFile (or HttpFile) the archive is read from"""
+        return open_positional(filename)
 
     def close(self):
         self.clusterCache.clear()
@@ -384,8 +1458,7 @@ class ZimFile(object):
                       h['uuid5'], h['uuid6'], h['uuid7'], h['uuid8'], h['uuid9'],
                       h['uuid10'], h['uuid11'], h['uuid12'], h['uuid13'], h['uuid14'],
                       h['uuid15']]
-        s = string.join([chr(x) for x in uuid_bytes], "")
-        return uuid.UUID(bytes=s)
+        return uuid.UUID(bytes=bytes(uuid_bytes))
 
     def get_kiwix_uuid(self):
         """Kiwix seems to have a bug in their library.xml which causes the
@@ -394,34 +1467,47 @@ class ZimFile(object):
         s = str(u).split("-")
         return s[0] + "-" + s[1] + "-" + s[2] + "-" + s[2] + "-" + s[3] + s[4]
 
+    def read_bytes(self, offset, size):
+        """Returns size bytes of the file from offset (fewer at its end)"""
+        return self.f.pread(size, offset)
+
+    def read_decoded(self, decode, offset, size=256):
+        """Reads size bytes at offset and returns decode(bytes), reading
+        twice as many until decode finds everything it needs in them"""
+        while True:
+            buf = self.f.pread(size, offset)
+            try:
+                return decode(buf)
+            except (IOError, struct.error):
+                if len(buf) < size:
+                    raise IOError("Truncated data at %s" % offset)
+            size *= 2
+
     def read_directory_entry(self, offset):
         """May return either a Redirect or Article entry depending on flag"""
-        self.f.seek(offset)
-        buf = self.f.read(2)
-        fields = struct.unpack('H', buf)
-        if fields[0] == 0xffff:  # Then redirect
-            return dict(self.redirectEntryFormat.unpack_from_file(self.f, offset))
-        else:
-            return dict(self.articleEntryFormat.unpack_from_file(self.f, offset))
+        def decode(buf):
+            fields = struct.unpack_from('<H', buf)
+            if fields[0] == 0xffff:  # Then redirect
+                return dict(self.redirectEntryFormat.unpack(buf))
+            else:
+                return dict(self.articleEntryFormat.unpack(buf))
+        return self.read_decoded(decode, offset)
 
     def read_url_pointer(self, index):
-        self.f.seek(self.header['urlPtrPos'] + 8 * index)
-        buf = self.f.read(8)
-        fields = struct.unpack('Q', buf)
+        buf = self.f.pread(8, self.header['urlPtrPos'] + 8 * index)
+        fields = struct.unpack('<Q', buf)
         return fields[0]
 
     def read_title_pointer(self, index):
-        self.f.seek(self.header['titlePtrPos'] + 4 * index)
-        buf = self.f.read(4)
-        fields = struct.unpack('L', buf)
+        buf = self.f.pread(4, self.header['titlePtrPos'] + 4 * index)
+        fields = struct.unpack('<I', buf)
         return fields[0]
 
     def read_cluster_pointer(self, index):
         """Returns a pointer to the cluster"""
 
-        self.f.seek(self.header['clusterPtrPos'] + 8 * index)
-        buf = self.f.read(8)
-        fields = struct.unpack('Q', buf)
+        buf = self.f.pread(8, self.header['clusterPtrPos'] + 8 * index)
+        fields = struct.unpack('<Q', buf)
         return fields[0]
 
     def read_directory_entry_by_index(self, index):
@@ -430,19 +1516,62 @@ class ZimFile(object):
         d['index'] = index
         return d
 
+    def read_cluster_range(self, index):
+        """Returns the offsets where the cluster starts and ends. The end is
+        taken from the next cluster pointer (the checksum for the last one);
+        that may overshoot when clusters are not stored in pointer order,
+        which only costs some extra bytes read."""
+        if index + 1 < self.header['clusterCount']:
+            start, end = self.read_pointer_list(self.header['clusterPtrPos'] + 8 * index, 2)
+        else:
+            start, end = self.read_cluster_pointer(index), self.header['checksumPos']
+        if end <= start:
+            if self._cluster_ends is None:
+                self._cluster_ends = self.cluster_ranges()[1]
+            end = self._cluster_ends[index]
+        return start, end
+
     def read_blob(self, cluster_index, blob_index):
-        ptr = self.read_cluster_pointer(cluster_index)
-        cluster_data = self.clusterCache.get(self.f, ptr)
-        return cluster_data.read_blob(blob_index)
+        ptr, end = self.read_cluster_range(cluster_index)
+        return self.clusterCache.read_blob(self.f, ptr, end, blob_index)
+
+    def read_cluster(self, cluster_index):
+        """Reads and decompresses a whole cluster without adding it to the
+        cache (but completing the cached one if the cluster is there, see
+        ClusterCache.read_cluster). With a spill cache (see use_spill) a cluster decompressed before, in this
+        run or an earlier one, is read back from the disk instead."""
+        if self.spill is not None:
+            return self.spill.read_cluster(cluster_index, self.load_cluster)
+        return self.load_cluster(cluster_index)
+
+    def load_cluster(self, cluster_index):
+        ptr, end = self.read_cluster_range(cluster_index)
+        return self.clusterCache.read_cluster(self.f, ptr, end)
+
+    def use_spill(self, root, max_bytes=4 << 30):
+        """Keeps the clusters read_cluster decompresses in files under root,
+        at most max_bytes of them, for this and later runs (see zim.spill)"""
+        from zim.spill import SpillCache
+        self.spill = SpillCache(root, self.get_uuid(), max_bytes)
+        return self.spill
+
+    def resolve_entry(self, index, follow_redirect=True):
+        """Returns the directory entry at index, or with follow_redirect the
+        entry the redirect chain starting there ends at"""
+        entry = self.read_directory_entry_by_index(index)
+        seen = set()
+        while follow_redirect and 'redirectIndex' in entry.keys():
+            seen.add(entry['index'])
+            if entry['redirectIndex'] in seen:
+                raise IOError("Redirect cycle through entry %s" % index)
+            logger.debug("REDIRECT TO " + str(entry['redirectIndex']))
+            entry = self.read_directory_entry_by_index(entry['redirectIndex'])
+        return entry
 
     def get_article_by_index(self, index, follow_redirect=True):
-        entry = self.read_directory_entry_by_index(index)
+        entry = self.resolve_entry(index, follow_redirect)
         if 'redirectIndex' in entry.keys():
-            if follow_redirect:
-                logger.debug("REDIRECT TO " + str(entry['redirectIndex']))
-                return self.get_article_by_index(entry['redirectIndex'], follow_redirect)
-            else:
-                return None, entry['redirectIndex'], entry['namespace']
+            return None, entry['redirectIndex'], entry['namespace']
         data = self.read_blob(entry['clusterNumber'], entry['blobNumber'])
         mime = self.mimeTypeList[entry['mimetype']]
         namespace = entry['namespace']
@@ -455,19 +1584,93 @@ class ZimFile(object):
                 return i
         return None
 
-    def get_entry_by_url(self, namespace, url):
-        nsurl = full_url(namespace, url)
-
-        def check(idx):
-            entry = self.read_directory_entry_by_index(idx)
-            return full_url(entry['namespace'], entry['url'])
+    def read_entry_strings(self, offset, size=256):
+        """Reads the namespace, url and title of the directory entry at
+        offset as bytes, without decoding the rest of the entry"""
+        while True:
+            buf = self.f.pread(size, offset)
+            strings = unpack_entry_strings(buf, 0)
+            if strings is not None:
+                return strings
+            if len(buf) < size:
+                raise IOError("Truncated directory entry at %s" % offset)
+            size *= 2
+
+    def _cached_key(self, keys, position, read_key):
+        key = keys.get(position)
+        if key is None:
+            if len(keys) >= self.key_cache_size:
+                keys.clear()
+            key = keys[position] = read_key(position)
+        return key
+
+    def url_key(self, index):
+        """(namespace, url) of the entry at index, as bytes: the sort key
+        of the URL pointer list. Decoded keys are cached for later probes."""
+        def read_key(index):
+            namespace, url, title = self.read_entry_strings(self.read_url_pointer(index))
+            return namespace, url
+        return self._cached_key(self._url_keys, index, read_key)
+
+    def title_key(self, position):
+        """(namespace, title) of the entry at position in the title pointer
+        list, as bytes (the url when the title is empty). Cached like url_key."""
+        def read_key(position):
+            namespace, url, title = self.read_entry_strings(self.read_url_pointer(self.read_title_pointer(position)))
+            return namespace, title or url
+        return self._cached_key(self._title_keys, position, read_key)
 
-        m = binary_search(check, nsurl, 0, self.header['articleCount'])
-        if m is None:
+    def get_entry_by_url(self, namespace, url):
+        """Returns the entry with that url and its index, or (None, None)"""
+        target = (as_bytes(namespace), as_bytes(url))
+        count = self.header['articleCount']
+        m = lower_bound(self.url_key, target, 0, count)
+        if m == count or self.url_key(m) != target:
             return None, None
         entry = self.read_directory_entry_by_index(m)
         return entry, m
 
+    def get_entry_by_title(self, namespace, title):
+        """Returns the entry with that title and its index, or (None, None)"""
+        target = (as_bytes(namespace), as_bytes(title))
+        count = self.header['articleCount']
+        m = lower_bound(self.title_key, target, 0, count)
+        if m == count or self.title_key(m) != target:
+            return None, None
+        index = self.read_title_pointer(m)
+        return self.read_directory_entry_by_index(index), index
+
+    def prefix_search(self, prefix, limit=None, namespace=b'A', order='url'):
+        """Generator of the entries of namespace whose url (order='url') or
+        title (order='title') starts with prefix, in that order, at most limit"""
+        if order == 'url':
+            key, index_at = self.url_key, lambda position: position
+        elif order == 'title':
+            key, index_at = self.title_key, self.read_title_pointer
+        else:
+            raise ValueError("order must be 'url' or 'title', not %r" % order)
+        namespace, prefix = as_bytes(namespace), as_bytes(prefix)
+        count = self.header['articleCount']
+        position = lower_bound(key, (namespace, prefix), 0, count)
+        found = 0
+        while position < count and (limit is None or found < limit):
+            ns, s = key(position)
+            if ns != namespace or not s.startswith(prefix):
+                return
+            yield self.read_directory_entry_by_index(index_at(position))
+            found += 1
+            position += 1
+
+    def match_urls(self, namespace, urls):
+        """Returns {url: index} for the urls with an entry in namespace,
+        found in one merge_join of the sorted urls against the URL pointer
+        list rather than a binary search for each"""
+        namespace = as_bytes(namespace)
+        targets = sorted(set((namespace, as_bytes(url)) for url in urls))
+        indexes = self.namespace_range(namespace)
+        return {url.decode('utf-8'): index for (_, url), index
+                in merge_join(self.url_key, targets, indexes.start, indexes.stop)}
+
     def get_article_by_url(self, namespace, url, follow_redirect=True):
         entry, idx = self.get_entry_by_url(namespace, url)
         if idx is None:
@@ -480,24 +1683,207 @@ class ZimFile(object):
 
     def metadata(self):
         metadata = {}
-        for i in range(self.header['articleCount'] - 1, -1, -1):
+        for i in self.namespace_range(b'M'):
             entry = self.read_directory_entry_by_index(i)
-            if entry['namespace'] == b'M':
-                m_name = entry['url']
-                # Lower case first letter to match kiwix-library names convention
-                m_name = re.sub(r'^([A-Z])', lambda pat: pat.group(1).lower(), m_name)
-                metadata[m_name] = self.get_article_by_index(i)[0]
-            else:
-                break
+            m_name = entry['url']
+            # Lower case first letter to match kiwix-library names convention
+            m_name = re.sub(r'^([A-Z])', lambda pat: pat.group(1).lower(), m_name)
+            metadata[m_name] = bytes(self.get_article_by_index(i)[0])
 
         return metadata
 
-    def articles(self):
-        """Generator which iterates through all articles"""
-        for i in range(self.header['articleCount']):
-            entry = self.read_directory_entry_by_index(i)
-            entry['fullUrl'] = full_url(entry['namespace'], entry['url'])
-            yield entry
+    def read_pointer_list(self, pos, count):
+        """Reads count 64 bit pointers starting at pos with a single read"""
+        ptrs = array('Q')
+        ptrs.frombytes(self.f.pread(8 * count, pos))
+        if sys.byteorder == 'big':
+            ptrs.byteswap()
+        return ptrs
+
+    def read_url_pointers(self):
+        """Reads the whole URL pointer list"""
+        return self.read_pointer_list(self.header['urlPtrPos'], self.header['articleCount'])
+
+    def read_cluster_pointers(self):
+        """Reads the whole cluster pointer list"""
+        return self.read_pointer_list(self.header['clusterPtrPos'], self.header['clusterCount'])
+
+    def cluster_ranges(self):
+        """Returns the cluster pointers and, for each cluster, the offset where
+        it ends: the next cluster in the file, or the checksum"""
+        ptrs = self.read_cluster_pointers()
+        return ptrs, cluster_ends(ptrs, self.header['checksumPos'])
+
+    def read_namespace(self, index):
+        """Reads only the namespace of the directory entry at index"""
+        return self.f.pread(1, self.read_url_pointer(index) + 3)
+
+    def namespace_range(self, namespace):
+        """Returns the range of indexes of the entries in namespace, found with
+        two binary searches over the URL pointer list (sorted by namespace),
+        or taken from the sidecar index if one is loaded"""
+        if self.sidecar is not None:
+            return self.sidecar.namespace_range(namespace)
+        count = self.header['articleCount']
+        start = lower_bound(self.read_namespace, namespace, 0, count)
+        end = lower_bound(self.read_namespace, bytes([namespace[0] + 1]), start, count) if namespace[0] < 255 else count
+        return range(start, end)
+
+    def directory_pointers(self, namespace=None):
+        """Returns the URL pointers of all entries, or of those in namespace,
+        with the range of indexes they cover"""
+        if namespace is None:
+            return self.read_url_pointers(), range(self.header['articleCount'])
+        indexes = self.namespace_range(namespace)
+        return self.read_pointer_list(self.header['urlPtrPos'] + 8 * indexes.start, len(indexes)), indexes
+
+    def read_directory_entries(self, start=0, stop=None, block_size=1 << 20):
+        """Returns the directory entries at indexes start to stop (the end by
+        default) as DirectoryEntry objects, decoded from blocks of the file
+        of block_size bytes rather than field by field"""
+        if stop is None:
+            stop = self.header['articleCount']
+        ptrs = self.read_pointer_list(self.header['urlPtrPos'] + 8 * start, max(stop - start, 0))
+        entries = []
+        i = 0
+        while i < len(ptrs):
+            block = self.f.pread(block_size, ptrs[i])
+            decoded = unpack_entries(block, ptrs, i, ptrs[i], start, entries)
+            if decoded == i:
+                if len(block) < block_size:
+                    raise IOError("Truncated directory entry at %s" % ptrs[i])
+                # a single entry larger than the block
+                block_size *= 2
+            i = decoded
+        return entries
+
+    def load_directory(self, namespace=None, block_size=1 << 24):
+        """Decodes every directory entry, or only those in namespace, into a
+        Directory, reading the file in blocks of block_size bytes rather
+        than field by field"""
+        ptrs, indexes = self.directory_pointers(namespace)
+        directory = Directory(self.mimeTypeList)
+        if namespace is not None:
+            directory.indexes = indexes
+        i = 0
+        while i < len(ptrs):
+            block = self.f.pread(block_size, ptrs[i])
+            decoded = unpack_directory_entries(block, ptrs, i, ptrs[i], directory)
+            if decoded == i:
+                if len(block) < block_size:
+                    raise IOError("Truncated directory entry at %s" % ptrs[i])
+                # a single entry larger than the block
+                block_size *= 2
+            i = decoded
+        return directory
+
+    def plan_shards(self, count, namespace=b'A', directory=None, mimetypes=None):
+        """Splits the clusters into count ranges of consecutive cluster
+        numbers holding about as many compressed bytes of the articles of
+        namespace (of one of mimetypes if given) each. A cluster belongs to a
+        single range, so no cluster is decompressed by two shards, and the
+        plan only depends on the file, so separate processes or machines
+        agree on it without talking."""
+        if count < 1:
+            raise ValueError("Number of shards must be at least 1")
+        if directory is None:
+            directory = self.load_directory(namespace=namespace)
+        ptrs, ends = self.cluster_ranges()
+        used = directory.cluster_mask(namespace=namespace, mimetypes=mimetypes, count=len(ptrs))
+        sizes = [ends[c] - ptrs[c] if used[c] else 0 for c in range(len(ptrs))]
+        total = sum(sizes)
+        # bounds[k] is the first cluster of shard k
+        bounds = [0] * count + [len(ptrs)]
+        shard = 0
+        done = 0
+        for c, size in enumerate(sizes):
+            if not size:
+                continue
+            # the shard the middle of the cluster falls in gets it
+            k = min(count - 1, (2 * done + size) * count // (2 * total))
+            while shard < k:
+                shard += 1
+                bounds[shard] = c
+            done += size
+        for k in range(shard + 1, count):
+            bounds[k] = len(ptrs)
+        return [range(bounds[k], bounds[k + 1]) for k in range(count)]
+
+    def sample_articles(self, count, namespace=b'A', directory=None, mimetypes=None, strata=1, seed=0):
+        """Returns a Directory (see Directory.subset) of count non-redirect
+        entries of namespace (of one of mimetypes if given) picked at random
+        with seed, in cluster order. The pick only reads the directory and
+        the cluster pointers, and depends on nothing but the file and the
+        arguments. With strata > 1 the entries are sorted by size and cut
+        into strata runs of as many entries, and each run gives its share of
+        the sample, so small and large pages are all represented. Blob sizes
+        are only known once clusters are read, so the size of an entry is
+        taken to be the compressed size of its cluster over the number of
+        entries in it."""
+        if directory is None:
+            directory = self.load_directory(namespace=namespace)
+        # in the order of the file, whatever the order of directory
+        zim_index = directory.indexes.__getitem__ if directory.indexes is not None else int
+        indexes = sorted(directory.select(namespace=namespace, redirects=False, mimetypes=mimetypes), key=zim_index)
+        rnd = random.Random(seed)
+        if strata <= 1:
+            picks = rnd.sample(indexes, min(count, len(indexes)))
+        else:
+            ptrs, ends = self.cluster_ranges()
+            blobs = Counter(directory.cluster[i] for i in directory.select(redirects=False))
+
+            def size(index):
+                cluster_index = directory.cluster[index]
+                return (ends[cluster_index] - ptrs[cluster_index]) / blobs[cluster_index]
+            indexes.sort(key=lambda index: (size(index), zim_index(index)))
+            picks = []
+            for k in range(strata):
+                stratum = indexes[len(indexes) * k // strata:len(indexes) * (k + 1) // strata]
+                share = count * (k + 1) // strata - count * k // strata
+                picks.extend(rnd.sample(stratum, min(share, len(stratum))))
+        return directory.subset(directory.cluster_order(array('I', sorted(picks))))
+
+    def aliases(self, namespace=b'A', directory=None):
+        """Returns {ZIM index of an entry: [titles of the redirects to it]}
+        for the entries of namespace, see Directory.aliases, from directory
+        (the whole namespace, redirects included) if it is already loaded"""
+        if directory is None:
+            directory = self.load_directory(namespace=namespace)
+        return directory.aliases()
+
+    def iter_blobs_by_cluster(self, namespace=b'A', directory=None, clusters=None, mimetypes=None):
+        """Generator of (entry, blob) for the non-redirect entries of namespace
+        in cluster order, only those in the range clusters if given (see
+        plan_shards) and of one of mimetypes if given. The entries are picked
+        from the directory before any blob is read, so clusters holding none
+        of them are never decompressed. Every other cluster is decompressed
+        exactly once, which clusterCache.loads records."""
+        if directory is None:
+            directory = self.load_directory(namespace=namespace)
+        for cluster_index, group in directory.cluster_groups(namespace, mimetypes, clusters):
+            cluster_data = self.read_cluster(cluster_index)
+            for index in group:
+                yield directory.entry(index), cluster_data.read_blob(directory.blob[index])
+
+    def iter_blobs_of_entries(self, entries, mimetypes=None):
+        """Generator of (entry, blob) for the non-redirect entries (dicts
+        such as read_directory_entry_by_index gives) of one of mimetypes if
+        given, in cluster order, so every cluster is decompressed once and
+        only the clusters holding them are read"""
+        for cluster_index, group in entries_by_cluster(entries, self.mimeTypeList, mimetypes):
+            cluster_data = self.read_cluster(cluster_index)
+            for entry in group:
+                yield entry, cluster_data.read_blob(entry['blobNumber'])
+
+    def articles(self, namespace=None, batch_size=4096):
+        """Generator which iterates through all articles, or only those in
+        namespace, decoding batch_size directory entries at a time"""
+        indexes = range(self.header['articleCount']) if namespace is None else self.namespace_range(namespace)
+        for start in range(indexes.start, indexes.stop, batch_size):
+            for entry in self.read_directory_entries(start, min(start + batch_size, indexes.stop)):
+                entry = entry.as_dict()
+                entry['fullUrl'] = full_url(entry['namespace'], entry['url'])
+                yield entry
 
     def validate(self):
         """This is a mostly a self-test, but will validate various assumptions"""
@@ -529,6 +1915,75 @@ class ZimFile(object):
             if article is None:  # Redirect
                 assert mime is not None
 
+    def verify(self, chunk_size=1 << 24, checksum=True):
+        """Checks the integrity of the file in a few sequential passes: the
+        MD5 checksum at checksumPos (read in chunks of chunk_size), the
+        pointer lists and cluster pointers lying inside the file, and the
+        order of the URLs (decoded with load_directory). Returns the list of
+        problems found, empty when the file is fine."""
+        h = self.header
+        size = self.f.size
+        end = h['checksumPos']
+        problems = []
+        if end + 16 > size:
+            # truncated: check what is left
+            problems.append("Checksum at %s is beyond the end of the file (%s bytes)" % (end, size))
+            end = size
+        elif checksum:
+            md5 = hashlib.md5()
+            pos = 0
+            while pos < end:
+                chunk = self.read_bytes(pos, min(chunk_size, end - pos))
+                md5.update(chunk)
+                pos += len(chunk)
+            if md5.digest() != bytes(self.read_bytes(end, 16)):
+                problems.append("MD5 checksum does not match")
+
+        tables = [('URL pointer list', h['urlPtrPos'], 8 * h['articleCount']),
+                  ('title pointer list', h['titlePtrPos'], 4 * h['articleCount']),
+                  ('cluster pointer list', h['clusterPtrPos'], 8 * h['clusterCount']),
+                  ('mime type list', h['mimeListPos'], 1)]
+        start = HeaderFormat().size
+        # nothing more can be read safely once a table is outside the file
+        outside = ["The %s (at %s) is outside the file" % (name, pos)
+                   for name, pos, length in tables if pos < start or pos + length > end]
+        if outside:
+            return problems + outside
+
+        cluster_ptrs = self.read_cluster_pointers()
+        for name, ptrs in (('Cluster', cluster_ptrs), ('Directory entry', self.read_url_pointers())):
+            bad = [i for i, ptr in enumerate(ptrs) if not start <= ptr < end]
+            if bad:
+                outside.append("%s pointers %s outside the file (%d in all)" % (name, bad[:10], len(bad)))
+        if outside:
+            return problems + outside
+        cut = [c for c, cluster_end in enumerate(cluster_ends(cluster_ptrs, h['checksumPos'])) if cluster_end > size]
+        if cut:
+            problems.append("Clusters %s are cut off by the end of the file (%d in all)" % (cut[:10], len(cut)))
+
+        titles = array('I', self.read_bytes(h['titlePtrPos'], 4 * h['articleCount']))
+        if sys.byteorder == 'big':
+            titles.byteswap()
+        if titles and max(titles) >= h['articleCount']:
+            problems.append("The title pointer list points past the last entry")
+
+        directory = self.load_directory()
+        pool, offsets, namespace = directory.pool, directory.offsets, directory.namespace
+        last = None
+        for i in range(len(directory)):
+            key = (namespace[i], pool[offsets[2 * i]:offsets[2 * i + 1]])
+            if last is not None and key <= last:
+                problems.append("URLs are not in order at entry %s (%r)" % (i, directory.url(i)))
+                break
+            last = key
+        articles = directory.select(redirects=False)
+        if articles and max(directory.cluster[i] for i in articles) >= h['clusterCount']:
+            problems.append("Articles point past the last cluster")
+        redirects = directory.select(mimetypes=[], redirects=True)
+        if redirects and max(directory.redirect[i] for i in redirects) >= h['articleCount']:
+            problems.append("Redirects point past the last entry")
+        return problems
+
     def list_articles_by_url(self):
         """Mostly for testing"""
         s = ""
@@ -536,3 +1991,142 @@ class ZimFile(object):
             entry = self.read_directory_entry_by_index(i)
             s += full_url(entry['namespace'], entry['url']) + "\n"
         return s
+
+
+class MmapZimFile(ZimFile):
+    """ZimFile backed by a read-only memory map of the archive.
+
+    The header, pointer tables and directory entries are decoded in place
+    with struct.unpack_from instead of a seek() and read() per field, and
+    blobs are returned as memoryview slices (see MmapClusterData).
+    Archives split into chunks are read by SplitMmapZimFile.
+    """
+    reads_split = False
+    cluster_class = MmapClusterData
+
+    def open_file(self, filename):
+        """Opens the archive and maps it into self.mm and self.buf"""
+        f = PositionalFile(filename)
+        if len(f.fds) > 1 and not self.reads_split:
+            f.close()
+            raise IOError("%s is split into chunks, open it with SplitMmapZimFile" % filename)
+        if self.reads_split:
+            self.mm = self.buf = SplitMap(f)
+        else:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buf = memoryview(self.mm)
+        return f
+
+    def close(self):
+        self.clusterCache.clear()
+        self.buf.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            # blobs handed out are still alive; the map goes away with them
+            logger.debug("mmap of %s still referenced by blobs" % self.filename)
+        self.f.close()
+
+    def read_directory_entry(self, offset):
+        """May return either a Redirect or Article entry depending on flag"""
+        if struct.unpack_from('<H', self.buf, offset)[0] == 0xffff:
+            return dict(self.redirectEntryFormat.unpack(self.mm, offset))
+        else:
+            return dict(self.articleEntryFormat.unpack(self.mm, offset))
+
+    def read_url_pointer(self, index):
+        return struct.unpack_from('<Q', self.buf, self.header['urlPtrPos'] + 8 * index)[0]
+
+    def read_title_pointer(self, index):
+        return struct.unpack_from('<I', self.buf, self.header['titlePtrPos'] + 4 * index)[0]
+
+    def read_cluster_pointer(self, index):
+        """Returns a pointer to the cluster"""
+        return struct.unpack_from('<Q', self.buf, self.header['clusterPtrPos'] + 8 * index)[0]
+
+    def read_blob(self, cluster_index, blob_index):
+        ptr, end = self.read_cluster_range(cluster_index)
+        return self.clusterCache.read_blob(self.buf, ptr, end, blob_index)
+
+    def load_cluster(self, cluster_index):
+        ptr, end = self.read_cluster_range(cluster_index)
+        return self.clusterCache.read_cluster(self.buf, ptr, end)
+
+    def read_bytes(self, offset, size):
+        """Returns a memoryview of size bytes of the map from offset"""
+        return self.buf[offset:offset + size]
+
+    def read_pointer_list(self, pos, count):
+        """Reads count 64 bit pointers starting at pos straight from the map"""
+        ptrs = array('Q')
+        ptrs.frombytes(self.buf[pos:pos + 8 * count])
+        if sys.byteorder == 'big':
+            ptrs.byteswap()
+        return ptrs
+
+    def read_namespace(self, index):
+        """Reads only the namespace of the directory entry at index"""
+        ptr = self.read_url_pointer(index) + 3
+        return self.mm[ptr:ptr + 1]
+
+    def read_entry_strings(self, offset, size=None):
+        """Decodes the namespace, url and title of the directory entry at
+        offset as bytes, straight from the map"""
+        strings = unpack_entry_strings(self.mm, offset)
+        if strings is None:
+            raise IOError("Truncated directory entry at %s" % offset)
+        return strings
+
+    def read_directory_entries(self, start=0, stop=None, block_size=None):
+        """Returns the directory entries at indexes start to stop (the end by
+        default) as DirectoryEntry objects, decoded straight from the map"""
+        if stop is None:
+            stop = self.header['articleCount']
+        ptrs = self.read_pointer_list(self.header['urlPtrPos'] + 8 * start, max(stop - start, 0))
+        entries = []
+        decoded = unpack_entries(self.mm, ptrs, 0, 0, start, entries)
+        if decoded < len(ptrs):
+            raise IOError("Truncated directory entry at %s" % ptrs[decoded])
+        return entries
+
+    def load_directory(self, namespace=None, block_size=None):
+        """Decodes every directory entry, or only those in namespace, into a
+        Directory straight from the map"""
+        ptrs, indexes = self.directory_pointers(namespace)
+        directory = Directory(self.mimeTypeList)
+        if namespace is not None:
+            directory.indexes = indexes
+        unpack_directory_entries(self.mm, ptrs, 0, 0, directory)
+        return directory
+
+
+class SplitMmapZimFile(MmapZimFile):
+    """MmapZimFile of an archive split into chunks (see split_parts), each
+    mapped on its own. Clusters and blobs are views of the maps as with
+    MmapZimFile, but the pointer tables and directory entries, which may
+    straddle two chunks, are read with positional reads as ZimFile does."""
+    reads_split = True
+
+    read_directory_entry = ZimFile.read_directory_entry
+    read_url_pointer = ZimFile.read_url_pointer
+    read_title_pointer = ZimFile.read_title_pointer
+    read_cluster_pointer = ZimFile.read_cluster_pointer
+    read_pointer_list = ZimFile.read_pointer_list
+    read_namespace = ZimFile.read_namespace
+    read_entry_strings = ZimFile.read_entry_strings
+    read_directory_entries = ZimFile.read_directory_entries
+    load_directory = ZimFile.load_directory
+
+
+def open_zim(filename, use_mmap=False, **kwargs):
+    """Opens a ZIM archive with the plain file reader or the mmap reader.
+    Other keyword arguments go to the reader (cache_bytes, cache_policy...).
+    filename may also name an archive split into chunks (see split_parts), or
+    be an http(s) url to read with Range requests (see zim.remote)."""
+    if use_mmap and is_url(filename):
+        logger.warning("Cannot memory-map %s; reading it over HTTP instead" % filename)
+    elif use_mmap:
+        if len(split_parts(filename)) > 1:
+            return SplitMmapZimFile(filename, **kwargs)
+        return MmapZimFile(filename, **kwargs)
+    return ZimFile(filename, **kwargs)